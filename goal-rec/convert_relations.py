@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+This script converts relations from DecompressedFile (one line per frame) to CompressedFile
+(one line per interval of frames) and back, reading and writing line by line:
+
+    0\tperson\tholding\tshell-egg         1-1 person moving shell-egg
+    1\tperson\tholding\tshell-egg   <=>   0-2 person holding shell-egg
+    1\tperson\tmoving\tshell-egg
+    2\tperson\tholding\tshell-egg
+
+Compression keeps only the intervals of relations that are still open, thus files larger
+than the memory are converted in a single pass. Each interval is written as soon as it is
+closed, so intervals are sorted by (end, start, subject, relation, object). Decompression
+accepts intervals in any order: chunks of intervals are sorted by start frame and saved in
+temporary files that are merged while only the relations that hold in the current frame
+are kept in memory and written sorted by (frame, subject, relation, object). The path of
+the 5th column of DecompressedFile is kept in the header `Path:` of CompressedFile.
+
+Convert a folder of files in parallel:
+
+    $ python convert_relations.py relations/ -m compress -o relations_compressed/
+"""
+import os
+import sys
+import time
+import heapq
+import tempfile
+import argparse
+from multiprocessing import Pool
+from os.path import join, dirname, relpath, splitext, isdir, getsize, exists
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+import filehandler as fh
+
+
+def compress(fileinput, output):
+    """ Convert a DecompressedFile sorted by frame into a CompressedFile.
+
+    Parameters:
+    -----------
+    fileinput: string
+        path to the DecompressedFile
+    output: string
+        path to the CompressedFile
+
+    Returns:
+    --------
+    (number of lines, number of intervals)
+    """
+    opened = {}  # triplet: [start, last]
+    nb_lines, nb_intervals = 0, 0
+    last_frame = None
+    with fh.DecompressedFile(fileinput) as fin, open(output, 'w') as fout:
+
+        def write(intervals):
+            """ Write closed intervals (start, last, triplet) sorted by end frame """
+            for start, last, triplet in sorted(intervals, key=lambda x: (x[1], x[0], x[2])):
+                fout.write('{}-{} {} {} {}\n'.format(start, last, *triplet))
+            return len(intervals)
+
+        for arr in fin:
+            idf, triplet = arr[0], tuple(arr[1:4])
+            if nb_lines == 0 and len(arr) == 5:
+                fout.write('Path: {}\n'.format(arr[4]))
+            nb_lines += 1
+            if last_frame is not None and idf < last_frame:
+                logger.error('Frames of {} are not sorted [LINE: {}]'.format(fileinput, fin.nb_line))
+                sys.exit()
+            if last_frame is not None and idf != last_frame:
+                # relations that do not hold in the previous frame are closed
+                closed = [key for key, (_, last) in opened.items() if last < idf-1]
+                nb_intervals += write([opened.pop(key)+[key] for key in closed])
+            last_frame = idf
+            interval = opened.get(triplet)
+            if interval is None:
+                opened[triplet] = [idf, idf]
+            else:
+                interval[1] = idf
+        nb_intervals += write([interval+[key] for key, interval in opened.items()])
+    return nb_lines, nb_intervals
+
+
+def save_run(intervals):
+    """ Save intervals (start, end, triplet) sorted by start in a temporary file """
+    fd, path = tempfile.mkstemp(suffix='.run')
+    with os.fdopen(fd, 'w') as fout:
+        for start, end, triplet in sorted(intervals):
+            fout.write('{} {} {} {} {}\n'.format(start, end, *triplet))
+    return path
+
+
+def read_run(path):
+    """ Yield the intervals (start, end, triplet) of a temporary file of `save_run` """
+    with open(path) as fin:
+        for line in fin:
+            arr = line.split()
+            yield int(arr[0]), int(arr[1]), tuple(arr[2:])
+
+
+def sorted_intervals(fin, runs, chunk_size):
+    """ Yield the intervals (start, end, triplet) of a CompressedFile sorted by start frame.
+        Chunks of `chunk_size` intervals are sorted and saved in temporary files (added to
+        `runs`), which are merged keeping a single interval of each file in memory.
+    """
+    chunk = []
+    for arr in fin:
+        chunk.append((arr[0], arr[1], tuple(arr[2:])))
+        if len(chunk) == chunk_size:
+            runs.append(save_run(chunk))
+            chunk = []
+    if not runs:
+        for interval in sorted(chunk):
+            yield interval
+        return
+    if chunk:
+        runs.append(save_run(chunk))
+    for interval in heapq.merge(*[read_run(path) for path in runs]):
+        yield interval
+
+
+def decompress(fileinput, output, chunk_size=1 << 20):
+    """ Convert a CompressedFile with intervals in any order into a DecompressedFile.
+
+    Parameters:
+    -----------
+    fileinput: string
+        path to the CompressedFile
+    output: string
+        path to the DecompressedFile
+    chunk_size: int
+        maximum number of intervals sorted in memory (see `sorted_intervals`)
+
+    Returns:
+    --------
+    (number of intervals, number of lines)
+    """
+    nb_intervals, nb_lines = 0, 0
+    runs = []
+    try:
+        with fh.CompressedFile(fileinput) as fin, open(output, 'w') as fout:
+            intervals = sorted_intervals(fin, runs, chunk_size)
+            active = {}  # triplet: end
+            following = next(intervals, None)
+            frame = following[0] if following else 0
+            path = '\t{}'.format(fin.path) if fin.path else ''
+            while following or active:
+                if not active and following[0] > frame:
+                    frame = following[0]
+                while following and following[0] <= frame:
+                    start, end, triplet = following
+                    active[triplet] = max(end, active.get(triplet, end))
+                    nb_intervals += 1
+                    following = next(intervals, None)
+                for triplet in sorted(active):
+                    fout.write('{}\t{}\t{}\t{}{}\n'.format(frame, triplet[0], triplet[1], triplet[2], path))
+                    nb_lines += 1
+                    if active[triplet] == frame:
+                        del active[triplet]
+                frame += 1
+    finally:
+        for run in runs:
+            os.remove(run)
+    return nb_intervals, nb_lines
+
+
+def convert_file(args):
+    """ Convert a single file with arguments (mode, fileinput, output) """
+    mode, fileinput, output = args
+    if dirname(output) and not exists(dirname(output)):
+        try:
+            os.makedirs(dirname(output))
+        except OSError:
+            pass
+    if mode == 'compress':
+        nb_lines, nb_intervals = compress(fileinput, output)
+    else:
+        nb_intervals, nb_lines = decompress(fileinput, output)
+    return fileinput, nb_lines, nb_intervals, getsize(fileinput), getsize(output)
+
+
+def convert_relations(inputfile, output=None, mode='compress', processes=None):
+    """
+    Convert a file or a folder of files between DecompressedFile and CompressedFile.
+    """
+    suffix = '_compressed' if mode == 'compress' else '_decompressed'
+    if isdir(inputfile):
+        inputfile = inputfile.rstrip('/')
+        output = output or inputfile+suffix
+        jobs = [(mode, path, join(output, relpath(path, inputfile))) for path in fh.FolderHandler(inputfile)]
+    else:
+        output = output or splitext(inputfile)[0]+suffix+'.txt'
+        jobs = [(mode, inputfile, output)]
+
+    start = time.time()
+    pool = None
+    if processes != 1 and len(jobs) > 1:
+        pool = Pool(processes)
+        results = pool.imap_unordered(convert_file, jobs)
+    else:
+        results = map(convert_file, jobs)
+    nb_lines, nb_intervals, size_in, size_out = 0, 0, 0, 0
+    for fname, lines, intervals, bytes_in, bytes_out in results:
+        nb_lines += lines
+        nb_intervals += intervals
+        size_in += bytes_in
+        size_out += bytes_out
+    if pool:
+        pool.close()
+        pool.join()
+    logger.info('Converted {} files: {} lines <=> {} intervals in {:.2f}s'.format(len(jobs), nb_lines, nb_intervals, time.time()-start))
+    logger.info('Size: {} bytes -> {} bytes ({:.1f}x)'.format(size_in, size_out, size_in / float(max(size_out, 1))))
+    logger.info('Saved relations in: {}'.format(output))
+    return output
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', metavar='relations_file', help='File (or folder of files) containing relations.')
+    parser.add_argument('-o', '--output', help='Path to the file (or folder) to save the relations', default=None)
+    parser.add_argument('-m', '--mode', help='Convert from Decompressed to Compressed or back', choices=['compress', 'decompress'], default='compress')
+    parser.add_argument('-p', '--processes', help='Number of processes', type=int, default=None)
+    args = parser.parse_args()
+
+    convert_relations(args.input, args.output, args.mode, args.processes)
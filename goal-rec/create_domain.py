@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+This script reads a folder containing files with relations and induces the actions of a
+PDDL domain from the transitions between consecutive states of each file. A transition
+from state S to state S' generates an action whose preconditions are the relations that
+disappear (S - S') and whose effects are the relations that appear (S' - S) as well as
+the negation of the preconditions. Objects are lifted to parameters, e.g.:
+
+(:action holding-person-knife
+  :parameters (?person ?knife ?cutting_board)
+  :precondition (and (person ?person) (knife ?knife) (cutting_board ?cutting_board) (on ?knife ?cutting_board))
+  :effect (and (holding ?person ?knife) (not (on ?knife ?cutting_board)))
+)
+
+Files are processed in parallel (map) and candidate actions are deduplicated by a canonical
+hash before being merged into a single `PDDLFile` (reduce). Workers return only the unique
+candidates of each file, thus the memory is bounded by the number of distinct actions.
+"""
+import sys
+import argparse
+import hashlib
+from multiprocessing import Pool
+from os.path import join, dirname, isfile, isdir
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+import filehandler as fh
+from create_template import check_group
+
+
+def lift_atom(atom):
+    """ Convert a relation into a lifted PDDL atom.
+
+    Example:
+    --------
+    >>> lift_atom(('knife', 'on', 'cutting_board'))
+        "(on ?knife ?cutting_board)"
+    >>> lift_atom(('shell_egg', 'egg'))
+        "(shell_egg ?egg)"
+    """
+    if len(atom) == 2:
+        return '({} ?{})'.format(atom[0], atom[1])
+    return '({} ?{} ?{})'.format(atom[1], atom[0], atom[2])
+
+
+def atom_name(atom):
+    """ Return the name of a relation as `on-knife-cutting_board` """
+    if len(atom) == 2:
+        return '-'.join(atom)
+    return '{}-{}-{}'.format(atom[1], atom[0], atom[2])
+
+
+def predicate_of(atom):
+    """ Return the predicate definition of a relation as `(on ?a ?b)` """
+    if len(atom) == 2:
+        return '({} ?a)'.format(atom[0])
+    return '({} ?a ?b)'.format(atom[1])
+
+
+def objects_of(atoms):
+    """ Return the sorted objects that appear in a set of relations """
+    objs = set()
+    for atom in atoms:
+        objs.add(atom[-1])
+        if len(atom) == 3:
+            objs.add(atom[0])
+    return sorted(objs)
+
+
+def create_action(before, after, groups):
+    """ Create the action corresponding to the transition between two states.
+
+    Parameters:
+    -----------
+    before: set
+        relations of the state before the transition
+    after: set
+        relations of the state after the transition
+    groups: dict
+        dictionary containing the name of the group as key and its components as value
+
+    Returns:
+    --------
+    (key, action_name, description, types) where `key` is the canonical hash of the action
+    and `types` are the objects whose type atoms (e.g. `(knife ?knife)`) are preconditions
+    """
+    pre = sorted(before - after)
+    add = sorted(after - before)
+    objs = objects_of(pre + add)
+    action_name = atom_name(add[0]) if add else 'not-'+atom_name(pre[0])
+
+    types = [obj for obj in objs if obj not in groups]
+    preconditions = ['({} ?{})'.format(obj, obj) for obj in types] + [lift_atom(atom) for atom in pre]
+    effects = [lift_atom(atom) for atom in add] + ['(not {})'.format(lift_atom(atom)) for atom in pre]
+
+    description = '  :parameters ({})\n'.format(' '.join('?'+obj for obj in objs))
+    description += '  :precondition (and {})\n'.format(' '.join(preconditions))
+    description += '  :effect (and {})\n'.format(' '.join(effects))
+    key = hashlib.sha1('{}\n{}'.format(action_name, description).encode('utf-8')).hexdigest()
+    return key, action_name, description, types
+
+
+def extract_transitions(args):
+    """ Map step: extract the unique candidate actions of a single file.
+
+    Parameters:
+    -----------
+    args: tuple
+        (fileinput, groups), where `fileinput` is the path to the DecompressedFile
+        and `groups` is the dictionary of groups from `pddl.ini`
+
+    Returns:
+    --------
+    (fileinput, actions, predicates) where `actions` is a list of (key, name, description, types)
+    """
+    fileinput, groups = args
+    actions = {}
+    predicates = set()
+    last_state = None
+    fd = fh.DecompressedFile(fileinput)
+    for _, relations in fd.iterate_frames():
+        state = set(check_group(groups, list(relations)))
+        if last_state is not None and state != last_state:
+            key, action_name, description, types = create_action(last_state, state, groups)
+            actions[key] = (action_name, description, types)
+        for atom in state:
+            predicates.add(predicate_of(atom))
+        last_state = state
+    fd.fin.close()
+    return fileinput, [(key,)+actions[key] for key in sorted(actions)], sorted(predicates)
+
+
+def induce_domain(inputs, output, initfile='pddl.ini', domain='kscgr', minor=False, processes=None):
+    """ Induce a PDDL domain from a list of files containing relations.
+
+    Parameters:
+    -----------
+    inputs: array
+        list of paths to DecompressedFile containing relations
+    output: string
+        path to the file where the domain is saved
+    initfile: string
+        path to the `pddl.ini` file containing groups
+    domain: string
+        name of the domain
+    minor: boolean
+        keep a single action per name with the minor number of preconditions
+    processes: int
+        number of processes (default: number of cpus)
+    """
+    groups = fh.load_pddlinit(initfile).groups
+    pddl = fh.PDDLFile()
+    pddl.set_domain(domain)
+    pddl.add_requirements(':strips')
+    seen = set()
+    pool = Pool(processes)
+    try:
+        jobs = ((fileinput, groups) for fileinput in inputs)
+        for fileinput, actions, predicates in pool.imap(extract_transitions, jobs):
+            logger.info('Merging {} candidate actions from file: {}'.format(len(actions), fileinput))
+            for predicate in predicates:
+                pddl.add_predicates(predicate)
+            for key, action_name, description, types in actions:
+                for obj in types:
+                    pddl.add_predicates('({} ?a)'.format(obj))
+                if key in seen: continue
+                seen.add(key)
+                pddl.add_action(action_name, description, minor=minor)
+    finally:
+        pool.close()
+        pool.join()
+    logger.info('Induced {} actions from {} unique transitions.'.format(len(pddl.actions), len(seen)))
+    logger.info('Saving domain in: {}'.format(output))
+    pddl.save_file(output)
+    return pddl
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', metavar='input_folder', help='Folder or file containing Decompressed relations.')
+    parser.add_argument('-o', '--output', help='Path to the domain file', default=None)
+    parser.add_argument('-i', '--initfile', metavar='pddl_ini', help='pddl.ini file with configuration', default='pddl.ini')
+    parser.add_argument('-d', '--domain', help='Name of the domain', default='kscgr')
+    parser.add_argument('-m', '--minor', help='Keep the action with minor preconditions for the same name', action='store_true')
+    parser.add_argument('-p', '--processes', help='Number of processes', type=int, default=None)
+    args = parser.parse_args()
+
+    if isfile(args.input):
+        inputs = [args.input]
+        output = args.output or join(dirname(args.input), 'domain.pddl')
+    elif isdir(args.input):
+        inputs = list(fh.FolderHandler(args.input))
+        output = args.output or join(args.input, 'domain.pddl')
+    else:
+        logger.error('{} is not a valid file or folder'.format(args.input))
+        sys.exit()
+    induce_domain(inputs, output, args.initfile, args.domain, args.minor, args.processes)
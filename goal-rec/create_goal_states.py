@@ -12,15 +12,25 @@ for each recipe. A recipe must have in common the filename as:
 The goal state is created using the relations in the last frame of the recipe from a 
 decompressed file. When the same object appears in two different places in the last 
 frame for the same recipe, the relation is discarded and not included in the goal state.
+Each line of the output file contains the goal state of a recipe sorted by name, and the
+names of the recipes are saved in the same order in a file with extension `.names`
+(e.g. `goal_states.names`).
+
+With `--support`, a relation is kept when it appears in the last frame of at least that
+fraction of the files of the recipe, instead of requiring all of them. Recipes are learned
+in parallel, counting the occurrences of each relation in an array of interned ids.
 """
 import sys
 import os
 import argparse
+from multiprocessing import Pool
 from os.path import join, dirname, splitext, basename, isfile, isdir
 import logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 
+import numpy as np
+
 import filehandler as fh
 
 
@@ -83,6 +93,9 @@ def save_goal(relations, fname):
     if type(relations) == dict:
         for recipe in sorted(relations):
             content += convert_relations_string(relations[recipe])+'\n'
+        with open(splitext(fname)[0]+'.names', 'w') as fout:
+            for recipe in sorted(relations):
+                fout.write('{}\n'.format(recipe))
     else:
         content = convert_relations_string(relations)
     
@@ -164,6 +177,83 @@ def add_relations(dic, key, values):
     dic[key] = rel
 
 
+def recipe_name(path):
+    """ Return the name of the recipe from a file named as `<nb_file>-<recipe>.txt` """
+    fname = fh.filename(path, extension=False)
+    return fname.split('-', 1)[-1]
+
+
+def learn_recipe(args):
+    """ Learn the goal state of a single recipe keeping the relations that appear
+        in the last frame of at least `support` of its files.
+
+    Parameters:
+    -----------
+    args: tuple
+        (recipe, files, support), where `files` is the list of DecompressedFile
+        of the recipe and `support` is a value between 0 and 1
+
+    Example:
+    --------
+    >>> learn_recipe(('omelette', ['1-omelette.txt', '2-omelette.txt', '3-omelette.txt'], 0.6))
+        ('omelette', [('egg', 'in', 'bowl'), ('shell_egg', 'egg')])
+    """
+    recipe, files, support = args
+    atoms = {}
+    ids = []
+    for file_input in files:
+        relations = goal_state_from_file(file_input)
+        ids.append(np.unique(np.array([atoms.setdefault(rel, len(atoms)) for rel in relations], dtype=np.int64)))
+    if not atoms:
+        return recipe, []
+    counts = np.bincount(np.concatenate(ids), minlength=len(atoms))
+    # minimum number of files, avoiding rounding errors as 0.28 * 25 = 7.000000000000001
+    min_files = int(np.ceil(support * len(files) - 1e-9))
+    keep = counts >= min_files
+    vocab = sorted(atoms, key=atoms.get)
+    return recipe, [vocab[i] for i in np.flatnonzero(keep)]
+
+
+def learn_goal_states(folder_input, output, support=1.0, processes=None):
+    """ Generate a file containing the goal states for a set of files,
+        keeping the relations with a frequency of at least `support` in
+        the last frame of the files of each recipe. Using `support=1` 
+        has the same result as `generate_goal_states`.
+
+    Parameters:
+    -----------
+    folder_input: string
+        path to the folder containing files with relations
+    output: string
+        path to the file where the goals are saved.
+    support: float
+        minimum fraction of files of the recipe containing the relation, in (0, 1]
+    processes: int
+        number of processes (default: number of cpus)
+    """
+    if not 0 < support <= 1:
+        logger.error('Support must be in (0, 1], received: {}'.format(support))
+        sys.exit()
+    if not output:
+        output = join(folder_input, 'goal_states.dat')
+
+    files = {}
+    for file_input in fh.FolderHandler(folder_input):
+        files.setdefault(recipe_name(file_input), []).append(file_input)
+    logger.info('Learning goal states of {} recipes (support={})'.format(len(files), support))
+
+    pool = Pool(processes)
+    try:
+        jobs = [(recipe, files[recipe], support) for recipe in sorted(files)]
+        drecipes = dict(pool.map(learn_recipe, jobs))
+    finally:
+        pool.close()
+        pool.join()
+
+    logger.info('Saving goal states in: {}'.format(output))
+    save_goal(drecipes, output)
+
+
 def generate_goal_states(folder_input, output):
     """ Generate a file containing the goal states for a set of files
         containing relations between objects. Each recipe has its own
@@ -184,7 +274,7 @@ def generate_goal_states(folder_input, output):
     relfiles = fh.FolderHandler(folder_input)
     for file_input in relfiles:
         logger.info('Reading file: {}'.format(file_input))
-        fname = fh.filename(file_input, extension=False)[2:]
+        fname = recipe_name(file_input)
         relations = goal_state_from_file(file_input)
         add_relations(drecipes, fname, relations)
     
@@ -196,10 +286,14 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('input', metavar='input_folder', help='Plain text file')
     parser.add_argument('-o', '--output', help='Plain text file', default=None)
+    parser.add_argument('-s', '--support', help='Minimum fraction of files of a recipe containing the relation', type=float, default=None)
+    parser.add_argument('-p', '--processes', help='Number of processes', type=int, default=None)
     args = parser.parse_args()
 
     if isfile(args.input):
         goal_state_from_file(args.input, args.output)
+    elif isdir(args.input) and args.support is not None:
+        learn_goal_states(args.input, args.output, args.support, args.processes)
     elif isdir(args.input):
         generate_goal_states(args.input, args.output)
     
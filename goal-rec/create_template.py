@@ -134,10 +134,10 @@ def generate_template(pddlinit, output, problem='pbkitchen', domain='kscgr'):
     if not output:
         output = join(dirname(pddlinit), 'template.pddl')
         
-    finit = fh.PDDLInit(initfile=pddlinit)
+    finit = fh.load_pddlinit(pddlinit)
     groups = finit.groups
     objects = finit.objects
-    relations = finit.init_states
+    relations = list(finit.init_states)
     relations = check_group(groups, relations)
     logger.info('Loaded {} relations.'.format(len(relations)))
     logger.info('Saving goal states in: {}'.format(output))
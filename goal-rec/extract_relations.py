@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+This script extracts spatial relations (`PREPOSITIONS` of `pddl.ini`) between the objects
+detected in each frame of a PredictionFile and saves them as a DecompressedFile, which can be
+used by `run_recognizer.py`. For all pairs (subject, object) of a frame, the geometry of
+their boxes is computed at once:
+
+'containment': fraction of the area of the subject inside the object
+'overlap_x': horizontal overlap divided by the width of the narrower box
+'bottom': position of the bottom of the subject in the object (0=top, 1=bottom)
+'gap': vertical distance from the bottom of the subject to the top of the object
+    divided by the height of the object (negative when boxes intersect)
+'distance': distance between centers divided by the diagonal of the object
+
+A rule is a dictionary with the (min, max) values of each feature, where `None` has no
+limit. Rules are checked in order, thus each pair receives the first preposition whose
+rule is satisfied. Rules are read from the `[RULES]` section of `pddl.ini`, e.g.:
+
+rules=[('in', {'containment': (0.8, None)}),
+       ('on', {'overlap_x': (0.5, None), 'bottom': (0.0, 0.5), 'containment': (None, 0.8)}),
+       ('above', {'overlap_x': (0.5, None), 'gap': (0.0, 1.0)})]
+"""
+import time
+import argparse
+from itertools import groupby
+from os.path import splitext
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+import numpy as np
+
+import filehandler as fh
+
+RULES = [('in', {'containment': (0.8, None)}),
+         ('on', {'overlap_x': (0.5, None), 'bottom': (0.0, 0.5), 'containment': (None, 0.8)}),
+         ('above', {'overlap_x': (0.5, None), 'gap': (0.0, 1.0)})]
+
+
+def pair_features(boxes):
+    """ Compute the geometry of all pairs of boxes.
+
+    Parameters:
+    -----------
+    boxes: array
+        array with shape (n, 4) containing [xmin, ymin, xmax, ymax] of each box
+
+    Returns:
+    --------
+    dictionary with arrays of shape (n, n), where [i, j] is the feature of the
+    subject `i` and the object `j`
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    s, o = boxes[:, np.newaxis, :], boxes[np.newaxis, :, :]
+    width = np.maximum(boxes[:, 2] - boxes[:, 0], 1.)
+    height = np.maximum(boxes[:, 3] - boxes[:, 1], 1.)
+    iw = np.maximum(np.minimum(s[..., 2], o[..., 2]) - np.maximum(s[..., 0], o[..., 0]), 0.)
+    ih = np.maximum(np.minimum(s[..., 3], o[..., 3]) - np.maximum(s[..., 1], o[..., 1]), 0.)
+    cx, cy = (boxes[:, 0] + boxes[:, 2]) / 2., (boxes[:, 1] + boxes[:, 3]) / 2.
+    return {
+        'containment': iw * ih / (width * height)[:, np.newaxis],
+        'overlap_x': iw / np.minimum(width[:, np.newaxis], width[np.newaxis, :]),
+        'bottom': (s[..., 3] - o[..., 1]) / height[np.newaxis, :],
+        'gap': (o[..., 1] - s[..., 3]) / height[np.newaxis, :],
+        'distance': np.hypot(cx[:, np.newaxis] - cx, cy[:, np.newaxis] - cy) / np.hypot(width, height)[np.newaxis, :]
+    }
+
+
+def apply_rules(features, rules):
+    """ Return an array (n, n) with the index of the first rule satisfied by each pair (-1 if none) """
+    n = len(features['containment'])
+    label = np.full((n, n), -1, dtype=np.int64)
+    free = ~np.eye(n, dtype=bool)
+    for i, (_, limits) in enumerate(rules):
+        mask = free.copy()
+        for feature, (vmin, vmax) in limits.items():
+            if vmin is not None:
+                mask &= features[feature] >= vmin
+            if vmax is not None:
+                mask &= features[feature] <= vmax
+        label[mask] = i
+        free &= ~mask
+    return label
+
+
+def frame_relations(classes, boxes, rules):
+    """ Return the sorted relations (subject, preposition, object) of the objects of a frame """
+    features = pair_features(boxes)
+    label = apply_rules(features, rules)
+    subs, objs = np.nonzero(label >= 0)
+    relations = set()
+    for s, o in zip(subs, objs):
+        if classes[s] != classes[o]:
+            relations.add((classes[s], rules[label[s, o]][0], classes[o]))
+    return sorted(relations)
+
+
+def load_rules(initfile='pddl.ini'):
+    """ Return the rules of `pddl.ini` (or the default rules) for its prepositions """
+    pddlinit = fh.load_pddlinit(initfile)
+    rules = pddlinit.rules or RULES
+    prepositions = pddlinit.relations.get('prepositions')
+    if prepositions:
+        rules = [(prep, limits) for prep, limits in rules if prep in prepositions]
+    return rules
+
+
+def extract_relations(fileinput, output=None, class_file='classes.cfg', initfile='pddl.ini', threshold=0.5):
+    """ Extract spatial relations of the detections of a PredictionFile.
+
+    Parameters:
+    -----------
+    fileinput: string
+        path to the PredictionFile containing detections
+    output: string
+        path to the DecompressedFile where relations are saved
+    class_file: string
+        path to the file containing ids and their classes
+    initfile: string
+        path to the `pddl.ini` file containing prepositions and rules
+    threshold: float
+        minimum score of a detection
+    """
+    if not output:
+        output = splitext(fileinput)[0]+'_relations.txt'
+    dcls = fh.ConfigFile(class_file).load_classes()
+    rules = load_rules(initfile)
+    logger.info('Extracting relations: {}'.format(', '.join(prep for prep, _ in rules)))
+
+    start = time.time()
+    nb_frames, nb_relations = 0, 0
+    with fh.PredictionFile(fileinput) as fpred, open(output, 'w') as fout:
+        detections = (arr for arr in fpred if float(arr[6]) >= threshold)
+        for idfr, group in groupby(detections, key=lambda arr: arr[0]):
+            group = list(group)
+            classes = [dcls[arr[5]] for arr in group]
+            boxes = [arr[1:5] for arr in group]
+            for sub, rel, obj in frame_relations(classes, boxes, rules):
+                fout.write('{}\t{}\t{}\t{}\n'.format(idfr, sub, rel, obj))
+                nb_relations += 1
+            nb_frames += 1
+    elapsed = time.time() - start
+    logger.info('Extracted {} relations from {} frames ({:.1f} frames/s)'.format(nb_relations, nb_frames, nb_frames / max(elapsed, 1e-6)))
+    logger.info('Saved relations in file: {}'.format(output))
+    return output
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', metavar='prediction_file', help='File containing detections (Frame;xmin;ymin;xmax;ymax;id_class;score).')
+    parser.add_argument('-o', '--output', help='Path to the file to save the relations', default=None)
+    parser.add_argument('-c', '--class_file', help='File containing ids and their classes', default='classes.cfg')
+    parser.add_argument('-i', '--initfile', metavar='pddl_ini', help='pddl.ini file with configuration', default='pddl.ini')
+    parser.add_argument('-t', '--threshold', help='Minimum score of a detection', type=float, default=0.5)
+    args = parser.parse_args()
+
+    extract_relations(args.input, args.output, args.class_file, args.initfile, args.threshold)
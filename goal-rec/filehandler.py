@@ -7,8 +7,18 @@ logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=lo
 import os
 import sys
 import ast
+import re
+import pickle
+import hashlib
 import lxml.etree as ET
 import configparser as cp
+from string import Template
+from multiprocessing import Pool
+from xml.sax.saxutils import escape
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from os.path import exists, join, splitext, dirname, basename, realpath, isfile
 
@@ -31,6 +41,13 @@ def is_folder(inputfolder):
     return inputfolder
 
 
+def check_numpy():
+    """ Check whether numpy, required by the arrays of predictions and VOC boxes, is installed """
+    if np is None:
+        logger.error('Numpy is required to load arrays, but it is not installed!')
+        sys.exit()
+
+
 def filename(path, extension=True, string=False):
     fname, ext = splitext(basename(path))
     if string:
@@ -61,6 +78,26 @@ def mkdir_from_file(path):
     return dirout
 
 
+CACHE = {}
+
+
+def load_cached(inputfile, function, *args):
+    """ Return the result of `function(*args)` shared by all the calls that read
+        the same ``inputfile``. The result is computed again only when the file
+        is modified, i.e., its size or modification time (in nanoseconds, when
+        available) changes. Callers must not change the returned object.
+    """
+    if not exists(inputfile):
+        return function(*args)
+    inputfile = realpath(inputfile)
+    st = os.stat(inputfile)
+    mtime = getattr(st, 'st_mtime_ns', st.st_mtime)
+    key = (inputfile, mtime, st.st_size, function.__name__) + args
+    if key not in CACHE:
+        CACHE[key] = function(*args)
+    return CACHE[key]
+
+
 class FolderHandler(object):
     """ Class to deal with folders """
     def __init__(self, inputfolder, ext='txt', sort_id=False):
@@ -261,6 +298,10 @@ class CompressedFile(FileHandler):
             1=person, 7=shell-egg, and 17=bowl
         and relations have the ids: 
             1=on, 3=holding, and 4=moving
+
+        Names of objects and relations are separated by spaces:
+
+            0-4 person holding shell-egg
     """
     def __init__(self, inputfile):
         super(CompressedFile, self).__init__(inputfile)
@@ -270,7 +311,10 @@ class CompressedFile(FileHandler):
     def __iter__(self):
         objs = []
         for self.nb_lines, line in enumerate(self.fin):
-            if not line or not line[0].isdigit(): continue
+            if not line or not line[0].isdigit():
+                if 'Path:' in line:
+                    self.path = line.strip().split('Path: ')[-1]
+                continue
             start, end, o1, r, o2 = self.check_line(self.nb_lines, line)
             yield start, end, o1, r, o2
 
@@ -283,15 +327,16 @@ class CompressedFile(FileHandler):
             start, end = int(arr[0]), int(arr[1])
         else:
             frames = arr[0].split('-')
-            if len(frames) != 2: error_line(i, line)
+            if len(frames) != 2 or len(arr) != 4: error_line(i, line)
             start, end = map(int, frames)
-        if start >= end:
+            arr = frames + arr[1:]
+        if start > end:
             logger.error('START frame is greater than END frame: ({} - {}) [LINE: {}]'.format(start, end, i))
             sys.exit()
         if arr[2].isdigit():
             return start, end, int(arr[2]), int(arr[3]), int(arr[4])
         self.cnames = True
-        return start, end, arr[1], arr[2], arr[3]
+        return start, end, arr[2], arr[3], arr[4]
 
     def list_relations(self, as_set=True):
         rels = []
@@ -458,27 +503,31 @@ class ConfigFile(FileHandler):
 
     def load_classes(self, cnames=False, as_set=False):
         """ cnames : class names instead of ids """
-        self.__enter__()
-        self.dcls = {}
-        for line in self.fin:
-            arr = line.strip().split()
-            if cnames:
-                if self.background:
-                    self.dcls[arr[1]] = int(arr[0])
-                elif arr[1] == '__background__': 
-                    continue
-                else:
-                    self.dcls[arr[1]] = int(arr[0])-1
-            else:
-                if self.background:
-                    self.dcls[int(arr[0])] = arr[1]
-                elif arr[1] == '__background__': 
-                    continue
-                else:
-                    self.dcls[int(arr[0])-1] = arr[1]
+        self.dcls = dict(load_cached(self.inputfile, self._read_classes, cnames, self.background))
         if as_set:
             return set(self.dcls.keys())
         return self.dcls
+
+    def _read_classes(self, cnames, background):
+        dcls = {}
+        with self:
+            for line in self.fin:
+                arr = line.strip().split()
+                if cnames:
+                    if background:
+                        dcls[arr[1]] = int(arr[0])
+                    elif arr[1] == '__background__': 
+                        continue
+                    else:
+                        dcls[arr[1]] = int(arr[0])-1
+                else:
+                    if background:
+                        dcls[int(arr[0])] = arr[1]
+                    elif arr[1] == '__background__': 
+                        continue
+                    else:
+                        dcls[int(arr[0])-1] = arr[1]
+        return dcls
 # End of ConfigFile class
 
 
@@ -488,6 +537,8 @@ class PDDLInit(object):
         self.groups = {}
         self.relations = {}
         self.objects = {}
+        self.goals = []
+        self.rules = []
         self.config = cp.ConfigParser()
         self.config.sections()
         self.config.read(initfile)
@@ -495,6 +546,8 @@ class PDDLInit(object):
         self._load_group()
         self._load_relations()
         self._load_objects()
+        self._load_goals()
+        self._load_rules()
 
     def _load_init(self):
         self.init_states = ast.literal_eval(self.config['INIT_STATE']['init'])
@@ -505,6 +558,14 @@ class PDDLInit(object):
     def _load_objects(self):
         self.objects = ast.literal_eval(self.config['OBJECTS']['objects'])
 
+    def _load_goals(self):
+        if 'GOALS' in self.config:
+            self.goals = ast.literal_eval(self.config['GOALS']['goals'])
+
+    def _load_rules(self):
+        if 'RULES' in self.config:
+            self.rules = ast.literal_eval(self.config['RULES']['rules'])
+
     def _load_relations(self):
         for rel in self.config['RELATIONS']:
             relation = self.config['RELATIONS'][rel]
@@ -512,12 +573,18 @@ class PDDLInit(object):
 # End of PDDLInit class
 
 
+def load_pddlinit(initfile='pddl.ini'):
+    """ Return the `PDDLInit` of ``initfile`` shared by all the calls in the process """
+    return load_cached(initfile, PDDLInit, initfile)
+
+
 class PredictionFile(FileHandler):
     """ Prediction file has the form:
 
         Frame;xmin;ymin;xmax;ymax;id_class;score
 
-        where `score' is a value between 0 and 1.
+        where `score' is a value between 0 and 1. Files created by the tracker
+        contain the id of the track in a last column (`id_track`).
     """
     def __init__(self, inputfile):
         super(PredictionFile, self).__init__(inputfile)
@@ -529,14 +596,109 @@ class PredictionFile(FileHandler):
 
     def check_line(self, i, line):
         arr = line.strip().split(';')
-        if len(arr) != 7:
+        if len(arr) != 7 and len(arr) != 8:
             logger.error('Malformed line in input file! [LINE: {}]'.format(i))
             sys.exit()
-        arr[:-1] = map(int, arr[:-1])
+        arr[:6] = map(int, arr[:6])
+        if len(arr) == 8:
+            arr[7] = int(arr[7])
         return arr
+
+    def load_arrays(self, chunk_size=1 << 24):
+        """ Parse all detections into a `PredictionArray`. The file is read in chunks 
+            of about `chunk_size` bytes and each chunk is converted to numbers at once.
+            Files created by the tracker also have the field `id_track`.
+        """
+        check_numpy()
+        self.exist_file()
+        parts = []
+        fields = None
+        with open(self.inputfile) as fin:
+            for lines in iter(lambda: fin.readlines(chunk_size), []):
+                lines = [line for line in lines if line[:1].isdigit()]
+                if not lines: continue
+                if fields is None:
+                    fields = PREDICTION_FIELDS
+                    if lines[0].count(';') == len(PREDICTION_FIELDS):
+                        fields = PREDICTION_FIELDS + [('id_track', np.int64)]
+                parts.append(parse_predictions(lines, fields))
+        data = np.concatenate(parts) if parts else np.zeros(0, dtype=PREDICTION_FIELDS)
+        return PredictionArray(data)
 # End of PredictionFile class
 
 
+if np is not None:
+    PREDICTION_FIELDS = [('frame', np.int64), ('xmin', np.int32), ('ymin', np.int32), ('xmax', np.int32),
+                         ('ymax', np.int32), ('id_class', np.int32), ('score', np.float32)]
+
+
+def parse_predictions(lines, fields, sep=';'):
+    """ Convert lines of a PredictionFile into a structured array with `fields` """
+    values = np.fromstring(''.join(lines).replace(sep, ' '), sep=' ')
+    if len(values) != len(lines) * len(fields):
+        logger.error('Malformed line in input file! [LINE: {}]'.format(lines[0].strip()))
+        sys.exit()
+    values = values.reshape((len(lines), len(fields)))
+    data = np.empty(len(lines), dtype=fields)
+    for i, (name, _) in enumerate(fields):
+        data[name] = values[:, i]
+    return data
+
+
+class PredictionArray(object):
+    """ Detections of a PredictionFile in a structured array sorted by frame, where
+        the rows of the N-th frame are in `offsets[N]:offsets[N+1]`. Rows of a frame
+        are views of the array. E.g.:
+
+            preds = PredictionFile('predictions.txt').load_arrays()
+            for idfr, rows in preds:
+                boxes, scores = rows[['xmin', 'ymin', 'xmax', 'ymax']], rows['score']
+    """
+    def __init__(self, data):
+        if len(data) and np.any(data['frame'][1:] < data['frame'][:-1]):
+            data = data[np.argsort(data['frame'], kind='mergesort')]
+        self.data = data
+        self.offsets = group_offsets(data['frame'])
+        self.frames = data['frame'][self.offsets[:-1]]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.data[self.offsets[index]:self.offsets[index+1]]
+
+    def __iter__(self):
+        for i, idfr in enumerate(self.frames):
+            yield int(idfr), self[i]
+
+    def frame(self, idfr):
+        """ Return the rows of the frame `idfr` (no rows if the frame has no detections) """
+        i = np.searchsorted(self.frames, idfr)
+        if i < len(self.frames) and self.frames[i] == idfr:
+            return self[i]
+        return self.data[:0]
+
+    def boxes(self):
+        """ Return an array (nb_rows, 4) with [xmin, ymin, xmax, ymax] of all rows """
+        return np.column_stack([self.data['xmin'], self.data['ymin'], self.data['xmax'], self.data['ymax']])
+# End of PredictionArray class
+
+
+def group_offsets(frames):
+    """ Return the offsets of the runs of equal values in `frames`
+
+    Example:
+    --------
+    >>> group_offsets(np.array([0, 0, 1, 3, 3, 3]))
+        array([0, 2, 3, 6])
+    """
+    frames = np.asarray(frames)
+    if not len(frames):
+        return np.zeros(1, dtype=np.int64)
+    starts = np.flatnonzero(frames[1:] != frames[:-1]) + 1
+    return np.concatenate([[0], starts, [len(frames)]]).astype(np.int64)
+
+
 class MapFile(FileHandler):
     """ Map_paths file has the form:
 
@@ -574,30 +736,68 @@ class MapFile(FileHandler):
 
 
 class VOCXML(object):
+    """ Objects of a VOC XML file (see `read_voc`) """
     def __init__(self, xml_file):
-        tree = ET.parse(xml_file)
-        self.root = tree.getroot()
+        self.path, self.width, self.height, self.names, self.boxes = read_voc(xml_file)
 
     def image_path(self):
-        for child in self.root:
-            if child.tag == 'path':
-                path = child.text
-        return path
+        return self.path
 
     def extract_objects(self):
-        objs = []
-        for child in self.root:
-            if child.tag == 'object':
-                for obj in child:
-                    if obj.tag == 'name':
-                        name = obj.text
-                    elif obj.tag == 'bndbox':
-                        dpos = {}
-                        for pos in obj:
-                            dpos[pos.tag] = int(pos.text)
-                        objs.append((name, dpos))
-        return objs
-                            
+        keys = ['xmin', 'ymin', 'xmax', 'ymax']
+        return [(name, dict(zip(keys, box))) for name, box in zip(self.names, self.boxes.tolist())]
+# End of VOCXML class
+
+
+VOC_TEMPLATE = Template("""<annotations>
+  <folder>JPEGImages</folder>
+  <filename>$filename</filename>
+  <size>
+    <width>$width</width>
+    <height>$height</height>
+    <depth>3</depth>
+  </size>
+  <segmented>0</segmented>
+$objects</annotations>
+""")
+
+VOC_OBJECT_TEMPLATE = Template("""  <object>
+    <name>$name</name>
+    <pose>Unspecified</pose>
+    <truncated>0</truncated>
+    <difficult>0</difficult>
+    <bndbox>
+      <xmin>$xmin</xmin>
+      <ymin>$ymin</ymin>
+      <xmax>$xmax</xmax>
+      <ymax>$ymax</ymax>
+    </bndbox>
+  </object>
+""")
+
+
+def render_voc(filename, width, height, objects):
+    """ Return the XML of an image containing `objects` [(name, xmin, ymin, xmax, ymax), ...] """
+    xml_objects = ''.join([VOC_OBJECT_TEMPLATE.substitute(name=escape(str(name)), xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax)
+                           for name, xmin, ymin, xmax, ymax in objects])
+    return VOC_TEMPLATE.substitute(filename=escape(filename), width=width, height=height, objects=xml_objects)
+
+
+UTILS_FOLDER = join(dirname(realpath(__file__)), '..', 'object-recognition')
+
+
+def image_size(image_file):
+    """ Return (width, height) of an image reading only its header, with the cache of sizes
+        of `object-recognition/utils.py`. Without its dependencies, the image is opened by PIL.
+    """
+    if UTILS_FOLDER not in sys.path:
+        sys.path.append(UTILS_FOLDER)
+    try:
+        from utils import image_size as header_size
+    except ImportError:
+        from PIL import Image
+        return Image.open(image_file).size
+    return header_size(image_file)
 
 
 class VOCFile(object):
@@ -606,20 +806,8 @@ class VOCFile(object):
         self.width = width
         self.height = height
         if not width or not height:
-            im = Image.open(image_file)
-            self.width, self.height = im.size
-        self._create_header()
-
-    def _create_header(self):
-        """ Create XML with information of the image """
-        self.xml = ET.Element('annotations')
-        ET.SubElement(self.xml, 'folder').text = 'JPEGImages'
-        ET.SubElement(self.xml, 'filename').text = self.filename    
-        imsize = ET.SubElement(self.xml, 'size')
-        ET.SubElement(imsize, 'width').text = str(self.width)
-        ET.SubElement(imsize, 'height').text = str(self.height)
-        ET.SubElement(imsize, 'depth').text = '3'
-        ET.SubElement(self.xml, 'segmented').text = '0' 
+            self.width, self.height = image_size(image_file)
+        self.objects = []
 
     def add_object(self, name, x, y, w, h):
         """ Add the annotation for an object """
@@ -634,30 +822,110 @@ class VOCFile(object):
         ymin = y
         xmax = x + w
         ymax = y + h 
-        if xmax > 256:
-            xmax = 256
-        if ymax > 256:
-            ymax = 256
-
-        obj = ET.SubElement(self.xml, "object")
-        ET.SubElement(obj, "name").text = name
-        ET.SubElement(obj, "pose").text = "Unspecified"
-        ET.SubElement(obj, "truncated").text = '0'
-        ET.SubElement(obj, "difficult").text = '0'
-        bbox = ET.SubElement(obj, "bndbox")
-        ET.SubElement(bbox, "xmin").text = str(xmin)
-        ET.SubElement(bbox, "ymin").text = str(ymin)
-        ET.SubElement(bbox, "xmax").text = str(xmax)
-        ET.SubElement(bbox, "ymax").text = str(ymax)
+        if xmax > self.width:
+            xmax = self.width
+        if ymax > self.height:
+            ymax = self.height
+        self.objects.append((name, xmin, ymin, xmax, ymax))
+
+    def to_xml(self):
+        """ Return the XML corresponding to the image """
+        return render_voc(self.filename, self.width, self.height, self.objects)
     
     def save_xml(self, folderout):
         """ Save the XML corresponding to an image in folderout """
         fname, _ = splitext(self.filename)
         fileout = join(folderout, fname+'.xml')
-        tree = ET.ElementTree(self.xml)
-        tree.write(fileout, pretty_print=True)
+        with open(fileout, 'w') as fout:
+            fout.write(self.to_xml())
 # End of VOCFile class
 
+
+def _write_voc_chunk(args):
+    """ Write the XML files of a chunk of images (see `write_voc_files`) """
+    folderout, images = args
+    for filename, width, height, objects in images:
+        fname, _ = splitext(basename(filename))
+        with open(join(folderout, fname+'.xml'), 'w') as fout:
+            fout.write(render_voc(basename(filename), width, height, objects))
+    return len(images)
+
+
+def write_voc_files(images, folderout, processes=None, chunk_size=500):
+    """ Write an XML file for each image in `folderout` using a pool of processes.
+
+    Parameters:
+    -----------
+    images: array
+        list of (filename, width, height, objects), where `objects` is a list of
+        (name, xmin, ymin, xmax, ymax)
+    folderout: string
+        path to the folder where XML files are saved
+    processes: int
+        number of processes (default: number of cpus)
+    chunk_size: int
+        number of images written by each task
+    """
+    if not exists(folderout):
+        os.makedirs(folderout)
+    jobs = [(folderout, images[i:i+chunk_size]) for i in range(0, len(images), chunk_size)]
+    if processes != 1 and len(jobs) > 1:
+        pool = Pool(processes)
+        nb_files = sum(pool.imap_unordered(_write_voc_chunk, jobs))
+        pool.close()
+        pool.join()
+    else:
+        nb_files = sum(map(_write_voc_chunk, jobs))
+    return nb_files
+
+
+def read_voc(xml_file):
+    """ Read a VOC XML file incrementally.
+
+    Returns:
+    --------
+    (path, width, height, names, boxes), where `path` is the path (or filename) of
+    the image and `boxes` is an array (nb_objects, 4) with [xmin, ymin, xmax, ymax]
+    """
+    check_numpy()
+    filename, path, width, height = '', '', 0, 0
+    names, boxes = [], []
+    for _, elem in ET.iterparse(xml_file):
+        if elem.tag == 'filename':
+            filename = elem.text
+        elif elem.tag == 'path':
+            path = elem.text
+        elif elem.tag == 'size':
+            width, height = int(elem.findtext('width')), int(elem.findtext('height'))
+        elif elem.tag == 'object':
+            names.append(elem.findtext('name'))
+            boxes.append([int(float(elem.findtext('bndbox/'+key))) for key in ['xmin', 'ymin', 'xmax', 'ymax']])
+            elem.clear()
+    return path or filename, width, height, names, np.array(boxes, dtype=np.int64).reshape((-1, 4))
+
+
+def _read_voc_chunk(files):
+    """ Read a chunk of XML files (see `read_voc_files`) """
+    return [read_voc(xml_file) for xml_file in files]
+
+
+def read_voc_files(files, processes=None, chunk_size=500):
+    """ Read a list of VOC XML files using a pool of processes, returning the list
+        of (path, width, height, names, boxes) of each file (see `read_voc`)
+    """
+    jobs = [files[i:i+chunk_size] for i in range(0, len(files), chunk_size)]
+    images = []
+    if processes != 1 and len(jobs) > 1:
+        pool = Pool(processes)
+        for chunk in pool.imap(_read_voc_chunk, jobs):
+            images.extend(chunk)
+        pool.close()
+        pool.join()
+    else:
+        for chunk in map(_read_voc_chunk, jobs):
+            images.extend(chunk)
+    return images
+
 class PathFile(FileHandler):
     """ Path file has the form:
         Frame path <SPACE> [Class]
@@ -687,67 +955,167 @@ class PathFile(FileHandler):
             yield arr
 # End of PathFile class
 
+
+PDDL_CACHE = '.pddl_cache'
+PDDL_CACHE_VERSION = 1
+PDDL_TOKENS = re.compile(r';[^\n]*|[()]|[^\s();]+')
+
+
+class SExpr(list):
+    """ List of tokens and nested expressions of a PDDL file. The attributes
+        `start` and `end` keep the position of the parentheses in the text.
+    """
+    start = -1
+    end = -1
+
+
+def parse_sexpr(text):
+    """ Parse a PDDL text into a list of `SExpr` in a single pass.
+
+    Parameters:
+    -----------
+    text: string
+        content of a PDDL file
+
+    Example:
+    --------
+    >>> parse_sexpr('(define (domain kscgr))')
+        [['define', ['domain', 'kscgr']]]
+    """
+    stack = [SExpr()]
+    for match in PDDL_TOKENS.finditer(text):
+        token = match.group()
+        if token[0] == ';':
+            continue
+        if token == '(':
+            node = SExpr()
+            node.start = match.start()
+            stack[-1].append(node)
+            stack.append(node)
+        elif token == ')':
+            if len(stack) == 1:
+                logger.error('Unbalanced parenthesis in PDDL! [POSITION: {}]'.format(match.start()))
+                sys.exit()
+            stack.pop().end = match.end()
+        else:
+            stack[-1].append(token)
+    if len(stack) > 1:
+        logger.error('Unbalanced parenthesis in PDDL! [POSITION: {}]'.format(stack[-1].start))
+        sys.exit()
+    return stack[0]
+
+
+def load_compiled(inputfile, compile_function):
+    """ Load the compiled form of `inputfile` from the cache folder. The cache
+        is keyed by the hash of the content of the file, thus a file is only
+        compiled again when its content changes.
+
+    Parameters:
+    -----------
+    inputfile: string
+        path to the PDDL file
+    compile_function: function
+        function receiving the content of the file and returning a picklable object
+    """
+    with open(inputfile, 'rb') as fin:
+        content = fin.read()
+    key = hashlib.sha1(content).hexdigest()
+    fcache = join(dirname(realpath(inputfile)), PDDL_CACHE, '{}-{}.pkl'.format(key, PDDL_CACHE_VERSION))
+    if exists(fcache):
+        try:
+            with open(fcache, 'rb') as fin:
+                return pickle.load(fin)
+        except (EOFError, pickle.UnpicklingError):
+            logger.warning('Ignoring corrupted cache file: {}'.format(fcache))
+    compiled = compile_function(content.decode('utf-8'))
+    try:
+        if not exists(dirname(fcache)):
+            os.makedirs(dirname(fcache))
+        ftmp = '{}.{}'.format(fcache, os.getpid())
+        with open(ftmp, 'wb') as fout:
+            pickle.dump(compiled, fout, pickle.HIGHEST_PROTOCOL)
+        os.rename(ftmp, fcache)
+    except OSError:
+        logger.warning('Could not save cache file: {}'.format(fcache))
+    return compiled
+
+
 class PddlTypes(object):
     def __init__(self, inputfile):
-        self.dic = {}
-        with open(inputfile) as fin:
-            for line in fin:
-                line = line.strip()
-                if not (line.startswith('(') or line.startswith(')')):
-                    arr = line.split(' - ')
-                    objs, label, var = arr
-                    label = label.replace('_', '-')
-                    for obj in objs.split():
-                        obj = obj.replace('_', '-')
-                        self.dic[obj] = (label, var)
+        self.dic = load_compiled(inputfile, self._compile)
+
+    @staticmethod
+    def _compile(text):
+        dic = {}
+        for line in text.splitlines():
+            line = line.strip()
+            if not (line.startswith('(') or line.startswith(')')):
+                arr = line.split(' - ')
+                objs, label, var = arr
+                label = label.replace('_', '-')
+                for obj in objs.split():
+                    obj = obj.replace('_', '-')
+                    dic[obj] = (label, var)
+        return dic
 
     def __getitem__(self, obj):
         return self.dic[obj]
 # End of PddlTypes class
 
 
-from string import Template
 class PDDLFile(object):
+    """ Domain of a PDDL file indexed by predicates and actions. 
+
+        `predicate_index` maps each predicate to its position in `predicates` and 
+        `action_index` maps each (base name, description) to the name of the 
+        action, avoiding to scan all actions when adding new ones. Indexed names
+        of actions (`key-0`, `key-1`, ...) are created from a counter per base name.
+    """
     def __init__(self, inputfile=None):
         self.domain = ''
         self.requirements = []
         self.predicates = []
         self.actions = {}
+        self.predicate_index = {}
+        self.action_index = {}
+        self.counters = {}
         if inputfile:
             self.inputfile = inputfile
             self._loadfile()
 
     def _loadfile(self):
-        record_predicates = False
-        record_action = False
-        with open(self.inputfile) as fin:
-            for line in fin:
-                line = line.rstrip()
-                if record_predicates:
-                    if line == ')':
-                        record_predicates = False
-                    else:
-                        self.predicates.append(line.strip())
-
-                if record_action:
-                    if line == ')':
-                        self.actions[action_name] = description
-                        description = ''
-                        action_name = ''
-                        record_action = False
-                    else:
-                        description += line+'\n'
-
-                if '(domain' in line:
-                    self.domain = line.split('(domain ')[1].replace(')','')
-                elif '(:requirements' in line:
-                    self.requirements = line.replace(')', '').split()[1:]
-                elif '(:predicates' in line:
-                    record_predicates = True
-                elif '(:action' in line:
-                    record_action = True
-                    action_name = line.split('action ')[1]
-                    description = ''
+        domain, requirements, predicates, actions = load_compiled(self.inputfile, self._compile)
+        self.set_domain(domain)
+        for requirement in requirements:
+            self.add_requirements(requirement)
+        for predicate in predicates:
+            self.add_predicates(predicate)
+        for action_name, description in actions:
+            self._set_action(action_name, description)
+
+    @staticmethod
+    def _compile(text):
+        """ Compile the content of a domain into (domain, requirements, predicates, actions) """
+        domain = ''
+        requirements, predicates, actions = [], [], []
+        for define in parse_sexpr(text):
+            if not define or define[0] != 'define':
+                continue
+            for element in define[1:]:
+                if not isinstance(element, SExpr) or not element:
+                    continue
+                if element[0] == 'domain':
+                    domain = element[1]
+                elif element[0] == ':requirements':
+                    requirements = list(element[1:])
+                elif element[0] == ':predicates':
+                    for predicate in element[1:]:
+                        predicates.append(text[predicate.start:predicate.end])
+                elif element[0] == ':action':
+                    # description starts in the line after `(:action name`
+                    _, _, description = text[element.start:element.end-1].partition('\n')
+                    actions.append((element[1], description))
+        return domain, requirements, predicates, actions
 
     def set_domain(self, domain):
         self.domain = domain
@@ -757,16 +1125,34 @@ class PDDLFile(object):
             self.requirements.append(requirement)
 
     def add_predicates(self, predicate):
-        if not predicate in self.predicates:
+        if not predicate in self.predicate_index:
+            self.predicate_index[predicate] = len(self.predicates)
             self.predicates.append(predicate)
 
+    def _base_name(self, action_name):
+        """ Return the base name and index of an indexed action as `key-index` """
+        base, _, index = action_name.rpartition('-')
+        if base and index.isdigit():
+            return base, int(index)
+        return action_name, -1
+
+    def _set_action(self, action_name, description):
+        base, index = self._base_name(action_name)
+        if action_name in self.actions:
+            key = (base, self.actions[action_name])
+            if self.action_index.get(key) == action_name:
+                del self.action_index[key]
+        if index >= self.counters.get(base, 0):
+            self.counters[base] = index + 1
+        self.action_index.setdefault((base, description), action_name)
+        self.actions[action_name] = description
+
     def _add_index(self, key):
-        index = 0
-        has_index = True
-        while True:
-            if not key+'-'+str(index) in self.actions:
-                return key+'-'+str(index)
+        index = self.counters.get(key, 0)
+        while key+'-'+str(index) in self.actions:
             index += 1
+        self.counters[key] = index + 1
+        return key+'-'+str(index)
 
     def _minor_precondition(self, action_name, description):
         line_prec1 = self.actions[action_name].split('\n')[1]
@@ -778,12 +1164,30 @@ class PDDLFile(object):
         return description
                     
     def add_action(self, action_name, description, minor=False):
+        """ Add an action to the domain, returning the name used to store it.
+            An action whose description is already stored for the same 
+            base name is not duplicated.
+        """
         if action_name in self.actions and description != self.actions[action_name]:
             if minor:
                 description = self._minor_precondition(action_name, description)
             else:
+                if (action_name, description) in self.action_index:
+                    return self.action_index[(action_name, description)]
                 action_name = self._add_index(action_name)
-        self.actions[action_name] = description
+        self._set_action(action_name, description)
+        return action_name
+
+    def merge(self, pddl, minor=False):
+        """ Add requirements, predicates and actions of another `PDDLFile` """
+        for requirement in pddl.requirements:
+            self.add_requirements(requirement)
+        for predicate in pddl.predicates:
+            self.add_predicates(predicate)
+        for action_name in sorted(pddl.actions):
+            base, _ = self._base_name(action_name)
+            self.add_action(base, pddl.actions[action_name], minor=minor)
+        return self
 
     def save_file(self, fname):
         # build strings before saving
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+This script builds an inverted index from relations (subject, relation, object) to the
+intervals of frames where they hold in each DecompressedFile of a dataset, and queries it.
+
+The index is a folder containing:
+
+'meta.pkl': list of files and sorted list of relations
+'offsets.npy': intervals of the relation N are in `offsets[N]:offsets[N+1]`
+'file.npy', 'start.npy', 'end.npy': file and first and last frames of each interval,
+    sorted by (file, start) for each relation
+
+Conjunctive queries (all relations hold at the same time) intersect the lists of intervals,
+and temporal queries (a relation followed by another in at most `gap` frames) join the end
+of the intervals of the first relation to the start of intervals of the second relation.
+Both are performed at once for all files with sorted arrays.
+
+Build the index of a folder:
+
+    $ python relation_index.py relations/ -o relations.idx
+
+Query all frames where `person holding knife` while `egg in bowl`:
+
+    $ python relation_index.py relations.idx -q person,holding,knife egg,in,bowl
+"""
+import os
+import sys
+import time
+import pickle
+import argparse
+from multiprocessing import Pool
+from os.path import join, exists, isdir
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+import numpy as np
+
+import filehandler as fh
+
+# frames of different files are kept apart in a single key (file * FILE_SPAN + frame)
+FILE_SPAN = 1 << 32
+
+
+def file_intervals(fileinput):
+    """ Compute the contiguous intervals of frames of each relation of a file.
+
+    Returns:
+    --------
+    (relations, id_relation, start, end), where `relations` is the sorted list of relations
+    of the file and `id_relation` indexes this list for each interval
+    """
+    frames, triplets = [], []
+    with open(fileinput) as fin:
+        for line in fin:
+            if not line or not line[0].isdigit(): continue
+            arr = line.rstrip('\r\n').split('\t')
+            frames.append(int(arr[0]))
+            triplets.append('\t'.join(arr[1:4]))
+    if not frames:
+        return [], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    names, ids = np.unique(triplets, return_inverse=True)
+    rows = np.unique(ids.astype(np.int64) * FILE_SPAN + np.array(frames, dtype=np.int64))
+    ids, frames = rows // FILE_SPAN, rows % FILE_SPAN
+    start = np.ones(len(rows), dtype=bool)
+    start[1:] = (ids[1:] != ids[:-1]) | (frames[1:] != frames[:-1] + 1)
+    starts = np.flatnonzero(start)
+    ends = np.append(starts[1:], len(rows)) - 1
+    relations = [tuple(name.split('\t')) for name in names]
+    return relations, ids[starts], frames[starts], frames[ends]
+
+
+def build_index(inputs, output, processes=None):
+    """ Build the inverted index of relations of a list of DecompressedFile.
+
+    Parameters:
+    -----------
+    inputs: array
+        list of paths to DecompressedFile containing relations
+    output: string
+        path to the folder where the index is saved
+    processes: int
+        number of processes (default: number of cpus)
+    """
+    start = time.time()
+    vocabulary = {}
+    ids, files, starts, ends = [], [], [], []
+    pool = Pool(processes)
+    for id_file, (relations, id_relation, first, last) in enumerate(pool.imap(file_intervals, inputs)):
+        lut = np.array([vocabulary.setdefault(rel, len(vocabulary)) for rel in relations], dtype=np.int64)
+        ids.append(lut[id_relation] if len(relations) else id_relation)
+        files.append(np.full(len(first), id_file, dtype=np.int64))
+        starts.append(first)
+        ends.append(last)
+    pool.close()
+    pool.join()
+
+    # sort relations by name and intervals by (relation, file, start)
+    relations = sorted(vocabulary)
+    rank = np.empty(len(relations), dtype=np.int64)
+    rank[[vocabulary[rel] for rel in relations]] = np.arange(len(relations))
+    ids = rank[np.concatenate(ids)] if ids else np.zeros(0, dtype=np.int64)
+    files, starts, ends = np.concatenate(files), np.concatenate(starts), np.concatenate(ends)
+    order = np.lexsort((starts, files, ids))
+    offsets = np.searchsorted(ids[order], np.arange(len(relations)+1))
+
+    if not exists(output):
+        os.makedirs(output)
+    np.save(join(output, 'offsets.npy'), offsets.astype(np.int64))
+    np.save(join(output, 'file.npy'), files[order].astype(np.int32))
+    np.save(join(output, 'start.npy'), starts[order].astype(np.int32))
+    np.save(join(output, 'end.npy'), ends[order].astype(np.int32))
+    with open(join(output, 'meta.pkl'), 'wb') as fout:
+        pickle.dump({'files': list(inputs), 'relations': relations}, fout, pickle.HIGHEST_PROTOCOL)
+    logger.info('Indexed {} intervals of {} relations from {} files in {:.2f}s'.format(len(order), len(relations), len(inputs), time.time()-start))
+    return output
+
+
+def intersect(a, b):
+    """ Intersect two lists of intervals (file, start, end), each sorted by (file, start)
+        without overlaps, returning the list of common intervals.
+    """
+    a_start, a_end = a[0] * FILE_SPAN + a[1], a[0] * FILE_SPAN + a[2]
+    b_start, b_end = b[0] * FILE_SPAN + b[1], b[0] * FILE_SPAN + b[2]
+    # intervals of `b` overlapping each interval of `a`
+    lo = np.searchsorted(b_end, a_start, side='left')
+    counts = np.searchsorted(b_start, a_end, side='right') - lo
+    counts = np.maximum(counts, 0)
+    ia = np.repeat(np.arange(len(a_start)), counts)
+    ib = np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    start = np.maximum(a_start[ia], b_start[ib])
+    end = np.minimum(a_end[ia], b_end[ib])
+    return a[0][ia], start % FILE_SPAN, end % FILE_SPAN
+
+
+def followed_by(a, b, gap):
+    """ Return the intervals (file, start of `a`, end of `b`) where an interval of `b`
+        starts at most `gap` frames after the end of an interval of `a`.
+    """
+    a_end = a[0] * FILE_SPAN + a[2]
+    b_start = b[0] * FILE_SPAN + b[1]
+    lo = np.searchsorted(b_start, a_end, side='right')
+    counts = np.searchsorted(b_start, a_end + gap, side='right') - lo
+    ia = np.repeat(np.arange(len(a_end)), counts)
+    ib = np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return a[0][ia], a[1][ia], b[2][ib]
+
+
+class RelationIndex(object):
+    """ Memory-mapped inverted index of relations created by `build_index`. E.g.:
+
+        >>> index = RelationIndex('relations.idx')
+        >>> index.query([('person', 'holding', 'knife'), ('egg', 'in', 'bowl')])
+            [('relations/data1/boild-egg.txt', 120, 178), ...]
+    """
+    def __init__(self, folder, mmap_mode='r'):
+        if not exists(join(folder, 'meta.pkl')):
+            logger.error('{} is not a valid index'.format(folder))
+            sys.exit()
+        with open(join(folder, 'meta.pkl'), 'rb') as fin:
+            meta = pickle.load(fin)
+        self.files = meta['files']
+        self.relations = meta['relations']
+        self.id_relations = dict((rel, i) for i, rel in enumerate(self.relations))
+        self.offsets = np.load(join(folder, 'offsets.npy'))
+        self.file = np.load(join(folder, 'file.npy'), mmap_mode=mmap_mode)
+        self.start = np.load(join(folder, 'start.npy'), mmap_mode=mmap_mode)
+        self.end = np.load(join(folder, 'end.npy'), mmap_mode=mmap_mode)
+
+    def __len__(self):
+        return len(self.relations)
+
+    def intervals(self, relation):
+        """ Return the arrays (file, start, end) of the intervals of a relation """
+        i = self.id_relations.get(tuple(relation))
+        if i is None:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty
+        a, b = self.offsets[i], self.offsets[i+1]
+        return (np.asarray(self.file[a:b], dtype=np.int64), np.asarray(self.start[a:b], dtype=np.int64),
+                np.asarray(self.end[a:b], dtype=np.int64))
+
+    def conjunction(self, relations):
+        """ Return the intervals (file, start, end) where all `relations` hold """
+        hits = self.intervals(relations[0])
+        for relation in relations[1:]:
+            hits = intersect(hits, self.intervals(relation))
+        return hits
+
+    def query(self, relations, then=None, gap=1):
+        """ Return the list of (file, start, end) where all `relations` hold. With `then`,
+            return the ranges where all `then` relations start at most `gap` frames after
+            the end of `relations` (`gap=1` is the next frame).
+        """
+        hits = self.conjunction(relations)
+        if then:
+            hits = followed_by(hits, self.conjunction(then), gap)
+        return [(self.files[f], int(s), int(e)) for f, s, e in zip(*hits)]
+# End of RelationIndex class
+
+
+def parse_relations(relations):
+    """ Convert strings `subject,relation,object` into tuples """
+    triplets = []
+    for relation in relations or []:
+        arr = relation.split(',')
+        if len(arr) != 3:
+            logger.error('Relations must have the form subject,relation,object: {}'.format(relation))
+            sys.exit()
+        triplets.append(tuple(arr))
+    return triplets
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', metavar='input', help='Folder containing Decompressed relations (build) or index (query).')
+    parser.add_argument('-o', '--output', help='Folder to save the index', default=None)
+    parser.add_argument('-q', '--query', help='Relations (subject,relation,object) that hold at the same time', nargs='+')
+    parser.add_argument('-t', '--then', help='Relations that hold after the relations of the query', nargs='+')
+    parser.add_argument('-g', '--gap', help='Maximum number of frames between query and then', type=int, default=1)
+    parser.add_argument('-p', '--processes', help='Number of processes', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.query:
+        index = RelationIndex(args.input)
+        start = time.time()
+        hits = index.query(parse_relations(args.query), parse_relations(args.then), args.gap)
+        logger.info('Found {} hits in {:.2f}ms'.format(len(hits), (time.time()-start)*1000))
+        for fname, first, last in hits:
+            print('{}\t{}\t{}'.format(fname, first, last))
+    elif isdir(args.input):
+        output = args.output or args.input.rstrip('/')+'.idx'
+        build_index(list(fh.FolderHandler(args.input)), output, args.processes)
+    else:
+        logger.error('{} is not a valid folder'.format(args.input))
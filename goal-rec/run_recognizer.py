@@ -1,21 +1,32 @@
 #!/usr/bin/env python
 # coding: utf-8
 """
-
+This script performs goal recognition for files containing relations. At each frame where
+the relations change, the observations are written into `demo/obs.dat` and the recognizer
+scores the goals. 
+
+With a hypotheses file (`goal_states.dat`, one line per goal, where the names of the goals
+are in the same order in `goal_states.names`), goals are prefiltered by the fraction of their atoms satisfied by the
+current state. Only the `top_k` goals and/or the goals above `threshold` are written into
+`demo/hyps.dat` and scored by the recognizer. Pruned goals receive `PRUNED_SCORE`.
 """
 import os
+import sys
 import argparse
-from os.path import join, dirname, basename, isfile, isdir
+from os.path import join, dirname, basename, splitext, isfile, isdir
 import logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 import subprocess
 from subprocess import Popen
 import math
+import numpy as np
 import pandas as pd
 
 import filehandler as fh
 
+PRUNED_SCORE = -2
+
 
 def check_group(relations, groups):
     """ Check if there are groups in elements of the relations.
@@ -99,6 +110,102 @@ def add_goals(i, goal_scores, candidate_goals, goals):
                     goal_scores[goal] = [score]
 
 
+def split_atoms(goal):
+    """ Split a goal or observation string into its atoms.
+
+    Example:
+    --------
+    >>> split_atoms("(egg1),(bowl1),(in egg1 bowl1)")
+        ['(egg1)', '(bowl1)', '(in egg1 bowl1)']
+    """
+    goal = goal.strip()
+    if not goal:
+        return []
+    return ['({})'.format(atom) for atom in goal.strip('()').split('),(')]
+
+
+def load_hypotheses(fname, goals=None):
+    """ Load the hypotheses from a file containing one goal per line (goals without atoms
+        have empty lines). Names of the goals are read from the file with extension 
+        `.names` (one name per line in the same order). Without this file, the lines are
+        assigned to `goals` sorted by name, which is the order of `create_goal_states`.
+
+    Returns:
+    --------
+    dictionary with the name of the goal as key and its atoms as value
+    """
+    with open(fname) as fin:
+        atoms = [line.rstrip('\r\n') for line in fin]
+    fnames = splitext(fname)[0]+'.names'
+    if isfile(fnames):
+        with open(fnames) as fin:
+            names = [line.strip() for line in fin if line.strip()]
+    else:
+        logger.warning('File {} not found. Assigning hypotheses to goals sorted by name'.format(fnames))
+        names = sorted(goals or [])
+    if len(names) != len(atoms):
+        logger.error('Number of hypotheses of {} ({}) differs from the number of names ({})'.format(fname, len(atoms), len(names)))
+        sys.exit()
+    return dict(zip(names, atoms))
+
+
+def save_hypotheses(fname, hypotheses):
+    """ Save the hypotheses that are scored by the recognizer """
+    with open(fname, 'w') as fout:
+        for hyp in hypotheses:
+            fout.write('{}\n'.format(hyp))
+        fout.flush()
+        os.fsync(fout.fileno())
+
+
+class GoalFilter(object):
+    """ Prefilter of goals by the fraction of their atoms satisfied in a state.
+        An index from each atom to the goals containing it allows to compute
+        the fraction of all goals looking only at the atoms of the state.
+    """
+    def __init__(self, hypotheses, top_k=None, threshold=None):
+        self.hypotheses = hypotheses
+        self.top_k = top_k
+        self.threshold = threshold
+        index = {}
+        self.sizes = np.zeros(len(hypotheses), dtype=np.float64)
+        for i, hyp in enumerate(hypotheses):
+            atoms = set(split_atoms(hyp))
+            self.sizes[i] = len(atoms)
+            for atom in atoms:
+                index.setdefault(atom, []).append(i)
+        self.index = dict((atom, np.array(ids)) for atom, ids in index.items())
+        self.sizes[self.sizes == 0] = 1
+
+    def scores(self, atoms):
+        """ Fraction of the atoms of each goal contained in `atoms` """
+        ids = [self.index[atom] for atom in set(atoms) if atom in self.index]
+        if not ids:
+            return np.zeros(len(self.hypotheses))
+        counts = np.bincount(np.concatenate(ids), minlength=len(self.hypotheses))
+        return counts / self.sizes
+
+    def select(self, atoms):
+        """ Return the sorted indexes of the goals that are sent to the recognizer """
+        scores = self.scores(atoms)
+        keep = np.ones(len(scores), dtype=bool)
+        if self.threshold is not None:
+            keep &= scores >= self.threshold
+        if self.top_k is not None and keep.sum() > self.top_k:
+            ranked = np.flatnonzero(keep)[np.argsort(-scores[keep], kind='stable')]
+            keep[:] = False
+            keep[ranked[:self.top_k]] = True
+        return np.flatnonzero(keep)
+
+
+def add_pruned(goal_scores, pruned_goals):
+    for goal in pruned_goals:
+        if goal in goal_scores:
+            goal_scores[goal].append(PRUNED_SCORE)
+        else:
+            goal_scores[goal] = [PRUNED_SCORE]
+
+
 class GoalRecognizer(object):
     def __init__(self):
         self.recognizer = Popen(['java', '-jar', 'gc_stop.jar'], 
@@ -150,27 +257,46 @@ def save_scores(fname, goal_scores):
     df.to_csv(fname)
 
 
-def run_file(fileinput, folder_output, initfile='pddl.ini'):
+def run_file(fileinput, folder_output, initfile='pddl.ini', hypotheses=None, top_k=None, threshold=None):
     """ Perform goal recognition in a single file.
 
     Parameters:
     -----------
     fileinput: string
         path to the DecompressedFile containing relations
+    folder_output: string
+        path to the folder where the scores are saved
+    initfile: string
+        path to the `pddl.ini` file
+    hypotheses: string (optional)
+        path to the file containing the atoms of each goal (`goal_states.dat`)
+    top_k: int (optional)
+        number of goals with more satisfied atoms sent to the recognizer
+    threshold: float (optional)
+        minimum fraction of satisfied atoms of a goal sent to the recognizer
     """
-    finit = fh.PDDLInit(initfile)
+    finit = fh.load_pddlinit(initfile)
     groups = finit.groups
     goals = finit.goals
     fname = fh.filename(fileinput, extension=False)
     fnameout = 'scores_{}.csv'.format(fname)
     foutput = join(folder_output, fnameout)
     goal_scores = {}
+    goal_filter = None
+    if hypotheses:
+        hyps = load_hypotheses(hypotheses, goals)
+        missing = [goal for goal in goals if goal not in hyps]
+        if missing or len(hyps) != len(goals):
+            logger.error('Hypotheses of {} ({}) do not match the goals of {} ({}). Missing goals: {}'.format(hypotheses, len(hyps), initfile, len(goals), missing))
+            sys.exit()
+        goal_filter = GoalFilter([hyps[goal] for goal in goals], top_k=top_k, threshold=threshold)
     rec = GoalRecognizer()
     fobs = FileObservations('demo/obs.dat')
 
     fd = fh.DecompressedFile(fileinput)
     last_relations = []
     candidate_goals = []
+    kept_goals, pruned_goals = goals, []
     for idfr, relations in fd.iterate_frames():
         relations = check_group(relations, groups)
         if relations != last_relations:
@@ -178,15 +304,21 @@ def run_file(fileinput, folder_output, initfile='pddl.ini'):
             last_relations = relations
             str_rels = convert_relations_string(relations)
             fobs.write_observation(str_rels)
-            candidate_goals = rec.check_goals()
+            if goal_filter:
+                kept = set(goal_filter.select(split_atoms(str_rels)))
+                kept_goals = [goal for i, goal in enumerate(goals) if i in kept]
+                pruned_goals = [goal for i, goal in enumerate(goals) if i not in kept]
+                save_hypotheses('demo/hyps.dat', [goal_filter.hypotheses[i] for i in sorted(kept)])
+            candidate_goals = rec.check_goals() if kept_goals else []
         else:
             candidate_goals = candidate_goals
-        add_goals(idfr, goal_scores, candidate_goals, goals)
+        add_goals(idfr, goal_scores, candidate_goals, kept_goals)
+        add_pruned(goal_scores, pruned_goals)
     save_scores(foutput, goal_scores)
 
 
-def run_multiple(folder_input, output):
-    """ 
+def run_multiple(folder_input, output, hypotheses=None, top_k=None, threshold=None):
+    """ Perform goal recognition for all files of a folder.
 
     Parameters:
     -----------
@@ -194,6 +326,8 @@ def run_multiple(folder_input, output):
         path to the folder containing files with relations
     output: string
         path to the file where the goals are saved.
+    hypotheses, top_k, threshold: 
+        options to prefilter goals (see `run_file`)
     """
     if not output:
         output = dirname(folder_input)
@@ -202,17 +336,20 @@ def run_multiple(folder_input, output):
     for file_input in relfiles:
         logger.info('Reading file: {}'.format(file_input))
         fname = fh.filename(file_input, extension=False)
-        run_file(file_input, output)
+        run_file(file_input, output, hypotheses=hypotheses, top_k=top_k, threshold=threshold)
     
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('input', metavar='input_folder', help='Folder containing Decompressed relations.')
     parser.add_argument('-o', '--output', help='Folder to save the score files', default=None)
+    parser.add_argument('-g', '--hypotheses', help='File containing the atoms of each goal (goal_states.dat)', default=None)
+    parser.add_argument('-k', '--top_k', help='Number of goals sent to the recognizer', type=int, default=None)
+    parser.add_argument('-t', '--threshold', help='Minimum fraction of satisfied atoms of a goal', type=float, default=None)
     args = parser.parse_args()
 
     if isfile(args.input):
-        run_file(args.input, args.output)
+        run_file(args.input, args.output, hypotheses=args.hypotheses, top_k=args.top_k, threshold=args.threshold)
     elif isdir(args.input):
-        run_multiple(args.input, args.output)
+        run_multiple(args.input, args.output, hypotheses=args.hypotheses, top_k=args.top_k, threshold=args.threshold)
     
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+This script links the detections of a PredictionFile across frames, assigning an id of track
+to each detection. Detections of a frame are matched to the active tracks of the same class
+by the IoU between their boxes, computed at once for all pairs (tracks x detections). The
+assignment is greedy (pairs with higher IoU first) or optimal (Hungarian, requires scipy).
+Detections that are not matched start new tracks, and tracks that are not matched for more
+than `max_age` frames are closed.
+
+The output is a PredictionFile with the id of the track in the last column:
+
+    Frame;xmin;ymin;xmax;ymax;id_class;score;id_track
+
+With `fill`, the last box of tracks that are missing for up to `max_age` frames is repeated,
+which avoids relations that disappear and appear again because of missing detections.
+"""
+import sys
+import time
+import argparse
+from itertools import groupby
+from os.path import splitext
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+import numpy as np
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+import filehandler as fh
+
+
+def iou_matrix(boxes1, boxes2):
+    """ Return the IoU (n, m) between all boxes of `boxes1` (n, 4) and `boxes2` (m, 4) """
+    b1, b2 = boxes1[:, np.newaxis, :], boxes2[np.newaxis, :, :]
+    iw = np.maximum(np.minimum(b1[..., 2], b2[..., 2]) - np.maximum(b1[..., 0], b2[..., 0]) + 1, 0.)
+    ih = np.maximum(np.minimum(b1[..., 3], b2[..., 3]) - np.maximum(b1[..., 1], b2[..., 1]) + 1, 0.)
+    inter = iw * ih
+    area1 = (boxes1[:, 2] - boxes1[:, 0] + 1) * (boxes1[:, 3] - boxes1[:, 1] + 1)
+    area2 = (boxes2[:, 2] - boxes2[:, 0] + 1) * (boxes2[:, 3] - boxes2[:, 1] + 1)
+    return inter / np.maximum(area1[:, np.newaxis] + area2[np.newaxis, :] - inter, 1.)
+
+
+def greedy_assignment(iou, threshold):
+    """ Match pairs (row, col) in decreasing order of IoU, each row and col only once """
+    rows, cols = np.nonzero(iou >= threshold)
+    order = np.argsort(-iou[rows, cols], kind='mergesort')
+    used_rows, used_cols, matches = set(), set(), []
+    for r, c in zip(rows[order], cols[order]):
+        if r in used_rows or c in used_cols: continue
+        used_rows.add(r)
+        used_cols.add(c)
+        matches.append((r, c))
+    return matches
+
+
+def hungarian_assignment(iou, threshold):
+    """ Match pairs (row, col) maximizing the sum of IoU """
+    rows, cols = linear_sum_assignment(-iou)
+    return [(r, c) for r, c in zip(rows, cols) if iou[r, c] >= threshold]
+
+
+class IoUTracker(object):
+    """ Keep the active tracks and match them to the detections of each frame """
+    def __init__(self, threshold=0.3, max_age=5, method='greedy'):
+        self.threshold = threshold
+        self.max_age = max_age
+        self.assignment = hungarian_assignment if method == 'hungarian' else greedy_assignment
+        self.boxes = np.zeros((0, 4))
+        self.classes = np.zeros(0, dtype=np.int64)
+        self.scores = np.zeros(0)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.last = np.zeros(0, dtype=np.int64)
+        self.nb_tracks = 0
+
+    def update(self, idfr, boxes, classes, scores):
+        """ Return the id of the track of each detection of the frame `idfr` """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape((-1, 4))
+        classes = np.asarray(classes, dtype=np.int64)
+        scores = np.asarray(scores, dtype=np.float64)
+        alive = idfr - self.last <= self.max_age
+        self.boxes, self.classes, self.scores = self.boxes[alive], self.classes[alive], self.scores[alive]
+        self.ids, self.last = self.ids[alive], self.last[alive]
+
+        iou = iou_matrix(self.boxes, boxes)
+        iou[self.classes[:, np.newaxis] != classes[np.newaxis, :]] = 0.
+        ids = np.full(len(boxes), -1, dtype=np.int64)
+        for t, d in self.assignment(iou, self.threshold):
+            ids[d] = self.ids[t]
+            self.boxes[t], self.scores[t], self.last[t] = boxes[d], scores[d], idfr
+
+        new = np.flatnonzero(ids < 0)
+        ids[new] = self.nb_tracks + np.arange(len(new))
+        self.nb_tracks += len(new)
+        self.boxes = np.vstack([self.boxes, boxes[new]])
+        self.classes = np.concatenate([self.classes, classes[new]])
+        self.scores = np.concatenate([self.scores, scores[new]])
+        self.ids = np.concatenate([self.ids, ids[new]])
+        self.last = np.concatenate([self.last, np.full(len(new), idfr, dtype=np.int64)])
+        return ids
+
+    def missing(self, idfr):
+        """ Return the indexes of the active tracks that were not matched in the frame `idfr` """
+        return np.flatnonzero(self.last != idfr)
+# End of IoUTracker class
+
+
+def track_detections(fileinput, output=None, threshold=0.3, max_age=5, method='greedy', fill=False):
+    """ Assign ids of tracks to the detections of a PredictionFile.
+
+    Parameters:
+    -----------
+    fileinput: string
+        path to the PredictionFile containing detections
+    output: string
+        path to the PredictionFile where detections and tracks are saved
+    threshold: float
+        minimum IoU to match a detection to a track
+    max_age: int
+        number of frames that a track is kept without detections
+    method: string
+        `greedy` or `hungarian` assignment
+    fill: boolean
+        repeat the last box of missing tracks
+    """
+    if method == 'hungarian' and linear_sum_assignment is None:
+        logger.error('Hungarian assignment requires scipy. Use greedy assignment instead.')
+        sys.exit()
+    if not output:
+        output = splitext(fileinput)[0]+'_tracks.txt'
+    tracker = IoUTracker(threshold, max_age, method)
+    start = time.time()
+    nb_frames = 0
+    with fh.PredictionFile(fileinput) as fpred, open(output, 'w') as fout:
+        fout.write('Frame;xmin;ymin;xmax;ymax;id_class;score;id_track\n')
+        for idfr, group in groupby(fpred, key=lambda arr: arr[0]):
+            group = list(group)
+            boxes = [arr[1:5] for arr in group]
+            classes = [arr[5] for arr in group]
+            scores = [float(arr[6]) for arr in group]
+            ids = tracker.update(idfr, boxes, classes, scores)
+            for arr, id_track in zip(group, ids):
+                fout.write('{};{};{};{};{};{};{};{}\n'.format(*(arr[:7]+[id_track])))
+            if fill:
+                for t in tracker.missing(idfr):
+                    box = tracker.boxes[t].astype(np.int64)
+                    fout.write('{};{};{};{};{};{};{};{}\n'.format(idfr, box[0], box[1], box[2], box[3],
+                               tracker.classes[t], round(tracker.scores[t], 2), tracker.ids[t]))
+            nb_frames += 1
+    elapsed = time.time() - start
+    logger.info('Created {} tracks in {} frames ({:.1f} frames/s)'.format(tracker.nb_tracks, nb_frames, nb_frames / max(elapsed, 1e-6)))
+    logger.info('Saved tracks in file: {}'.format(output))
+    return output
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', metavar='prediction_file', help='File containing detections (Frame;xmin;ymin;xmax;ymax;id_class;score).')
+    parser.add_argument('-o', '--output', help='Path to the file to save detections with tracks', default=None)
+    parser.add_argument('-t', '--threshold', help='Minimum IoU to match a detection to a track', type=float, default=0.3)
+    parser.add_argument('-a', '--max_age', help='Number of frames to keep a track without detections', type=int, default=5)
+    parser.add_argument('-m', '--method', help='Assignment method', choices=['greedy', 'hungarian'], default='greedy')
+    parser.add_argument('-f', '--fill', help='Repeat the last box of missing tracks', action='store_true')
+    args = parser.parse_args()
+
+    track_detections(args.input, args.output, args.threshold, args.max_age, args.method, args.fill)
@@ -0,0 +1,365 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+"""
+Annotation of bounding boxes of a sequence of frames kept in arrays, where each row is a box.
+Boxes are kept as [xmin, ymin, xmax, ymax] and transformations (scale, crop, clamp, resize)
+are applied to all boxes at once. Annotations are read from and written to the formats:
+
+'lis': id_frame \t label \t (x,y,w,h) \t bbox_id \t path
+'yolo': path xmin,ymin,xmax,ymax,class_id xmin,ymin,xmax,ymax,class_id
+'voc': folder with one XML file per image (JPEGImages)
+'pred': Frame;xmin;ymin;xmax;ymax;id_class;score
+
+Convert a LIS file of 640x480 images to VOC files of images resized to 416x416
+(same resize and center crop of `resize_dataset.py`):
+
+    $ python annotation.py Bounding_Boxes_Annotation.txt -i lis -f voc -o Annotations/ -s 416 -W 640 -H 480
+"""
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+import os
+import sys
+import numbers
+import argparse
+import numpy as np
+from os.path import join, splitext, basename
+
+from utils import image_size, read_voc_files, write_voc_files
+
+FORMATS = ['lis', 'yolo', 'voc', 'pred']
+
+
+def xywh_to_xyxy(boxes):
+    """ Convert boxes [x, y, w, h] into [xmin, ymin, xmax, ymax] """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape((-1, 4))
+    return np.hstack([boxes[:, :2], boxes[:, :2] + boxes[:, 2:]])
+
+
+def xyxy_to_xywh(boxes):
+    """ Convert boxes [xmin, ymin, xmax, ymax] into [x, y, w, h] """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape((-1, 4))
+    return np.hstack([boxes[:, :2], boxes[:, 2:] - boxes[:, :2]])
+
+
+def resize_geometry(width, height, size):
+    """ Return the scale (sx, sy) and the offsets of the center crop (dx, dy) of images
+        with `width` and `height` resized by `resize_dataset.resize_image` to `size`
+    """
+    width, height = np.asarray(width, dtype=np.int64), np.asarray(height, dtype=np.int64)
+    portrait = width < height
+    new_width = np.where(portrait, size, (size * width) // np.maximum(height, 1))
+    new_height = np.where(portrait, (size * height) // np.maximum(width, 1), size)
+    sx = new_width / np.maximum(width, 1).astype(np.float64)
+    sy = new_height / np.maximum(height, 1).astype(np.float64)
+    return sx, sy, (new_width - size) // 2, (new_height - size) // 2
+
+
+class Annotation(object):
+    """ Boxes of a sequence of frames, where the row N contains the box `boxes[N]`
+        of the object `labels[N]` in the frame `frames[N]`. E.g.:
+
+            ann = read_lis('Bounding_Boxes_Annotation.txt', 640, 480)
+            ann = ann.resize(416).clamp().nonempty()
+            write_voc_folder(ann, 'Annotations/')
+
+        Optionally, `images` keeps the path of all frames (the frame N in `images[N]`),
+        including frames without boxes.
+    """
+    def __init__(self, frames, boxes, labels, scores=None, ids=None, paths=None, width=0, height=0, images=None):
+        nb_rows = len(frames)
+        self.frames = np.asarray(frames, dtype=np.int64)
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape((-1, 4))
+        self.labels = np.asarray(labels, dtype=object)
+        self.scores = np.ones(nb_rows) if scores is None else np.asarray(scores, dtype=np.float64)
+        self.ids = np.full(nb_rows, -1, dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+        if paths is None:
+            paths = [str(idfr)+'.jpg' for idfr in self.frames]
+        self.paths = np.asarray(paths, dtype=object)
+        self.width = np.zeros(nb_rows, dtype=np.int64) + np.asarray(width, dtype=np.int64)
+        self.height = np.zeros(nb_rows, dtype=np.int64) + np.asarray(height, dtype=np.int64)
+        self.images = None if images is None else np.asarray(images, dtype=object)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def copy(self, **changes):
+        """ Return a new annotation replacing the arrays of `changes` """
+        arrays = dict((key, getattr(self, key)) for key in
+                      ['frames', 'boxes', 'labels', 'scores', 'ids', 'paths', 'width', 'height', 'images'])
+        arrays.update(changes)
+        return Annotation(**arrays)
+
+    def select(self, mask):
+        """ Return the annotation of the rows of `mask` (boolean array or indexes) """
+        return Annotation(self.frames[mask], self.boxes[mask], self.labels[mask], self.scores[mask],
+                          self.ids[mask], self.paths[mask], self.width[mask], self.height[mask], self.images)
+
+    def offsets(self):
+        """ Return the offsets of the rows of each frame, i.e., rows of the frame N are
+            in `offsets[N]:offsets[N+1]`. Rows must be grouped by frame.
+        """
+        if not len(self):
+            return np.zeros(1, dtype=np.int64)
+        starts = np.flatnonzero(self.frames[1:] != self.frames[:-1]) + 1
+        return np.concatenate([[0], starts, [len(self)]]).astype(np.int64)
+
+    def scale(self, sx, sy=None):
+        """ Scale boxes and images by `sx` horizontally and `sy` vertically """
+        sx = np.zeros(len(self)) + sx
+        sy = sx if sy is None else np.zeros(len(self)) + sy
+        factor = np.column_stack([sx, sy, sx, sy])
+        return self.copy(boxes=self.boxes * factor,
+                         width=np.round(self.width * sx).astype(np.int64),
+                         height=np.round(self.height * sy).astype(np.int64))
+
+    def crop(self, dx, dy, width, height):
+        """ Move boxes to a crop of images starting at (`dx`, `dy`) with `width` and `height` """
+        dx, dy = np.zeros(len(self)) + dx, np.zeros(len(self)) + dy
+        offset = np.column_stack([dx, dy, dx, dy])
+        return self.copy(boxes=self.boxes - offset, width=width, height=height)
+
+    def clamp(self, low=0):
+        """ Limit boxes to [low, width] and [low, height], where images without size are
+            only limited by `low`
+        """
+        upper_x = np.where(self.width > 0, self.width, np.inf)
+        upper_y = np.where(self.height > 0, self.height, np.inf)
+        upper = np.column_stack([upper_x, upper_y, upper_x, upper_y])
+        return self.copy(boxes=np.minimum(np.maximum(self.boxes, low), upper))
+
+    def resize(self, size):
+        """ Resize and center crop images to `size` x `size` (see `resize_geometry`) """
+        sx, sy, dx, dy = resize_geometry(self.width, self.height, size)
+        return self.scale(sx, sy).crop(dx, dy, size, size)
+
+    def nonempty(self):
+        """ Return the annotation without boxes with zero area """
+        boxes = self.boxes
+        return self.select((boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1]))
+# End of Annotation class
+
+
+def with_image_sizes(annotation, folder):
+    """ Return the annotation with the width and height of its images in `folder`,
+        reading only the header of images (see `utils.image_size`)
+    """
+    width, height = annotation.width.copy(), annotation.height.copy()
+    offsets = annotation.offsets()
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        width[start:end], height[start:end] = image_size(join(folder, basename(annotation.paths[start])))
+    return annotation.copy(width=width, height=height)
+
+
+def class_ids(labels, classes=None):
+    """ Return the id of each label, where `classes` is a dictionary {name: id} that
+        receives the new labels in the order they appear. Labels that are already ids
+        are kept.
+    """
+    if not len(labels):
+        return np.zeros(0, dtype=np.int64)
+    if classes is None or isinstance(labels[0], numbers.Integral):
+        return np.asarray(labels, dtype=np.int64)
+    names, first, inverse = np.unique(labels.astype(str), return_index=True, return_inverse=True)
+    for k in np.argsort(first):
+        if str(names[k]) not in classes:
+            classes[str(names[k])] = len(classes)
+    return np.array([classes[name] for name in names], dtype=np.int64)[inverse]
+
+
+def class_names(ids, classes=None):
+    """ Return the name of each id, where `classes` is a list of names sorted by id """
+    if classes is None:
+        return np.asarray(ids, dtype=object)
+    return np.asarray(classes, dtype=object)[np.asarray(ids, dtype=np.int64)]
+
+
+def read_lis(inputfile, width=0, height=0):
+    """ Read a LIS file (id_frame \\t label \\t (x,y,w,h) \\t bbox_id \\t path) """
+    frames, labels, points, ids, paths = [], [], [], [], []
+    with open(inputfile) as fin:
+        for line in fin:
+            if not line[0].isdigit(): continue
+            arr = line.strip().split('\t')
+            frames.append(arr[0])
+            labels.append(arr[1])
+            points.append(arr[2].strip('()'))
+            ids.append(arr[3])
+            paths.append(arr[4])
+    boxes = np.fromstring(','.join(points), sep=',') if points else np.zeros(0)
+    return Annotation(np.array(frames, dtype=np.int64), xywh_to_xyxy(boxes), labels,
+                      ids=np.array(ids, dtype=np.int64), paths=paths, width=width, height=height)
+
+
+def write_lis(annotation, fout):
+    """ Write the annotation in the LIS format into the opened file `fout` """
+    fout.write('Frame:\tLabel:\tPoints:\tBounding Box ID:\tFrame path:\n')
+    boxes = xyxy_to_xywh(annotation.boxes.astype(np.int64)).astype(np.int64)
+    for idfr, label, box, id, path in zip(annotation.frames, annotation.labels, boxes, annotation.ids, annotation.paths):
+        fout.write('%d\t%s\t(%d,%d,%d,%d)\t%d\t%s\n' % (idfr, label, box[0], box[1], box[2], box[3], id, path))
+
+
+def read_yolo(inputfile, classes=None, width=0, height=0):
+    """ Read a keras-yolov3 file (path xmin,ymin,xmax,ymax,class_id ...), where each line
+        is a frame. With `classes` (list of names), labels are names instead of ids.
+        Paths of all frames are kept in `images`, including frames without boxes.
+    """
+    frames, paths, values, images = [], [], [], []
+    with open(inputfile) as fin:
+        for line in fin:
+            arr = line.strip().split()
+            if not arr: continue
+            frames.extend([len(images)] * (len(arr)-1))
+            images.append(arr[0])
+            paths.extend([arr[0]] * (len(arr)-1))
+            values.extend(arr[1:])
+    values = np.fromstring(','.join(values), sep=',').reshape((-1, 5)) if values else np.zeros((0, 5))
+    return Annotation(frames, values[:, :4], class_names(values[:, 4].astype(np.int64), classes),
+                      paths=paths, width=width, height=height, images=images)
+
+
+def write_yolo(annotation, fout, classes=None):
+    """ Write the annotation in the keras-yolov3 format into the opened file `fout`,
+        where `classes` is a dictionary {name: id} (see `class_ids`). With `images`,
+        a line is written for each frame, including frames without boxes.
+    """
+    ids = class_ids(annotation.labels, classes)
+    boxes = annotation.boxes.astype(np.int64)
+    if annotation.images is None:
+        offsets = annotation.offsets()
+        starts, ends = offsets[:-1], offsets[1:]
+        paths = annotation.paths[starts]
+    else:
+        idframes = np.arange(len(annotation.images))
+        starts = np.searchsorted(annotation.frames, idframes, side='left')
+        ends = np.searchsorted(annotation.frames, idframes, side='right')
+        paths = annotation.images
+    for path, start, end in zip(paths, starts, ends):
+        positions = ''.join([' %d,%d,%d,%d,%d' % (b[0], b[1], b[2], b[3], i) for b, i in zip(boxes[start:end], ids[start:end])])
+        fout.write('%s%s\n' % (path, positions))
+
+
+def read_voc_folder(folder, processes=None):
+    """ Read all XML files of a VOC folder, where each file is a frame (see `utils.read_voc_files`) """
+    fnames = sorted([fname for fname in os.listdir(folder) if splitext(fname)[1] == '.xml'])
+    images = read_voc_files([join(folder, fname) for fname in fnames], processes)
+    idframes = [int(splitext(fname)[0]) if splitext(fname)[0].isdigit() else idfr for idfr, fname in enumerate(fnames)]
+    counts = [len(names) for _, _, _, names, _ in images]
+    frames = np.repeat(np.array(idframes, dtype=np.int64), counts)
+    boxes = np.concatenate([boxes for _, _, _, _, boxes in images]) if images else np.zeros((0, 4))
+    labels = [name for _, _, _, names, _ in images for name in names]
+    paths = np.repeat(np.array([path for path, _, _, _, _ in images], dtype=object), counts)
+    width = np.repeat(np.array([w for _, w, _, _, _ in images], dtype=np.int64), counts)
+    height = np.repeat(np.array([h for _, _, h, _, _ in images], dtype=np.int64), counts)
+    order = np.argsort(frames, kind='mergesort')
+    return Annotation(frames, boxes, labels, paths=paths, width=width, height=height).select(order)
+
+
+def write_voc_folder(annotation, folder, processes=None):
+    """ Write an XML file for each frame of the annotation in `folder` (see `utils.write_voc_files`).
+        As VOC cannot have xmin or ymin equals zero, boxes are limited to [1, width] and [1, height].
+    """
+    annotation = annotation.clamp(low=1)
+    boxes = annotation.boxes.astype(np.int64).tolist()
+    offsets = annotation.offsets()
+    images = []
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        objects = [tuple([label]+box) for label, box in zip(annotation.labels[start:end], boxes[start:end])]
+        images.append((basename(annotation.paths[start]), annotation.width[start], annotation.height[start], objects))
+    return write_voc_files(images, folder, processes)
+
+
+def read_predictions(inputfile, classes=None, width=0, height=0):
+    """ Read a prediction file (Frame;xmin;ymin;xmax;ymax;id_class;score), where files
+        created by the tracker have the id of the track in a last column (kept in `ids`)
+    """
+    with open(inputfile) as fin:
+        lines = [line for line in fin if line[:1].isdigit()]
+    nb_cols = lines[0].count(';') + 1 if lines else 7
+    for line in lines:
+        if nb_cols not in (7, 8) or line.count(';') != nb_cols - 1:
+            logger.error('Malformed line in input file: %s [LINE: %s]' % (inputfile, line.strip()))
+            sys.exit()
+    values = np.fromstring(''.join(lines).replace(';', ' '), sep=' ')
+    if len(values) != len(lines) * nb_cols:
+        logger.error('Malformed line in input file: %s' % inputfile)
+        sys.exit()
+    values = values.reshape((-1, nb_cols))
+    ids = values[:, 7] if nb_cols == 8 else None
+    return Annotation(values[:, 0], values[:, 1:5], class_names(values[:, 5].astype(np.int64), classes),
+                      scores=values[:, 6], ids=ids, width=width, height=height)
+
+
+def write_predictions(annotation, fout, classes=None):
+    """ Write the annotation as predictions into the opened file `fout` """
+    fout.write('Frame;xmin;ymin;xmax;ymax;id_class;score\n')
+    ids = class_ids(annotation.labels, classes)
+    boxes = annotation.boxes.astype(np.int64)
+    for idfr, box, id, score in zip(annotation.frames, boxes, ids, annotation.scores):
+        fout.write('%d;%d;%d;%d;%d;%d;%s\n' % (idfr, box[0], box[1], box[2], box[3], id, round(score, 2)))
+
+
+def load_classes(inputfile):
+    """ Return the list of names of a file with a class per line (e.g. `classes.txt`) """
+    with open(inputfile) as fin:
+        return [line.strip() for line in fin if line.strip()]
+
+
+def main(inputfile, output, fmt_in='lis', fmt_out='yolo', size=None, width=0, height=0, class_file=None, image_folder=None, processes=None):
+    """
+    Convert the annotation of `inputfile` from `fmt_in` to `fmt_out`, resizing boxes
+    to images of `size` x `size`. Sizes of images are read from `image_folder`.
+    VOC files are read and written by `processes`.
+    """
+    classes = load_classes(class_file) if class_file else None
+    if fmt_in == 'lis':
+        annotation = read_lis(inputfile, width, height)
+    elif fmt_in == 'yolo':
+        annotation = read_yolo(inputfile, classes, width, height)
+    elif fmt_in == 'voc':
+        annotation = read_voc_folder(inputfile, processes)
+    else:
+        annotation = read_predictions(inputfile, classes, width, height)
+    logger.info('Loaded %d boxes of %d frames' % (len(annotation), len(annotation.offsets())-1))
+    if image_folder:
+        annotation = with_image_sizes(annotation, image_folder)
+
+    if size:
+        if not np.all(annotation.width > 0) or not np.all(annotation.height > 0):
+            logger.error('Resizing requires the width and height of images')
+            return
+        annotation = annotation.resize(size).clamp().nonempty()
+    dclasses = dict((name, i) for i, name in enumerate(classes or []))
+    if fmt_out == 'voc':
+        write_voc_folder(annotation, output, processes)
+    elif fmt_out == 'lis':
+        with open(output, 'w') as fout:
+            write_lis(annotation, fout)
+    else:
+        writer = write_yolo if fmt_out == 'yolo' else write_predictions
+        with open(output, 'w') as fout:
+            writer(annotation, fout, dclasses)
+        if dclasses and not classes:
+            fclasses = splitext(output)[0]+'_classes.txt'
+            with open(fclasses, 'w') as fout:
+                for name, _ in sorted(dclasses.items(), key=lambda kv: kv[1]):
+                    fout.write('%s\n' % name)
+            logger.info('Saved class labels in: %s' % fclasses)
+    logger.info('Saved %d boxes in: %s' % (len(annotation), output))
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('inputfile', metavar='annotation', help='Path to the annotation file (or folder of VOC files)')
+    argparser.add_argument('-o', '--output', help='Path to the output file (or folder of VOC files)', required=True)
+    argparser.add_argument('-i', '--input_format', help='Format of the input annotation', choices=FORMATS, default='lis')
+    argparser.add_argument('-f', '--output_format', help='Format of the output annotation', choices=FORMATS, default='yolo')
+    argparser.add_argument('-s', '--size', help='Resize boxes to images of size x size', default=None, type=int)
+    argparser.add_argument('-W', '--width', help='Width of the input images', default=0, type=int)
+    argparser.add_argument('-H', '--height', help='Height of the input images', default=0, type=int)
+    argparser.add_argument('-c', '--class_file', help='File containing a class name per line (sorted by id)', default=None)
+    argparser.add_argument('-d', '--image_folder', help='Folder containing the images (to read their sizes)', default=None)
+    argparser.add_argument('-p', '--processes', help='Number of processes to read and write VOC files', default=None, type=int)
+    args = argparser.parse_args()
+
+    main(args.inputfile, args.output, args.input_format, args.output_format, args.size, args.width, args.height, args.class_file, args.image_folder, args.processes)
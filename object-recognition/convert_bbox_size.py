@@ -13,14 +13,8 @@ logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 import argparse
 from os.path import join, dirname, splitext, basename
-import progressbar as pb
 
-
-def count_lines(inputfile):
-    """ Count the number of lines of the inputfile """
-    with open(inputfile) as fin:
-        for n, _ in enumerate(fin, start=1): pass
-    return n
+import annotation as an
 
 
 def main(inputfile, size_in, size_out):
@@ -31,22 +25,11 @@ def main(inputfile, size_in, size_out):
     foutname = fname+'_'+str(size_out)+'.txt'
     foutput = join(dirname(inputfile), foutname)
 
-    pbar = pb.ProgressBar(count_lines(inputfile))
-    with open(foutput, 'w') as fout, open(inputfile) as fin:
-        for i, line in enumerate(fin):
-            #image.jpg xmin,ymin,xmax,ymax,id xmin,ymin,xmax,ymax,id
-            arr = line.strip().split()
-            pos_str = arr[0]
-            for position in arr[1:]:
-                xmin, ymin, xmax, ymax, id = position.split(',')
-                xmin_out = int((float(xmin)/size_in) * size_out)
-                ymin_out = int((float(ymin)/size_in) * size_out)
-                xmax_out = int((float(xmax)/size_in) * size_out)
-                ymax_out = int((float(ymax)/size_in) * size_out)
-                pos_str += ' %d,%d,%d,%d,%s' % (xmin_out, ymin_out, xmax_out, ymax_out, id)
-            fout.write('%s\n' % pos_str)
-            pbar.update()
-    logger.info('Converted %d files' % i)
+    annotation = an.read_yolo(inputfile)
+    annotation = annotation.scale(float(size_out) / size_in)
+    with open(foutput, 'w') as fout:
+        an.write_yolo(annotation, fout)
+    logger.info('Converted %d files' % len(annotation.images))
     logger.info('Saved output file as: %s' % foutput)
                 
 
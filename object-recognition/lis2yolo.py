@@ -17,11 +17,11 @@ import logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 import argparse
-from PIL import Image
 import os
-import ast
 from os.path import join
 
+import annotation as an
+
 
 def change_annotation(fan, fout, dclasses):
     """
@@ -30,30 +30,8 @@ def change_annotation(fan, fout, dclasses):
     To keras-yolov3 annotation as:
         Path xmin,ymin,xmax,ymax,class_id xmin,ymin,xmax,ymax,class_id
     """ 
-    last_index = 0
-    positions = ''
-    with open(fan) as fin:
-        for i, line in enumerate(fin):
-            #Frame \t Label \t Points \t Bounding Box ID \t Frame path
-            arr = line.strip().split('\t')
-            if arr[0].isdigit():
-                index = int(arr[0])
-                if index != last_index and i != 1:
-                    fout.write('%s%s\n' % (path, positions)) 
-                    positions = ''
-                    last_index = index
-                path = arr[4]
-                xmin, ymin, w, h = ast.literal_eval(arr[2])
-                if xmin < 0: xmin = 0
-                if ymin < 0: ymin = 0
-                xmax = xmin+w
-                ymax = ymin+h
-                label = arr[1]
-                if not dclasses.has_key(label):
-                    dclasses[label] = len(dclasses)
-                class_id = dclasses[arr[1]]
-                positions += ' %d,%d,%d,%d,%d' % (xmin, ymin, xmax, ymax, class_id)
-        fout.write('%s%s\n' % (path, positions))
+    annotation = an.read_lis(fan).clamp()
+    an.write_yolo(annotation, fout, dclasses)
     return dclasses
                 
 
@@ -24,6 +24,8 @@ from PIL import Image, ImageTk, ImageDraw
 import ast
 from matplotlib import colors
 
+from utils import image_size
+
 class ImageManager(object):
     """
     Class to manage the frames
@@ -57,8 +59,7 @@ class ImageManager(object):
     
     def _check_size(self, pathimg):
         """Check the size of an image"""
-        im = Image.open(pathimg)
-        self.width, self.height = im.size
+        self.width, self.height = image_size(pathimg)
 
 
     def _loadImages(self):
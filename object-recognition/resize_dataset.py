@@ -9,6 +9,8 @@ Input file has the form "<path_to_image> <true_label>" as:
 path/data1/boild-egg/0.jpg 0
 ```
 
+With `--annotation`, the boxes of a LIS file are resized and cropped as the images.
+
 """
 import logging
 logger = logging.getLogger(__name__)
@@ -16,9 +18,11 @@ logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=lo
 import argparse
 import os
 import cv2
-from os.path import join, realpath, dirname, isdir
+import numpy as np
+from os.path import join, realpath, dirname, isdir, basename
 
 import progressbar as pb
+import annotation as an
 from utils import count_lines
 
 
@@ -55,17 +59,42 @@ def resize_image(img, size):
     return img
 
 
+def image_key(path):
+    """ Return the path of an image from the folder of the dataset (e.g. data1/boild-egg/0.jpg) """
+    return '/'.join(path.split('/')[-3:])
+
+
 def create_path(inputfile, outputdir):
     """ Change the path of the inputfile to the outputdir folder """
-    pathdata = '/'.join(inputfile.split('/')[-3:])
-    newpath = join(outputdir, pathdata)
+    newpath = join(outputdir, image_key(inputfile))
     dirout = dirname(newpath)
     if not isdir(dirout):
         os.makedirs(dirout)
     return newpath
     
 
-def main(inputfile, output, size):
+def resize_annotation(inputfile, output, size, sizes):
+    """
+    Resize the boxes of the LIS file `inputfile` as `resize_image`, where `sizes` is a
+    dictionary {image_key: (width, height)} with the original size of each image, saving
+    the LIS file in `output` folder. Boxes of images not in `sizes` are discarded.
+    """
+    annotation = an.read_lis(inputfile)
+    paths, inverse = np.unique(annotation.paths.astype(str), return_inverse=True)
+    dims = np.array([sizes.get(image_key(path), (0, 0)) for path in paths], dtype=np.int64).reshape((-1, 2))[inverse]
+    known = dims[:, 0] > 0
+    if not known.all():
+        logger.warning('Discarding %d boxes of images that were not resized' % (~known).sum())
+    annotation = annotation.copy(width=dims[:, 0], height=dims[:, 1]).select(known)
+    annotation = annotation.resize(size).clamp().nonempty()
+    fileout = join(output, basename(inputfile))
+    with open(fileout, 'w') as fout:
+        an.write_lis(annotation, fout)
+    logger.info('Saved %d boxes in file: %s' % (len(annotation), fileout))
+    return fileout
+
+
+def main(inputfile, output, size, annotation=None):
     """
     Resize images from `fileinput` to `size` by `size`, saving the output
     images in `output` folder.
@@ -80,15 +109,20 @@ def main(inputfile, output, size):
     #/usr/share/datasets/KSCGR_Original/data1/boild-egg/0.jpg 0
     nb_lines = count_lines(inputfile)
     pbar = pb.ProgressBar(nb_lines)
+    sizes = {}
     with open(inputfile) as fin:
         for line in fin:
             path, tl = line.strip().split()
             newpath = create_path(path, output)
             img = cv2.imread(path)
+            height, width = img.shape[:2]
+            sizes[image_key(path)] = (width, height)
             img = resize_image(img, size)
             cv2.imwrite(newpath, img)
             pbar.update()
     logger.info('Total of images resized: %d' % nb_lines)
+    if annotation:
+        resize_annotation(annotation, output, size, sizes)
 
 
 if __name__ == "__main__":
@@ -96,7 +130,8 @@ if __name__ == "__main__":
     argparser.add_argument('inputfile', metavar='input_file', help='File containing paths of images and true labels (paths.txt)')
     argparser.add_argument('-o', '--output', help='Folder to save images with the new size', default=None)
     argparser.add_argument('-s', '--size', help='Size of the output images', default=416, type=int)
+    argparser.add_argument('-a', '--annotation', help='LIS file containing the boxes of the images', default=None)
     args = argparser.parse_args()
 
-    main(args.inputfile, args.output, args.size)
+    main(args.inputfile, args.output, args.size, args.annotation)
 
@@ -7,11 +7,23 @@ import logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 import os
-from os.path import realpath, join, splitext, dirname
+import struct
+import atexit
+import pickle
+import numpy as np
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+from string import Template
+from multiprocessing import Pool
+from xml.sax.saxutils import escape
+from os.path import realpath, join, splitext, dirname, split, exists, getmtime, basename
 
 
 def count_lines(inputfile):
     """ Count the number of lines of the inputfile """
+    n = 0
     with open(inputfile) as fin:
         for n, _ in enumerate(fin, start=1): pass
     return n
@@ -46,3 +58,211 @@ def create_pathfile(inputfolder, outputfile=None, images=True):
             fout.write('%s\n' % name)
     logger.info('Saved paths in file: %s' % outputfile)
     return outputfile
+
+
+SIZE_CACHE_FILE = '.image_sizes.pkl'
+SIZE_CACHE = {}
+SIZE_CACHE_CHANGED = set()
+JPEG_SOF = set([0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF])
+
+
+def read_image_size(pathimg):
+    """ Return (width, height) of a JPEG or PNG image reading only the header 
+        of the file (SOF or IHDR). Other formats and truncated headers are
+        opened with PIL.
+    """
+    with open(pathimg, 'rb') as fin:
+        head = fin.read(24)
+        if len(head) == 24 and head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+            return struct.unpack('>II', head[16:24])
+        if head[:2] == b'\xff\xd8':
+            fin.seek(2)
+            while True:
+                marker = fin.read(2)
+                # stop at the end of the file, at a byte that is not a marker, or at the
+                # end of image (EOI) or start of scan (SOS) without a frame header
+                if len(marker) < 2 or marker[:1] != b'\xff' or marker[1:2] in (b'\xd9', b'\xda'):
+                    break
+                code = ord(marker[1:2])
+                if code == 0xFF:
+                    # fill bytes before the marker
+                    fin.seek(-1, 1)
+                    continue
+                if code == 0x01 or 0xD0 <= code <= 0xD8:
+                    continue
+                segment = fin.read(2)
+                if len(segment) < 2:
+                    break
+                length = struct.unpack('>H', segment)[0]
+                if code in JPEG_SOF:
+                    segment = fin.read(5)
+                    if len(segment) < 5:
+                        break
+                    height, width = struct.unpack('>xHH', segment)
+                    return width, height
+                fin.seek(length-2, 1)
+    from PIL import Image
+    return Image.open(pathimg).size
+
+
+def _folder_sizes(folder):
+    """ Return the cache {filename: (mtime, width, height)} of the images of `folder` """
+    if folder not in SIZE_CACHE:
+        SIZE_CACHE[folder] = {}
+        fcache = join(folder, SIZE_CACHE_FILE)
+        if exists(fcache):
+            try:
+                with open(fcache, 'rb') as fin:
+                    SIZE_CACHE[folder] = pickle.load(fin)
+            except Exception:
+                logger.warning('Ignoring invalid cache of sizes: %s' % fcache)
+    return SIZE_CACHE[folder]
+
+
+def image_size(pathimg):
+    """ Return (width, height) of an image. Sizes are kept in a cache file for each 
+        folder (`.image_sizes.pkl`) and only read again when the image changes.
+        Call `save_image_sizes` to save the cache (done at exit).
+    """
+    folder, fname = split(realpath(pathimg))
+    sizes = _folder_sizes(folder)
+    mtime = getmtime(pathimg)
+    entry = sizes.get(fname)
+    if entry is None or entry[0] != mtime:
+        width, height = read_image_size(pathimg)
+        entry = sizes[fname] = (mtime, width, height)
+        SIZE_CACHE_CHANGED.add(folder)
+    return entry[1], entry[2]
+
+
+def save_image_sizes():
+    """ Save the cache of sizes of the folders that received new images """
+    for folder in SIZE_CACHE_CHANGED:
+        fcache = join(folder, SIZE_CACHE_FILE)
+        try:
+            # protocol 2 is read by Python 2 and 3
+            with open(fcache, 'wb') as fout:
+                pickle.dump(SIZE_CACHE[folder], fout, 2)
+        except (IOError, OSError):
+            logger.warning('Cannot save the cache of sizes: %s' % fcache)
+    SIZE_CACHE_CHANGED.clear()
+atexit.register(save_image_sizes)
+
+
+VOC_TEMPLATE = Template("""<annotations>
+  <folder>JPEGImages</folder>
+  <filename>$filename</filename>
+  <size>
+    <width>$width</width>
+    <height>$height</height>
+    <depth>3</depth>
+  </size>
+  <segmented>0</segmented>
+$objects</annotations>
+""")
+
+VOC_OBJECT_TEMPLATE = Template("""  <object>
+    <name>$name</name>
+    <pose>Unspecified</pose>
+    <truncated>0</truncated>
+    <difficult>0</difficult>
+    <bndbox>
+      <xmin>$xmin</xmin>
+      <ymin>$ymin</ymin>
+      <xmax>$xmax</xmax>
+      <ymax>$ymax</ymax>
+    </bndbox>
+  </object>
+""")
+
+
+def render_voc(filename, width, height, objects):
+    """ Return the XML of an image containing `objects` [(name, xmin, ymin, xmax, ymax), ...] """
+    xml_objects = ''.join([VOC_OBJECT_TEMPLATE.substitute(name=escape(str(name)), xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax)
+                           for name, xmin, ymin, xmax, ymax in objects])
+    return VOC_TEMPLATE.substitute(filename=escape(filename), width=width, height=height, objects=xml_objects)
+
+
+def _write_voc_chunk(args):
+    """ Write the XML files of a chunk of images (see `write_voc_files`) """
+    folderout, images = args
+    for filename, width, height, objects in images:
+        fname, _ = splitext(basename(filename))
+        with open(join(folderout, fname+'.xml'), 'w') as fout:
+            fout.write(render_voc(basename(filename), width, height, objects))
+    return len(images)
+
+
+def write_voc_files(images, folderout, processes=None, chunk_size=500):
+    """ Write an XML file for each image in `folderout` using a pool of processes.
+
+    Parameters:
+    -----------
+    images: array
+        list of (filename, width, height, objects), where `objects` is a list of
+        (name, xmin, ymin, xmax, ymax)
+    folderout: string
+        path to the folder where XML files are saved
+    processes: int
+        number of processes (default: number of cpus)
+    chunk_size: int
+        number of images written by each task
+    """
+    if not exists(folderout):
+        os.makedirs(folderout)
+    jobs = [(folderout, images[i:i+chunk_size]) for i in range(0, len(images), chunk_size)]
+    if processes != 1 and len(jobs) > 1:
+        pool = Pool(processes)
+        nb_files = sum(pool.imap_unordered(_write_voc_chunk, jobs))
+        pool.close()
+        pool.join()
+    else:
+        nb_files = sum(map(_write_voc_chunk, jobs))
+    return nb_files
+
+
+def read_voc(xml_file):
+    """ Read a VOC XML file incrementally.
+
+    Returns:
+    --------
+    (path, width, height, names, boxes), where `path` is the path (or filename) of
+    the image and `boxes` is an array (nb_objects, 4) with [xmin, ymin, xmax, ymax]
+    """
+    filename, path, width, height = '', '', 0, 0
+    names, boxes = [], []
+    for _, elem in ET.iterparse(xml_file):
+        if elem.tag == 'filename':
+            filename = elem.text
+        elif elem.tag == 'path':
+            path = elem.text
+        elif elem.tag == 'size':
+            width, height = int(elem.findtext('width')), int(elem.findtext('height'))
+        elif elem.tag == 'object':
+            names.append(elem.findtext('name'))
+            boxes.append([int(float(elem.findtext('bndbox/'+key))) for key in ['xmin', 'ymin', 'xmax', 'ymax']])
+            elem.clear()
+    return path or filename, width, height, names, np.array(boxes, dtype=np.int64).reshape((-1, 4))
+
+
+def _read_voc_chunk(files):
+    """ Read a chunk of XML files (see `read_voc_files`) """
+    return [read_voc(xml_file) for xml_file in files]
+
+
+def read_voc_files(files, processes=None, chunk_size=500):
+    """ Read a list of VOC XML files using a pool of processes, returning the list
+        of (path, width, height, names, boxes) of each file (see `read_voc`)
+    """
+    jobs = [files[i:i+chunk_size] for i in range(0, len(files), chunk_size)]
+    images = []
+    if processes != 1 and len(jobs) > 1:
+        pool = Pool(processes)
+        for chunk in pool.imap(_read_voc_chunk, jobs):
+            images.extend(chunk)
+        pool.close()
+        pool.join()
+    else:
+        for chunk in map(_read_voc_chunk, jobs):
+            images.extend(chunk)
+    return images
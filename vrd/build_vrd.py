@@ -0,0 +1,213 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+"""
+Build all VRD files in a single pass over the LIS annotation and the Decompressed relations:
+
+- `train.pkl`: list of dictionaries with `img_path`, `classes`, `boxes`, `ix1`, `ix2` and
+  `rel_classes` for each image (see `create_pickle.py`)
+- `gt.pkl` and `gt.npz`: bounding boxes of subjects and objects and their relations for each
+  image (see `create_gt.py`)
+- `so_prior.pkl`: conditional probability of the predicate given the subject and the object
+  (see `create_so_prior.py`)
+- `obj.txt` and `rel.txt`: names of objects and relations sorted by id
+
+Both files are sorted by frame, thus they are read together, joining the relations to the
+objects of the same frame. Configuration and map files are loaded only once and there is no
+pass to count lines or frames. The elapsed time of each step and the amount of data read are
+compared with the separated scripts at the end.
+"""
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+import time
+import argparse
+from os.path import join, dirname, getsize
+
+import filehandler as fh
+import numpy as np
+import cPickle
+
+from create_pickle import save_dictionary
+from create_gt import split_rows
+from create_so_prior import normalize
+
+MISSING_BOX = (-1, -1, -1, -1)
+
+
+class Relations(object):
+    """ Iterate on the frames of a Decompressed file keeping the ids of all relations
+        that are read, which are used to count the relations for `so_prior`.
+    """
+    def __init__(self, filerel, do, dr):
+        self.frels = fh.DecompressedFile(filerel)
+        self.do = do
+        self.dr = dr
+        self.subs, self.rels, self.objs = [], [], []
+        self.path = ''
+
+    def __iter__(self):
+        with self.frels:
+            for idfr, triplets in self.frels.frames():
+                ids = []
+                for sub, rel, obj in triplets:
+                    ids.append((self.do[sub], self.dr[rel], self.do[obj]))
+                    self.subs.append(ids[-1][0])
+                    self.rels.append(ids[-1][1])
+                    self.objs.append(ids[-1][2])
+                yield idfr, ids
+
+    def counts(self):
+        """ Count (subject, object, relation) of all relations that were read """
+        nb_objects, nb_relations = len(self.do), len(self.dr)
+        flat = (np.array(self.subs, dtype=np.int64) * nb_objects + np.array(self.objs, dtype=np.int64)) * nb_relations + np.array(self.rels, dtype=np.int64)
+        counts = np.bincount(flat, minlength=nb_objects*nb_objects*nb_relations)
+        return counts.reshape((nb_objects, nb_objects, nb_relations)).astype('float64')
+# End of Relations class
+
+
+def build_shard(fileobj, filerel, do, dr, index=None):
+    """ Read a LIS file and its Decompressed file once, creating the content of all files.
+
+    Parameters:
+    -----------
+    fileobj: string
+        path to the file containing LIS annotation
+    filerel: string
+        path to the Decompressed file containing relations
+    do: dict
+        dictionary in the form {'object_1': idobj1, 'object_2': idobj2...}
+    dr: dict
+        dictionary in the form {'relation1': idrel1, 'relation2': idrel2...}
+    index: MapIndex
+        index of the map file from KSCGR to VOC dataset (see `MapFile.load_index`)
+
+    Returns:
+    --------
+    dictionary with the keys `info` (content of `train.pkl`), `sub_bboxes`, `obj_bboxes`,
+    `tuple_label` and `offsets` (content of `gt.npz`) and `counts` of relations for `so_prior`
+    """
+    info = []
+    sub_boxes, obj_boxes, labels = [], [], []
+    offsets = [0]
+    nb_missing = 0
+    relations = Relations(filerel, do, dr)
+    itrels = iter(relations)
+    idrel, triplets = next(itrels, (None, []))
+    with fh.LisFile(fileobj) as flis:
+        for idfr, imgname, arr in flis.frames():
+            while idrel is not None and idrel < idfr:
+                idrel, triplets = next(itrels, (None, []))
+            frame_rels = triplets if idrel == idfr else []
+
+            classes, boxes, dor = [], [], {}
+            for obj, x, y, w, h in arr:
+                dor[do[obj]] = len(boxes)
+                classes.append(do[obj])
+                boxes.append([x, y, x+w, y+h]) # [xmin,ymin,xmax,ymax]
+            vsub, vobj, vrel = [], [], []
+            for idsub, idr, idobj in frame_rels:
+                sub_boxes.append(boxes[dor[idsub]] if idsub in dor else MISSING_BOX)
+                obj_boxes.append(boxes[dor[idobj]] if idobj in dor else MISSING_BOX)
+                labels.append((idsub, idr, idobj))
+                if idsub not in dor or idobj not in dor:
+                    nb_missing += 1
+                    continue
+                vsub.append(dor[idsub])
+                vobj.append(dor[idobj])
+                vrel.append([idr])
+            offsets.append(len(labels))
+
+            filepath = index.voc(*fh.kscgr_key(imgname)) if index else imgname
+            info.append({
+                'img_path': filepath,
+                'classes': np.array(classes),
+                'boxes': np.array(boxes),
+                'ix1': np.array(vsub),
+                'ix2': np.array(vobj),
+                'rel_classes': vrel
+            })
+    # consume relations after the last frame of LIS
+    for _ in itrels: pass
+    if nb_missing:
+        logger.warning('{} relations without subject or object annotated in their frames.'.format(nb_missing))
+    return {'info': info,
+            'sub_bboxes': np.array(sub_boxes, dtype=np.int64).reshape((-1, 4)),
+            'obj_bboxes': np.array(obj_boxes, dtype=np.int64).reshape((-1, 4)),
+            'tuple_label': np.array(labels, dtype=np.int64).reshape((-1, 3)),
+            'offsets': np.array(offsets, dtype=np.int64),
+            'counts': relations.counts()}
+
+
+def save_pickle(filename, content):
+    fout = open(filename, 'wb')
+    cPickle.dump(content, fout, cPickle.HIGHEST_PROTOCOL)
+    fout.close()
+    logger.info('Saved content in file: {}'.format(filename))
+
+
+def save_files(folder, shard, do, dr):
+    """ Save `train.pkl`, `gt.pkl`, `gt.npz`, `so_prior.pkl`, `obj.txt` and `rel.txt` of a shard """
+    save_pickle(join(folder, 'train.pkl'), shard['info'])
+    np.savez(join(folder, 'gt.npz'), sub_bboxes=shard['sub_bboxes'], obj_bboxes=shard['obj_bboxes'],
+             tuple_label=shard['tuple_label'], offsets=shard['offsets'])
+    dgt = {}
+    for key in ['sub_bboxes', 'obj_bboxes', 'tuple_label']:
+        dgt[key] = split_rows(shard[key], shard['offsets'])
+    save_pickle(join(folder, 'gt.pkl'), dgt)
+    save_pickle(join(folder, 'so_prior.pkl'), normalize(shard['counts']))
+    save_dictionary(join(folder, 'obj.txt'), do)
+    save_dictionary(join(folder, 'rel.txt'), dr)
+
+
+def build_vrd(fileobj, filerel, output=None, class_file='classes.cfg', rels_file='relations.cfg', map_paths='map_paths.txt'):
+    """
+    Create `train.pkl`, `gt.pkl`, `so_prior.pkl`, `obj.txt` and `rel.txt` files in the
+    `output` folder reading LIS and relation files once.
+    """
+    if not output:
+        output = dirname(fileobj)
+    start = time.time()
+    index = None
+    if map_paths:
+        index = fh.MapFile(map_paths).load_index()
+        logger.info('Loaded index of map file containing {} entries.'.format(len(index)))
+    do = fh.ConfigFile(class_file, background=False).load_classes(cnames=True)
+    logger.info('Loaded dictionary with {} objects.'.format(len(do)))
+    dr = fh.ConfigFile(rels_file).load_classes(cnames=True)
+    logger.info('Loaded dictionary with {} relations.'.format(len(dr)))
+    time_config = time.time() - start
+
+    start = time.time()
+    logger.info('Loading information from files: {} and {}'.format(fileobj, filerel))
+    shard = build_shard(fileobj, filerel, do, dr, index)
+    time_read = time.time() - start
+    logger.info('Processed {} frames with {} relations.'.format(len(shard['info']), len(shard['tuple_label'])))
+
+    start = time.time()
+    save_files(output, shard, do, dr)
+    time_save = time.time() - start
+
+    size_obj, size_rel = getsize(fileobj), getsize(filerel)
+    size_map = getsize(map_paths) if map_paths else 0
+    # create_pickle: 3 passes on relations, 1 on LIS and map
+    # create_gt: 2 passes on relations and 2 on LIS
+    # create_so_prior: 2 passes on relations
+    size_single = size_obj + size_rel + size_map
+    size_separated = 7 * size_rel + 3 * size_obj + size_map
+    logger.info('Time loading configuration: {:.2f}s'.format(time_config))
+    logger.info('Time reading and processing: {:.2f}s'.format(time_read))
+    logger.info('Time saving files: {:.2f}s'.format(time_save))
+    logger.info('Read {:.2f} MB instead of {:.2f} MB of the separated scripts.'.format(size_single / 1e6, size_separated / 1e6))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('objfile', metavar='file_objects', help='Path to the file containing LIS annotation.')
+    parser.add_argument('relfile', metavar='file_relations', help='Path to the file containing Decompressed relations between objects.')
+    parser.add_argument('-o', '--output', help='Folder to save the files.')
+    parser.add_argument('-c', '--cfg_objects', help='File containing ids and their classes', default='classes.cfg')
+    parser.add_argument('-r', '--cfg_relations', help='File containing ids and their relations', default='relations.cfg')
+    parser.add_argument('-m', '--map_voc', help='File containing a mapping between LIS and VOC', default='map_paths.txt')
+    args = parser.parse_args()
+
+    build_vrd(args.objfile, args.relfile, args.output, args.cfg_objects, args.cfg_relations, args.map_voc)
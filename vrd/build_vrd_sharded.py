@@ -0,0 +1,148 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+"""
+Build the VRD files (`train.pkl`, `gt.pkl`, `gt.npz`, `so_prior.pkl`, `obj.txt` and `rel.txt`)
+of several (split, recipe) shards in parallel. The input file contains one shard per line
+with the path to the LIS annotation and the path to the Decompressed relations, as:
+
+```
+data1/boild-egg/Bounding_Boxes_Annotation.txt relations/data1/boild-egg.txt
+data1/ham-egg/Bounding_Boxes_Annotation.txt relations/data1/ham-egg.txt
+...
+data7/scramble-egg/Bounding_Boxes_Annotation.txt relations/data7/scramble-egg.txt
+```
+
+Each shard is processed by a process of the pool (see `build_vrd.build_shard`) and saved as a
+partial file in `<output>/shards/`. Shards are merged in the order of the input file, thus the
+index of each image does not depend on the order in which the shards finished.
+"""
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+import os
+import sys
+import time
+import shutil
+import argparse
+from os.path import join, dirname, exists
+from multiprocessing import Pool
+
+import filehandler as fh
+import numpy as np
+import cPickle
+
+from build_vrd import build_shard, save_files
+
+# configuration shared by the processes of the pool
+CONFIG = {}
+
+
+def load_shards(inputfile):
+    """ Load the list of (LIS file, relations file) from the input file """
+    shards = []
+    with open(inputfile) as fin:
+        for i, line in enumerate(fin):
+            arr = line.strip().split()
+            if not arr or arr[0].startswith('#'): continue
+            if len(arr) != 2:
+                logger.error('Malformed line in input file! [LINE: {}]'.format(i))
+                sys.exit()
+            shards.append((arr[0], arr[1]))
+    return shards
+
+
+def init_worker(do, dr, index_folder):
+    """ Each process opens the memory-mapped index of the map file, sharing its pages """
+    index = fh.MapIndex(index_folder) if index_folder else None
+    CONFIG.update({'do': do, 'dr': dr, 'index': index})
+
+
+def process_shard(args):
+    """ Build a single shard saving its content in `fileshard` """
+    index, fileobj, filerel, fileshard = args
+    start = time.time()
+    shard = build_shard(fileobj, filerel, CONFIG['do'], CONFIG['dr'], CONFIG['index'])
+    fout = open(fileshard, 'wb')
+    cPickle.dump(shard, fout, cPickle.HIGHEST_PROTOCOL)
+    fout.close()
+    return index, fileshard, len(shard['info']), time.time() - start
+
+
+def merge_shards(files, nb_objects, nb_relations):
+    """ Concatenate the content of shard files in the order of `files`. Without shards,
+        arrays are empty and `counts` has zeros in the shape (`nb_objects`, `nb_objects`, `nb_relations`).
+    """
+    info = []
+    counts = np.zeros((nb_objects, nb_objects, nb_relations), dtype=np.float64)
+    arrays = {'sub_bboxes': [np.zeros((0, 4), dtype=np.int64)],
+              'obj_bboxes': [np.zeros((0, 4), dtype=np.int64)],
+              'tuple_label': [np.zeros((0, 3), dtype=np.int64)]}
+    offsets = [np.zeros(1, dtype=np.int64)]
+    for fileshard in files:
+        with open(fileshard, 'rb') as fin:
+            shard = cPickle.load(fin)
+        info.extend(shard['info'])
+        for key in arrays:
+            arrays[key].append(shard[key])
+        offsets.append(shard['offsets'][1:] + offsets[-1][-1])
+        counts += shard['counts']
+    merged = dict((key, np.concatenate(arrays[key])) for key in arrays)
+    merged.update({'info': info, 'offsets': np.concatenate(offsets), 'counts': counts})
+    return merged
+
+
+def build_sharded(inputfile, output=None, class_file='classes.cfg', rels_file='relations.cfg',
+                  map_paths='map_paths.txt', processes=None, keep_shards=False):
+    """
+    Build the VRD files of all shards of `inputfile` in a pool of `processes`.
+    """
+    if not output:
+        output = dirname(inputfile)
+    folder_shards = join(output, 'shards')
+    if not exists(folder_shards):
+        os.makedirs(folder_shards)
+
+    index_folder = None
+    if map_paths:
+        index = fh.MapFile(map_paths).load_index()
+        logger.info('Loaded index of map file containing {} entries.'.format(len(index)))
+        index_folder = index.folder
+    do = fh.ConfigFile(class_file, background=False).load_classes(cnames=True)
+    logger.info('Loaded dictionary with {} objects.'.format(len(do)))
+    dr = fh.ConfigFile(rels_file).load_classes(cnames=True)
+    logger.info('Loaded dictionary with {} relations.'.format(len(dr)))
+
+    shards = load_shards(inputfile)
+    logger.info('Building {} shards.'.format(len(shards)))
+    jobs = [(i, fileobj, filerel, join(folder_shards, '{:04d}.pkl'.format(i)))
+            for i, (fileobj, filerel) in enumerate(shards)]
+    start = time.time()
+    files = [None] * len(jobs)
+    pool = Pool(processes, initializer=init_worker, initargs=(do, dr, index_folder))
+    for i, fileshard, nb_frames, elapsed in pool.imap_unordered(process_shard, jobs):
+        files[i] = fileshard
+        logger.info('Shard {} ({} frames) built in {:.2f}s: {}'.format(i, nb_frames, elapsed, shards[i][0]))
+    pool.close()
+    pool.join()
+    logger.info('Built all shards in {:.2f}s'.format(time.time() - start))
+
+    start = time.time()
+    merged = merge_shards(files, len(do), len(dr))
+    logger.info('Merged {} frames with {} relations in {:.2f}s'.format(len(merged['info']), len(merged['tuple_label']), time.time() - start))
+    save_files(output, merged, do, dr)
+    if not keep_shards:
+        shutil.rmtree(folder_shards)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inputfile', metavar='file_shards', help='File containing a LIS file and a relations file per line.')
+    parser.add_argument('-o', '--output', help='Folder to save the files.')
+    parser.add_argument('-c', '--cfg_objects', help='File containing ids and their classes', default='classes.cfg')
+    parser.add_argument('-r', '--cfg_relations', help='File containing ids and their relations', default='relations.cfg')
+    parser.add_argument('-m', '--map_voc', help='File containing a mapping between LIS and VOC', default='map_paths.txt')
+    parser.add_argument('-p', '--processes', help='Number of processes', type=int, default=None)
+    parser.add_argument('-k', '--keep_shards', help='Keep the partial files of each shard', action='store_true')
+    args = parser.parse_args()
+
+    build_sharded(args.inputfile, args.output, args.cfg_objects, args.cfg_relations, args.map_voc, args.processes, args.keep_shards)
@@ -12,6 +12,10 @@ Create `gt.pkl` containing a Python dictionary with the following keys:
 'tuple_label': tuple with the ids of subject, relation and object for each element in the image
     d['tuple_label'].shape == (1, nb_images)
     d['tuple_label'][0][N].shape == (nb_relations, REL), where REL = [isubj, irel, iobj]
+
+The same content is saved in `gt.npz` as flat arrays (CSR layout), where the relations of
+the image N are in the rows `offsets[N]:offsets[N+1]` of `sub_bboxes`, `obj_bboxes` and 
+`tuple_label`. Boxes of subjects or objects that are not annotated in the image are [-1,-1,-1,-1].
 """
 import logging
 logger = logging.getLogger(__name__)
@@ -27,13 +31,6 @@ import operator
 
 import progressbar as pbar 
 
-def add_element(element, vec):
-    if not len(element):
-        element = np.array([vec])
-    else:
-        element = np.append(element, [vec], axis=0)
-    return element
-
 def load_relations(file_relations, do, dr, dmap=None, home=None):
     """ Returns a dictionary containing the form
     drels[path_img] = [(idsub1, idrel1, idobj1), (idsub2, idrel2, idobj2),...]
@@ -70,16 +67,67 @@ def load_relations(file_relations, do, dr, dmap=None, home=None):
     return dic_rels
 
 
+def index_boxes(flis, do, dic_rels):
+    """ Read all frames of a LIS file indexing their boxes by class id.
+
+    Returns:
+    --------
+    (lut, boxes, rels, frames) where `boxes` contains [xmin, ymin, xmax, ymax] of each object,
+    `lut[N, idclass]` is the row in `boxes` of the object of class `idclass` in the frame N 
+    (-1 if not annotated), `rels` contains [idsub, idrel, idobj] of all relations and `frames`
+    contains the frame of each relation.
+    """
+    box_frame, box_class, boxes = [], [], []
+    rels, frames = [], []
+    nb_frames = 0
+    pb = pbar.ProgressBar(flis.nb_frames())
+    with flis:
+        for pathimg, arr in flis.iterate_frames():
+            for obj, x, y, w, h in arr:
+                box_frame.append(nb_frames)
+                box_class.append(do[obj])
+                boxes.append((x, y, x+w, y+h))
+            for relation in dic_rels.get(pathimg, []):
+                rels.append(relation)
+                frames.append(nb_frames)
+            nb_frames += 1
+            pb.update()
+    print
+    boxes = np.array(boxes, dtype=np.int64).reshape((-1, 4))
+    rels = np.array(rels, dtype=np.int64).reshape((-1, 3))
+    frames = np.array(frames, dtype=np.int64)
+    # when a class appears twice in a frame, keep the last box
+    keys = np.array(box_frame, dtype=np.int64) * len(do) + np.array(box_class, dtype=np.int64)
+    _, last = np.unique(keys[::-1], return_index=True)
+    last = len(keys) - 1 - last
+    lut = np.full(nb_frames * len(do), -1, dtype=np.int64)
+    lut[keys[last]] = last
+    return lut.reshape((nb_frames, len(do))), boxes, rels, frames
+
+
+def split_rows(flat, offsets):
+    """ Convert a flat array into an object array with the rows of each image """
+    parts = np.empty(len(offsets)-1, dtype=object)
+    for i in range(len(parts)):
+        parts[i] = flat[offsets[i]:offsets[i+1]]
+    return parts
+
+
+def load_gt(filename):
+    """ Load the flat arrays of `gt.npz` as a dictionary """
+    with np.load(filename) as data:
+        return dict((key, data[key]) for key in data.files)
+
+
 def create_gt_pickle(fileobj, filerel, output=None, class_file='classes.cfg', rels_file='relations.cfg'):
     """
-    Create a `gt.pkl` file containing the relationship between subjects and objects. 
+    Create a `gt.pkl` file containing the relationship between subjects and objects,
+    as well as the flat arrays of `gt.npz`.
 
     TODO: Implement relations for two objects of the same class in the same image
     """  
     if not output:
         output = join(dirname(fileobj), 'gt.pkl')
-
-    dgt = {'sub_bboxes': [], 'obj_bboxes': [], 'tuple_label': []}
    
     # Load classes for objects from dict {0: 'rel0', 1: 'rel1'}
     # DO NOT LOAD `__background__`. Thus, id_person=0
@@ -87,55 +135,34 @@ def create_gt_pickle(fileobj, filerel, output=None, class_file='classes.cfg', re
     logger.info('Loaded dictionary with {} objects.'.format(len(do)))
     dr = fh.ConfigFile(rels_file).load_classes(cnames=True)
     logger.info('Loaded dictionary with {} relations.'.format(len(dr)))
-    '''
-    dic_rels = defaultdict(list) # relations for each image
-    logger.info('Loading information from file: {}'.format(filerel))
-    filerls = fh.DecompressedFile(filerel)
-    pb = pbar.ProgressBar(filerls.nb_lines())
-    with filerls as frels:
-        for fr, o1, r, o2, path in frels:
-            idsub = do[o1]
-            idrel = dr[r]
-            idobj = do[o2]
-            pathimg = join(path, str(fr)+'.jpg')
-            dic_rels[pathimg].append((idsub, idrel, idobj))
-            pb.update()
-    '''
     dic_rels = load_relations(filerel, do, dr)
     print
     # Load objects
     logger.info('Loading information from file: {}'.format(fileobj))
-    flis = fh.LisFile(fileobj)
-    nb_frames = flis.nb_frames()
-    pb = pbar.ProgressBar(nb_frames)
-    logger.info('Processing {} frames.'.format(nb_frames))
-    with flis as fin:
-        for pathimg, arr in flis.iterate_frames():
-            sub_boxes, obj_boxes, vrels = [], [], []
-            for idsub, idrel, idobj in dic_rels[pathimg]:
-                relation = np.array([idsub, idrel, idobj])
-                for i in range(len(arr)):
-                    obj, x, y, w, h = arr[i]
-                    iobj = do[obj]
-                    if iobj == idsub:
-                        bbox_sub = np.array([x, y, x+w, y+h])
-                    if iobj == idobj:
-                        bbox_obj = np.array([x, y, x+w, y+h])
-                sub_boxes = add_element(sub_boxes, bbox_sub)
-                obj_boxes = add_element(obj_boxes, bbox_obj)
-                vrels = add_element(vrels, relation)
-                   
-            dgt['sub_bboxes'].append(sub_boxes)
-            dgt['obj_bboxes'].append(obj_boxes)
-            dgt['tuple_label'].append(vrels)
-            pb.update()
-    
-    dgt['sub_bboxes'] = np.array(dgt['sub_bboxes'])
-    dgt['obj_bboxes'] = np.array(dgt['obj_bboxes'])
-    dgt['tuple_label'] = np.array(dgt['tuple_label'])
+    lut, boxes, rels, frames = index_boxes(fh.LisFile(fileobj), do, dic_rels)
+    nb_frames = lut.shape[0]
+    logger.info('Processed {} frames with {} relations.'.format(nb_frames, len(rels)))
+
+    offsets = np.zeros(nb_frames+1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(frames, minlength=nb_frames))
+    # add a row for missing boxes at the end
+    boxes = np.vstack([boxes, np.full((1, 4), -1, dtype=np.int64)])
+    sub_boxes = boxes[lut[frames, rels[:, 0]]]
+    obj_boxes = boxes[lut[frames, rels[:, 2]]]
+    nb_missing = np.sum(lut[frames, rels[:, 0]] < 0) + np.sum(lut[frames, rels[:, 2]] < 0)
+    if nb_missing:
+        logger.warning('{} subjects or objects of relations are not annotated in their frames.'.format(nb_missing))
+
+    fcsr = splitext(output)[0]+'.npz'
+    np.savez(fcsr, sub_bboxes=sub_boxes, obj_bboxes=obj_boxes, tuple_label=rels, offsets=offsets)
+    logger.info('Saved flat arrays in file: {}'.format(fcsr))
+
+    dgt = {'sub_bboxes': split_rows(sub_boxes, offsets),
+           'obj_bboxes': split_rows(obj_boxes, offsets),
+           'tuple_label': split_rows(rels, offsets)}
     logger.info('Saving pickle file...')
     fout = open(output, 'wb')
-    cPickle.dump(dgt, fout)
+    cPickle.dump(dgt, fout, cPickle.HIGHEST_PROTOCOL)
     fout.close()
     logger.info('Saved content in file: {}'.format(output))
     
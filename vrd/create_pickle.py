@@ -21,13 +21,17 @@ with the following keys:
     : array : [1, 2, 1, 3, 1]
 'rel_classes': the relationship for a subject-object pair.
     : array : [[26], [15], [0], [10], [0]]
+
+By default, records are written as they are processed in shards of `chunk_size` records in
+the `train/` folder (see `ShardWriter`), keeping the memory constant for any size of dataset.
+`fh.ShardReader('train')` reads the records as a list. Use `--single` to save a single
+`train.pkl` file.
 """
 import logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 import argparse
 from os.path import join, dirname, splitext, basename
-from collections import defaultdict
 
 import filehandler as fh
 import numpy as np
@@ -46,7 +50,8 @@ def save_dictionary(filename, dic):
             fout.write('{}\n'.format(key))
 
 
-def main(fileobj, filerel, output=None, class_file='classes.cfg', rels_file='relations.cfg', map_paths='map_paths.txt'):
+def main(fileobj, filerel, output=None, class_file='classes.cfg', rels_file='relations.cfg', map_paths='map_paths.txt',
+         chunk_size=1000, single=False):
     """
     Create a `train.pkl` or 'test.pkl` file containing the relationship between objects. 
 
@@ -58,10 +63,8 @@ def main(fileobj, filerel, output=None, class_file='classes.cfg', rels_file='rel
     fdicrel = join(dirname(output), 'rel.txt')
 
     if map_paths:
-        fmap = fh.MapFile(map_paths)
-        dmap = fmap.load_dictionary(key='kscgr')
-        logger.info('Loaded map file containing {} entries.'.format(len(dmap)))
-        home = fmap.path
+        index = fh.MapFile(map_paths).load_index()
+        logger.info('Loaded index of map file containing {} entries.'.format(len(index)))
    
     # Load classes for objects from dict {0: 'rel0', 1: 'rel1'}
     # DO NOT LOAD `__background__`. Thus, id_person=0
@@ -70,32 +73,28 @@ def main(fileobj, filerel, output=None, class_file='classes.cfg', rels_file='rel
     dr = fh.ConfigFile(rels_file).load_classes(cnames=True)
     logger.info('Loaded dictionary with {} relations.'.format(len(dr)))
 
-    dic_rels = defaultdict(list) # relations for each image
-    logger.info('Loading information from file: {}'.format(filerel))
+    if single:
+        info = []
+        add_record = info.append
+    else:
+        writer = fh.ShardWriter(splitext(output)[0], chunk_size=chunk_size)
+        add_record = writer.add
+    # Both files are sorted by frame, thus relations are joined to the objects of the same frame
+    logger.info('Loading information from files: {} and {}'.format(fileobj, filerel))
     filerls = fh.DecompressedFile(filerel)
-    pb = pbar.ProgressBar(filerls.nb_lines())
-
-    with filerls as frels:
-        for fr, o1, r, o2, path in frels:
-            idsub = do[o1]
-            idrel = dr[r]
-            idobj = do[o2]
-            pathimg = join(path, str(fr)+'.jpg')
-            if map_paths:
-                pathimg = dmap[join(home, pathimg)]
-            dic_rels[pathimg].append((idsub, idrel, idobj))
-            pb.update()
-    print 
-    info = []
-    # Load objects
-    logger.info('Loading information from file: {}'.format(fileobj))
     flis = fh.LisFile(fileobj)
     nb_frames = filerls.nb_frames()
     pb = pbar.ProgressBar(nb_frames)
     logger.info('Processing {} frames.'.format(nb_frames))
-    with flis as fin:
-        for imgname, arr in flis.iterate_frames():
-            filepath = dmap[join(home, imgname)]
+    with flis, filerls:
+        itrels = filerls.frames()
+        idrel, triplets = next(itrels, (None, []))
+        for idfr, imgname, arr in flis.frames():
+            while idrel is not None and idrel < idfr:
+                idrel, triplets = next(itrels, (None, []))
+            frame_rels = triplets if idrel == idfr else []
+
+            filepath = index.voc(*fh.kscgr_key(imgname)) if map_paths else imgname
             classes, boxes = [], []
             vsub, vobj, vrel = [], [], []
             dor = {}
@@ -104,13 +103,13 @@ def main(fileobj, filerel, output=None, class_file='classes.cfg', rels_file='rel
                 iobj = do[obj]
                 dor[iobj] = i
                 classes.append(iobj)
-                boxes.append([x, y, x+w, y+w]) # [xmin,ymin,xmax,ymax]
-            for idsub, idrel, idobj in dic_rels[filepath]:
-                vsub.append(dor[idsub])
-                vobj.append(dor[idobj])
-                vrel.append([idrel])
+                boxes.append([x, y, x+w, y+h]) # [xmin,ymin,xmax,ymax]
+            for sub, rel, obj in frame_rels:
+                vsub.append(dor[do[sub]])
+                vobj.append(dor[do[obj]])
+                vrel.append([dr[rel]])
             
-            info.append({
+            add_record({
                 'img_path': filepath,
                 'classes': np.array(classes),
                 'boxes': np.array(boxes),
@@ -120,11 +119,15 @@ def main(fileobj, filerel, output=None, class_file='classes.cfg', rels_file='rel
             })
             pb.update()
     
-    logger.info('Saving pickle file...')
-    fout = open(output, 'wb')
-    cPickle.dump(info, fout)
-    fout.close()
-    logger.info('Saved content in file: {}'.format(output))
+    if single:
+        logger.info('Saving pickle file...')
+        fout = open(output, 'wb')
+        cPickle.dump(info, fout, cPickle.HIGHEST_PROTOCOL)
+        fout.close()
+        logger.info('Saved content in file: {}'.format(output))
+    else:
+        writer.close()
+        logger.info('Saved {} records in {} shards in folder: {}'.format(len(writer), len(writer.sizes), writer.folder))
 
     save_dictionary(fdicobj, do)
     save_dictionary(fdicrel, dr)
@@ -138,7 +141,9 @@ if __name__ == "__main__":
     parser.add_argument('-c', '--cfg_objects', help='File containing ids and their classes', default='classes.cfg')
     parser.add_argument('-r', '--cfg_relations', help='File containing ids and their relations', default='relations.cfg')
     parser.add_argument('-m', '--map_voc', help='File containing a mapping between LIS and VOC', default='map_paths.txt')
+    parser.add_argument('-n', '--chunk_size', help='Number of records in each shard', type=int, default=1000)
+    parser.add_argument('-s', '--single', help='Save all records in a single pickle file', action='store_true')
     args = parser.parse_args()
 
-    main(args.objfile, args.relfile, args.output, args.cfg_objects, args.cfg_relations, args.map_voc)
+    main(args.objfile, args.relfile, args.output, args.cfg_objects, args.cfg_relations, args.map_voc, args.chunk_size, args.single)
 
@@ -13,6 +13,11 @@ The output file is represented as a dictionary containing the following keys:
 'cls' : class of each bounding box
     dic['cls'].shape == (nb_images,)
     dic['cls'].shape == (nb_bboxes, 1), where 1 is the class id
+
+The proposals are saved as a folder (`proposal/`) of flat arrays `confs.npy`, `boxes.npy`,
+`cls.npy` and `frames.npy` containing the rows of all images, where `offsets.npy` keeps the
+rows of each image (see `FlatStore`). Use `load_proposals` to access them with the same
+structure of `proposal.pkl`, which is only saved with the `--save_pickle` option.
 """
 import logging
 logger = logging.getLogger(__name__)
@@ -22,46 +27,48 @@ import numpy as np
 import cPickle
 from os.path import join, dirname, splitext, basename
 
-import progressbar as pbar
 import filehandler as fh
 
-def add_element(element, vec, type=np.uint32):
-    if not len(element):
-        element = np.array([vec], dtype=type)
-    else:
-        element = np.append(element, [vec], axis=0)
-    return element
+def load_proposals(folder, mmap_mode='r'):
+    """ Load the proposals saved by `prediction_to_proposals` with the structure of 
+        `proposal.pkl`, where each image contains a view of the flat arrays.
+    """
+    store = fh.FlatStore(folder, mmap_mode=mmap_mode)
+    dpkl = {}
+    for key in ['confs', 'boxes', 'cls']:
+        dpkl[key] = np.empty(len(store), dtype=object)
+        for i in range(len(store)):
+            dpkl[key][i] = store.rows(key, i)
+    return dpkl
+
 
-def prediction_to_proposals(inputfile, output=None, class_file='classes.cfg', rels_file='relations.cfg'):
+def prediction_to_proposals(inputfile, output=None, class_file='classes.cfg', rels_file='relations.cfg', save_pickle=False):
     """
-    Create a `proposal.pkl` file containing bounding boxes and probabilities from predictions. 
+    Create a `proposal` folder containing flat arrays with bounding boxes and probabilities 
+    from predictions. With `save_pickle=True`, the `proposal.pkl` file is also created.
     """
-    dpkl = {'confs': [], 'boxes': [], 'cls': []}
     if not output:
-        output = join(dirname(inputfile), 'proposal.pkl')
+        output = join(dirname(inputfile), 'proposal')
+    output = splitext(output)[0]
+
+    preds = fh.PredictionFile(inputfile).load_arrays()
+    logger.info('Loaded {} proposals of {} frames.'.format(len(preds.data), len(preds)))
+
+    fh.FlatStore.save(output, preds.offsets, 
+                      frames=preds.data['frame'],
+                      confs=preds.data['score'],
+                      boxes=preds.boxes().astype(np.uint32),
+                      cls=preds.data['id_class'].astype(np.uint32))
+    logger.info('Saved proposals in folder: {}'.format(output))
 
-    with fh.PredictionFile(inputfile) as fpred:
-        pb = pbar.ProgressBar(fpred.nb_frames())
-        for idfr, arr in fpred.iterate_frames():
-            bbox, scores, classes = [], [], []
-            for id_class, xmin, ymin, xmax, ymax, score in arr:
-                bbox = add_element(bbox, [xmin, ymin, xmax, ymax])
-                scores = add_element(scores, score, type=np.float32)
-                classes = add_element(classes, id_class)
-            dpkl['confs'].append(scores)
-            dpkl['boxes'].append(bbox)
-            dpkl['cls'].append(classes)
-            pb.update()
-    dpkl['confs'] = np.array(dpkl['confs'])
-    dpkl['boxes'] = np.array(dpkl['boxes'])
-    dpkl['cls'] = np.array(dpkl['cls'])
-    
-    logger.info('Saving pickle file...')
-    fout = open(output, 'wb')
-    cPickle.dump(dpkl, fout)
-    fout.close()
-    logger.info('Saved content in file: {}'.format(output))
-    
+    if save_pickle:
+        dpkl = load_proposals(output, mmap_mode=None)
+        logger.info('Saving pickle file...')
+        fout = open(output+'.pkl', 'wb')
+        cPickle.dump(dpkl, fout, cPickle.HIGHEST_PROTOCOL)
+        fout.close()
+        logger.info('Saved content in file: {}'.format(output+'.pkl'))
+    return output
 
 
 if __name__ == "__main__":
@@ -70,7 +77,8 @@ if __name__ == "__main__":
     parser.add_argument('-o', '--output', help='Path to the file to save the conditional probabilities.')
     parser.add_argument('-c', '--class_file', help='File containing ids and their classes', default='classes.cfg')
     parser.add_argument('-r', '--relation_file', help='File containing ids and their relations', default='relations.cfg')
+    parser.add_argument('--save_pickle', help='Save also the `proposal.pkl` file', action='store_true')
     args = parser.parse_args()
 
-    prediction_to_proposals(args.inputfile, args.output)
+    prediction_to_proposals(args.inputfile, args.output, save_pickle=args.save_pickle)
 
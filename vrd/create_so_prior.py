@@ -10,12 +10,17 @@ Each cell contains the probability of a relation be associated with two objects
 For example, if we want to calculate p(hold|person, spoon), we should find all the relationships describing 
 person and spoon `<person, *, spoon>` (M) and the exact relationships `<person, hold, spoon>` (N). Thus, the
 probability `p(hold|person, spoon)` is acquired as by dividing `N` by `M` (\frac{N}{M}).
+
+The input can be a single file or a folder of files containing relations. Each file is parsed into
+arrays of ids and counted with `np.bincount` over the flattened (subject, object, predicate) index 
+in a pool of processes. The partial counts are summed and normalized at once.
 """
 import logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 import argparse
-from os.path import join, dirname, splitext, basename
+from os.path import join, dirname, splitext, basename, isdir
+from multiprocessing import Pool
 
 #import progressbar as pb
 import filehandler as fh
@@ -24,9 +29,62 @@ import cPickle
 
 import progressbar as pbar
 
-def main(inputfile, output=None, class_file='classes.cfg', rels_file='relations.cfg'):
+def count_file(args):
+    """ Count the (subject, object, relation) triplets of a single file.
+
+    Parameters:
+    -----------
+    args: tuple
+        (inputfile, do, dr), where `inputfile` is the path to the Decompressed file,
+        `do` is the dictionary of objects and `dr` is the dictionary of relations
+
+    Returns:
+    --------
+    (counts, nb_relations) where `counts` has shape (nb_objects, nb_objects, nb_relations)
+    """
+    inputfile, do, dr = args
+    _, subs, rels, objs = fh.DecompressedFile(inputfile).to_arrays(do, dr)
+    nb_objects, nb_relations = len(do), len(dr)
+    flat = (subs * nb_objects + objs) * nb_relations + rels
+    counts = np.bincount(flat, minlength=nb_objects*nb_objects*nb_relations)
+    return counts.reshape((nb_objects, nb_objects, nb_relations)), len(flat)
+
+
+def count_files(inputs, do, dr, processes=None):
+    """ Sum the counts of (subject, object, relation) of a list of files 
+        processing each file in a pool of `processes`.
+    """
+    counts = np.zeros((len(do), len(do), len(dr)), dtype='float64')
+    jobs = [(inputfile, do, dr) for inputfile in inputs]
+    pool = None
+    if processes != 1 and len(jobs) > 1:
+        pool = Pool(processes)
+        results = pool.imap_unordered(count_file, jobs)
+    else:
+        results = map(count_file, jobs)
+    pb = pbar.ProgressBar(len(jobs))
+    nb_lines = 0
+    for partial, nb in results:
+        counts += partial
+        nb_lines += nb
+        pb.update()
+    if pool:
+        pool.close()
+        pool.join()
+    logger.info('Processed {} relations from {} files.'.format(nb_lines, len(jobs)))
+    return counts
+
+
+def normalize(counts):
+    """ Convert counts of (subject, object, relation) into p(relation|subject, object) """
+    objsub = counts.sum(axis=2, keepdims=True)
+    return np.divide(counts, objsub, out=np.zeros_like(counts), where=objsub!=0)
+
+
+def main(inputfile, output=None, class_file='classes.cfg', rels_file='relations.cfg', processes=None):
     """
     Create a `so_prior.pkl` file containing the relationship between objects. 
+    `inputfile` can be a file or a folder containing files with relations.
     """  
     if not output:
         output = join(dirname(inputfile), 'so_prior.pkl')
@@ -37,43 +95,28 @@ def main(inputfile, output=None, class_file='classes.cfg', rels_file='relations.
     logger.info('Loaded dictionary with {} objects.'.format(len(do)))
     dr = fh.ConfigFile(rels_file).load_classes(cnames=True)
     logger.info('Loaded dictionary with {} relations.'.format(len(dr)))
+    logger.info('Matrix of objects and relations with shape: {}'.format((len(do), len(do), len(dr))))
+
+    if isdir(inputfile):
+        inputs = list(fh.FolderHandler(inputfile))
+    else:
+        inputs = [inputfile]
+    logger.info('Loading information from {} files.'.format(len(inputs)))
+    so_prior = normalize(count_files(inputs, do, dr, processes))
 
-    so_prior = np.zeros((len(do), len(do), len(dr)), dtype='float64')
-    objsub = np.zeros((len(do), len(do)), dtype='float64')
-    logger.info('Matrix of objects and relations with shape: {}'.format(so_prior.shape))
-    logger.info('Matrix of only objects with shape: {}'.format(objsub.shape))
-
-    filerels = fh.DecompressedFile(inputfile)
-    logger.info('Loading information from file: {}'.format(inputfile))
-    nb_lines = filerels.nb_lines()
-    pb = pbar.ProgressBar(nb_lines)
-    logger.info('Processing {} lines...'.format(nb_lines))
-    with filerels as frels:
-        for arr in frels:
-            fr, o1, r, o2 = arr[0], arr[1], arr[2], arr[3]
-            idsub = do[o1]
-            idrel = dr[r]
-            idobj = do[o2]
-            so_prior[idsub][idobj][idrel] += 1
-            objsub[idsub][idobj] += 1
-            pb.update()
-    print
-    for i in range(so_prior.shape[2]):
-        so_prior[:,:,i] = np.divide(so_prior[:,:,i], objsub, out=np.zeros_like(so_prior[:,:,i]), where=objsub!=0)
-    
     fout = open(output, 'wb')
-    cPickle.dump(so_prior, fout)
+    cPickle.dump(so_prior, fout, cPickle.HIGHEST_PROTOCOL)
     fout.close()
     logger.info('Saved content in file: {}'.format(output))
     
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument('inputfile', metavar='relations_file', help='Path to the file containing relations between objects.')
+    parser.add_argument('inputfile', metavar='relations_file', help='Path to the file (or folder of files) containing relations between objects.')
     parser.add_argument('-o', '--output', help='Path to the file to save the conditional probabilities.')
     parser.add_argument('-c', '--class_file', help='File containing ids and their classes', default='classes.cfg')
     parser.add_argument('-r', '--relation_file', help='File containing ids and their relations', default='relations.cfg')
+    parser.add_argument('-p', '--processes', help='Number of processes', type=int, default=None)
     args = parser.parse_args()
 
-    main(args.inputfile, args.output)
-
+    main(args.inputfile, args.output, args.class_file, args.relation_file, args.processes)
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+"""
+Create a store (see `FlatStore`) with spatial features of every ordered pair (subject, object)
+of boxes of each image, read from `train.pkl`, the `train/` folder of shards, `proposal.pkl`
+or the `proposal/` folder. The store contains the following arrays, where the pairs of the
+image N are in `offsets[N]:offsets[N+1]`:
+
+'sub': index of the subject box in the image
+'obj': index of the object box in the image
+'union': union box [xmin,ymin,xmax,ymax] of subject and object
+'delta': offsets of the subject relative to the object [dx/w, dy/h, log(ws/wo), log(hs/ho)]
+'iou': intersection over union of subject and object
+
+Features of all pairs of a chunk of images are computed at once. Use `load_features` to
+read the store, which is only created again when the input file changes.
+"""
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+import os
+import argparse
+from os.path import join, exists, isdir, splitext, getmtime
+
+import filehandler as fh
+import numpy as np
+import cPickle
+
+from predict_prior import frame_pairs
+
+
+def iterate_boxes(inputfile):
+    """ Yield the boxes [xmin,ymin,xmax,ymax] of each image of `inputfile` """
+    if isdir(inputfile) and exists(join(inputfile, 'offsets.npy')):
+        store = fh.FlatStore(inputfile)
+        for i in range(len(store)):
+            yield store.rows('boxes', i)
+        return
+    if isdir(inputfile):
+        records = fh.ShardReader(inputfile)
+    else:
+        with open(inputfile, 'rb') as fin:
+            records = cPickle.load(fin)
+    if isinstance(records, dict):
+        for boxes in records['boxes']:
+            yield boxes
+    else:
+        for record in records:
+            yield record['boxes']
+
+
+def pair_features(boxes, sizes):
+    """ Compute the spatial features of all ordered pairs of boxes of a chunk of images.
+
+    Parameters:
+    -----------
+    boxes: array
+        array (nb_boxes, 4) with the boxes of all images
+    sizes: array
+        number of boxes of each image
+
+    Returns:
+    --------
+    dictionary with `sub`, `obj`, `union`, `delta` and `iou` of all pairs and the
+    number of pairs of each image (`nb_pairs`)
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape((-1, 4))
+    sizes = np.asarray(sizes, dtype=np.int64)
+    image, i, j = frame_pairs(sizes)
+    starts = np.cumsum(sizes) - sizes
+    s, o = boxes[starts[image] + i], boxes[starts[image] + j]
+
+    ws = np.maximum(s[:, 2] - s[:, 0] + 1, 1.)
+    hs = np.maximum(s[:, 3] - s[:, 1] + 1, 1.)
+    wo = np.maximum(o[:, 2] - o[:, 0] + 1, 1.)
+    ho = np.maximum(o[:, 3] - o[:, 1] + 1, 1.)
+    union = np.hstack([np.minimum(s[:, :2], o[:, :2]), np.maximum(s[:, 2:], o[:, 2:])])
+    delta = np.column_stack([(s[:, 0] - o[:, 0]) / wo, (s[:, 1] - o[:, 1]) / ho, np.log(ws / wo), np.log(hs / ho)])
+    iw = np.maximum(np.minimum(s[:, 2], o[:, 2]) - np.maximum(s[:, 0], o[:, 0]) + 1, 0.)
+    ih = np.maximum(np.minimum(s[:, 3], o[:, 3]) - np.maximum(s[:, 1], o[:, 1]) + 1, 0.)
+    inter = iw * ih
+    return {'sub': i.astype(np.int32), 'obj': j.astype(np.int32),
+            'union': union.astype(np.float32), 'delta': delta.astype(np.float32),
+            'iou': (inter / (ws * hs + wo * ho - inter)).astype(np.float32),
+            'nb_pairs': np.bincount(image, minlength=len(sizes))}
+
+
+def create_spatial(inputfile, output=None, chunk_size=1000):
+    """
+    Create the store of spatial features of the pairs of boxes of `inputfile`.
+    """
+    if not output:
+        output = splitext(inputfile.rstrip('/'))[0]+'_spatial'
+    parts = dict((key, []) for key in ['sub', 'obj', 'union', 'delta', 'iou'])
+    nb_pairs = []
+    chunk = []
+    images = iterate_boxes(inputfile)
+    while True:
+        boxes = next(images, None)
+        if boxes is not None:
+            chunk.append(np.asarray(boxes).reshape((-1, 4)))
+        if chunk and (boxes is None or len(chunk) == chunk_size):
+            features = pair_features(np.concatenate(chunk), [len(b) for b in chunk])
+            nb_pairs.append(features.pop('nb_pairs'))
+            for key in features:
+                parts[key].append(features[key])
+            chunk = []
+        if boxes is None:
+            break
+    nb_pairs = np.concatenate(nb_pairs) if nb_pairs else np.zeros(0, dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(nb_pairs)])
+    # features of no pairs keep the shape and type of each array
+    empty = pair_features(np.zeros((0, 4)), [])
+    arrays = dict((key, np.concatenate(parts[key]) if parts[key] else empty[key]) for key in parts)
+    fh.FlatStore.save(output, offsets, **arrays)
+    logger.info('Saved features of {} pairs of {} images in folder: {}'.format(offsets[-1], len(nb_pairs), output))
+    return output
+
+
+def load_features(inputfile, output=None, chunk_size=1000):
+    """ Return the `FlatStore` with the spatial features of `inputfile`, creating the store
+        when it does not exist or when it is older than `inputfile`.
+
+        >>> store = load_features('train.pkl')
+        >>> store.rows('delta', 10)
+    """
+    if not output:
+        output = splitext(inputfile.rstrip('/'))[0]+'_spatial'
+    foffsets = join(output, 'offsets.npy')
+    if isdir(inputfile):
+        mtime = max(getmtime(join(inputfile, fname)) for fname in os.listdir(inputfile))
+    else:
+        mtime = getmtime(inputfile)
+    if not exists(foffsets) or getmtime(foffsets) < mtime:
+        create_spatial(inputfile, output, chunk_size)
+    return fh.FlatStore(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inputfile', metavar='boxes_file', help='Path to train.pkl, proposal.pkl or their folders.')
+    parser.add_argument('-o', '--output', help='Path to the folder to save the features.')
+    parser.add_argument('-n', '--chunk_size', help='Number of images processed at once', type=int, default=1000)
+    args = parser.parse_args()
+
+    create_spatial(args.inputfile, args.output, args.chunk_size)
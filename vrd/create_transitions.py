@@ -0,0 +1,212 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+"""
+Create a `.npz` report with temporal statistics of relations of a folder of Decompressed files.
+The report contains the following arrays:
+
+'transitions': array (nb_objects, nb_objects, nb_relations+1, nb_relations+1) counting, for
+    each pair (subject, object), the relation at frame t (row) and the relation at frame t+1
+    (column). The last index means that the pair has no relation in the frame. Relations that
+    hold in both frames stay, and relations that end are followed by the relations of the pair
+    that start in the next frame.
+'p_change': array (nb_objects, nb_objects, nb_relations) with p(state change | previous relation),
+    i.e., the probability of the relation of a pair not holding in the next frame
+'dwell': array (nb_objects, nb_objects, nb_relations, nb_bins) with the histogram of the number
+    of frames of each interval of the relations (see `DecompressedFile.group_relations`)
+'object_dwell': array (nb_objects, nb_bins) with the histogram of the intervals of relations
+    containing each object as subject or object
+'bin_edges': lower number of frames of each bin of the histograms (powers of 2)
+'classes', 'relations': names of objects and relations sorted by id
+
+Each file is converted into arrays of ids and counted at once. Files are processed in a pool
+of processes and their counts are summed.
+"""
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+import argparse
+import operator
+from os.path import join, dirname, isdir
+from multiprocessing import Pool
+
+import filehandler as fh
+import numpy as np
+
+NB_BINS = 16
+
+
+def count_transitions(frames, pairs, rels, nb_pairs, nb_relations):
+    """ Count the transitions of relations of each pair between consecutive frames.
+        A relation that holds at t and t+1 stays (row and column of the same relation).
+        Relations that end at t are followed by the relations of the same pair that
+        start at t+1 (or by no relation), thus relations that hold together are not
+        counted as transitions between them.
+
+    Parameters:
+    -----------
+    frames, pairs, rels: array
+        unique rows (frame, pair, relation) of a file, where `pair` is subject*nb_objects+object
+    nb_pairs: int
+        number of pairs (nb_objects * nb_objects)
+    nb_relations: int
+        number of relations
+
+    Returns:
+    --------
+    (transitions, ended), where `transitions` is an array with shape 
+    (nb_pairs, nb_relations+1, nb_relations+1) and `ended` is an array with shape
+    (nb_pairs, nb_relations) counting the frames where each relation does not hold
+    in the next frame
+    """
+    none = nb_relations
+    size = nb_pairs * (nb_relations+1) * (nb_relations+1)
+    if not len(frames):
+        return (np.zeros(size, dtype=np.int64).reshape((nb_pairs, none+1, none+1)),
+                np.zeros((nb_pairs, nb_relations), dtype=np.int64))
+    # key of each row (frame, pair, relation) and the key of the same row in the next frame
+    keys = (frames * nb_pairs + pairs) * nb_relations + rels
+    step = nb_pairs * nb_relations
+    now = frames < frames.max()
+    later = frames > frames.min()
+    stay = now & np.isin(keys + step, keys)
+    ended = now & ~stay
+    started = later & ~np.isin(keys - step, keys)
+
+    cells = [(pairs[stay] * (none+1) + rels[stay]) * (none+1) + rels[stay]]
+    # relations that end at t joined to relations of the same pair that start at t+1
+    key_end = frames[ended] * nb_pairs + pairs[ended]
+    rel_end = rels[ended]
+    key_start = (frames[started] - 1) * nb_pairs + pairs[started]
+    rel_start = rels[started]
+    order = np.argsort(key_start, kind='mergesort')
+    key_start, rel_start = key_start[order], rel_start[order]
+    lo = np.searchsorted(key_start, key_end, side='left')
+    counts = np.searchsorted(key_start, key_end, side='right') - lo
+    idx_end = np.repeat(np.arange(len(key_end)), counts)
+    shift = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    idx_start = np.repeat(lo, counts) + shift
+    cells.append(((key_end[idx_end] % nb_pairs) * (none+1) + rel_end[idx_end]) * (none+1) + rel_start[idx_start])
+    # relation at t and no new relation of the pair at t+1
+    alone = counts == 0
+    cells.append(((key_end[alone] % nb_pairs) * (none+1) + rel_end[alone]) * (none+1) + none)
+    # no relation of the pair ends at t and relation starts at t+1
+    new = ~np.isin(key_start, key_end)
+    cells.append(((key_start[new] % nb_pairs) * (none+1) + none) * (none+1) + rel_start[new])
+    transitions = np.bincount(np.concatenate(cells), minlength=size).reshape((nb_pairs, none+1, none+1))
+    ended = np.bincount(pairs[ended] * nb_relations + rels[ended], minlength=nb_pairs*nb_relations)
+    return transitions, ended.reshape((nb_pairs, nb_relations))
+
+
+def count_dwell(frames, pairs, rels, nb_pairs, nb_relations, nb_bins=NB_BINS):
+    """ Histogram of the number of frames of the contiguous intervals of each relation.
+
+    Returns:
+    --------
+    array with shape (nb_pairs, nb_relations, nb_bins)
+    """
+    size = nb_pairs * nb_relations * nb_bins
+    if not len(frames):
+        return np.zeros(size, dtype=np.int64).reshape((nb_pairs, nb_relations, nb_bins))
+    triplet = pairs * nb_relations + rels
+    order = np.lexsort((frames, triplet))
+    triplet, frames = triplet[order], frames[order]
+    start = np.ones(len(frames), dtype=bool)
+    start[1:] = (triplet[1:] != triplet[:-1]) | (frames[1:] != frames[:-1] + 1)
+    starts = np.flatnonzero(start)
+    lengths = np.diff(np.append(starts, len(frames)))
+    bins = np.minimum(np.floor(np.log2(lengths)).astype(np.int64), nb_bins-1)
+    counts = np.bincount(triplet[starts] * nb_bins + bins, minlength=size)
+    return counts.reshape((nb_pairs, nb_relations, nb_bins))
+
+
+def count_file(args):
+    """ Count transitions and dwell times of a single file.
+
+    Parameters:
+    -----------
+    args: tuple
+        (inputfile, do, dr), where `inputfile` is the path to the Decompressed file,
+        `do` is the dictionary of objects and `dr` is the dictionary of relations
+
+    Returns:
+    --------
+    (transitions, ended, dwell, nb_lines)
+    """
+    inputfile, do, dr = args
+    frames, subs, rels, objs = fh.DecompressedFile(inputfile).to_arrays(do, dr)
+    nb_objects, nb_relations = len(do), len(dr)
+    nb_pairs = nb_objects * nb_objects
+    pairs = subs * nb_objects + objs
+    # repeated lines of the same relation in a frame are counted once
+    rows = np.unique((frames * nb_pairs + pairs) * nb_relations + rels)
+    frames, pairs, rels = rows // (nb_pairs * nb_relations), (rows // nb_relations) % nb_pairs, rows % nb_relations
+    transitions, ended = count_transitions(frames, pairs, rels, nb_pairs, nb_relations)
+    dwell = count_dwell(frames, pairs, rels, nb_pairs, nb_relations)
+    return transitions, ended, dwell, len(subs)
+
+
+def create_transitions(inputs, output, class_file='classes.cfg', rels_file='relations.cfg', processes=None):
+    """
+    Create the `.npz` report with transitions and dwell times of relations of `inputs`.
+    """
+    do = fh.ConfigFile(class_file, background=False).load_classes(cnames=True)
+    logger.info('Loaded dictionary with {} objects.'.format(len(do)))
+    dr = fh.ConfigFile(rels_file).load_classes(cnames=True)
+    logger.info('Loaded dictionary with {} relations.'.format(len(dr)))
+    nb_objects, nb_relations = len(do), len(dr)
+
+    transitions = np.zeros((nb_objects*nb_objects, nb_relations+1, nb_relations+1), dtype=np.int64)
+    ended = np.zeros((nb_objects*nb_objects, nb_relations), dtype=np.int64)
+    dwell = np.zeros((nb_objects*nb_objects, nb_relations, NB_BINS), dtype=np.int64)
+    jobs = [(inputfile, do, dr) for inputfile in inputs]
+    pool = None
+    if processes != 1 and len(jobs) > 1:
+        pool = Pool(processes)
+        results = pool.imap_unordered(count_file, jobs)
+    else:
+        results = map(count_file, jobs)
+    nb_lines = 0
+    for partial_transitions, partial_ended, partial_dwell, nb in results:
+        transitions += partial_transitions
+        ended += partial_ended
+        dwell += partial_dwell
+        nb_lines += nb
+    if pool:
+        pool.close()
+        pool.join()
+    logger.info('Processed {} relations from {} files.'.format(nb_lines, len(jobs)))
+
+    transitions = transitions.reshape((nb_objects, nb_objects, nb_relations+1, nb_relations+1))
+    dwell = dwell.reshape((nb_objects, nb_objects, nb_relations, NB_BINS))
+    ended = ended.reshape((nb_objects, nb_objects, nb_relations)).astype('float64')
+    stay = np.diagonal(transitions[:, :, :-1, :-1], axis1=2, axis2=3)
+    previous = stay + ended
+    p_change = np.where(previous > 0, ended / np.maximum(previous, 1.), 0.)
+    object_dwell = dwell.sum(axis=(1, 2)) + dwell.sum(axis=(0, 2))
+    # relations of an object with itself are counted once
+    object_dwell -= dwell[np.arange(nb_objects), np.arange(nb_objects)].sum(axis=1)
+
+    np.savez_compressed(output, transitions=transitions, p_change=p_change, dwell=dwell,
+                        object_dwell=object_dwell, bin_edges=2 ** np.arange(NB_BINS),
+                        classes=np.array([k for k, _ in sorted(do.items(), key=operator.itemgetter(1))]),
+                        relations=np.array([k for k, _ in sorted(dr.items(), key=operator.itemgetter(1))]))
+    logger.info('Saved report in file: {}'.format(output))
+    return output
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inputfile', metavar='relations_file', help='Path to the file (or folder of files) containing relations between objects.')
+    parser.add_argument('-o', '--output', help='Path to the `.npz` file to save the report.')
+    parser.add_argument('-c', '--class_file', help='File containing ids and their classes', default='classes.cfg')
+    parser.add_argument('-r', '--relation_file', help='File containing ids and their relations', default='relations.cfg')
+    parser.add_argument('-p', '--processes', help='Number of processes', type=int, default=None)
+    args = parser.parse_args()
+
+    if isdir(args.inputfile):
+        inputs = list(fh.FolderHandler(args.inputfile))
+        output = args.output or join(args.inputfile, 'transitions.npz')
+    else:
+        inputs = [args.inputfile]
+        output = args.output or join(dirname(args.inputfile), 'transitions.npz')
+    create_transitions(inputs, output, args.class_file, args.relation_file, args.processes)
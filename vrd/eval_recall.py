@@ -0,0 +1,242 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+"""
+Evaluate the recall@K of relations predicted by VRD-DSR against the ground truth created by
+`create_gt.py` (`gt.npz` or `gt.pkl`). Predictions are read from the pickle file saved by
+VRD-DSR, containing lists with the predictions of each image:
+
+'rlp_labels_ours': (subject, predicate, object) of each relation
+'rlp_confs_ours': confidence of each relation
+'sub_bboxes_ours': bounding box [xmin,ymin,xmax,ymax] of the subject of each relation
+'obj_bboxes_ours': bounding box [xmin,ymin,xmax,ymax] of the object of each relation
+
+or from a `.npz` file containing the flat arrays `tuple_label`, `confs`, `sub_bboxes`,
+`obj_bboxes` and `offsets`, where the relations of the image N are in `offsets[N]:offsets[N+1]`.
+
+In predicate detection, relations are predicted for the pairs of boxes of the ground truth,
+while in relationship detection, boxes come from the object detector (`proposal.pkl`). Both
+are evaluated in the same way: the K relations with higher confidence of each image are
+matched to relations of the ground truth with the same labels, whose subject and object
+boxes have IoU >= 0.5. Each relation of the ground truth is matched only once.
+
+All images are evaluated at once with flat arrays, and shards of images can be evaluated
+in parallel.
+"""
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+import sys
+import time
+import argparse
+from os.path import splitext
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+import cPickle
+
+import create_gt
+
+IOU_THRESHOLD = 0.5
+DET_KEYS = [('tuple_label', 'rlp_labels_ours', 3), ('confs', 'rlp_confs_ours', 1),
+            ('sub_bboxes', 'sub_bboxes_ours', 4), ('obj_bboxes', 'obj_bboxes_ours', 4)]
+
+
+def flatten(rows, ncols):
+    """ Concatenate the rows of each image in a flat array, returning (flat, offsets) """
+    sizes = [0 if row is None else len(row) for row in rows]
+    offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    parts = [np.asarray(row, dtype=np.float64).reshape((-1, ncols)) for row in rows if row is not None and len(row)]
+    if not parts:
+        return np.zeros((0, ncols)), offsets
+    return np.concatenate(parts), offsets
+
+
+def load_flat(filename, keys):
+    """ Load a `.npz` file or a pickle file with a list per image of each key.
+
+    Parameters:
+    -----------
+    filename: string
+        path to the `.npz` or pickle file
+    keys: array
+        list of (flat key, pickle key, number of columns)
+
+    Returns:
+    --------
+    dictionary containing the flat array of each key and `offsets`
+    """
+    if splitext(filename)[1] == '.npz':
+        return create_gt.load_gt(filename)
+    with open(filename, 'rb') as fin:
+        dpkl = cPickle.load(fin)
+    data = {}
+    for key, pkey, ncols in keys:
+        data[key], offsets = flatten(dpkl[pkey], ncols)
+        if 'offsets' in data and not np.array_equal(offsets, data['offsets']):
+            logger.error('Number of elements of {} differs from other keys in: {}'.format(pkey, filename))
+            sys.exit()
+        data['offsets'] = offsets
+    return data
+
+
+def load_gt(filename):
+    """ Load the ground truth from `gt.npz` or `gt.pkl` """
+    keys = [('tuple_label', 'tuple_label', 3), ('sub_bboxes', 'sub_bboxes', 4), ('obj_bboxes', 'obj_bboxes', 4)]
+    return load_flat(filename, keys)
+
+
+def load_detections(filename):
+    """ Load the predictions of VRD-DSR from a pickle file or a `.npz` file """
+    data = load_flat(filename, DET_KEYS)
+    data['confs'] = data['confs'].ravel()
+    return data
+
+
+def box_iou(boxes1, boxes2):
+    """ IoU between each row of `boxes1` and the same row of `boxes2` as in VRD-DSR """
+    iw = np.minimum(boxes1[:, 2], boxes2[:, 2]) - np.maximum(boxes1[:, 0], boxes2[:, 0]) + 1
+    ih = np.minimum(boxes1[:, 3], boxes2[:, 3]) - np.maximum(boxes1[:, 1], boxes2[:, 1]) + 1
+    inter = np.where((iw > 0) & (ih > 0), iw * ih, 0.)
+    area1 = (boxes1[:, 2] - boxes1[:, 0] + 1) * (boxes1[:, 3] - boxes1[:, 1] + 1)
+    area2 = (boxes2[:, 2] - boxes2[:, 0] + 1) * (boxes2[:, 3] - boxes2[:, 1] + 1)
+    return inter / np.maximum(area1 + area2 - inter, np.finfo(np.float64).eps)
+
+
+def slice_images(data, start, end):
+    """ Return the rows of the images `start:end` with offsets starting at 0 """
+    offsets = data['offsets'][start:end+1]
+    part = dict((key, data[key][offsets[0]:offsets[-1]]) for key in data if key != 'offsets')
+    part['offsets'] = offsets - offsets[0]
+    return part
+
+
+def match_images(args):
+    """ Count the matched relations of the images of a shard for each K.
+
+    Parameters:
+    -----------
+    args: tuple
+        (gt, det, ks), where `gt` and `det` are dictionaries of flat arrays
+        of the same images and `ks` is the list of K
+
+    Returns:
+    --------
+    array with the number of matched relations in the top K of each K
+    """
+    gt, det, ks = args
+    ks = np.asarray(ks)
+    nb_images = len(gt['offsets']) - 1
+    gimg = np.repeat(np.arange(nb_images), np.diff(gt['offsets']))
+    dimg = np.repeat(np.arange(nb_images), np.diff(det['offsets']))
+    if not len(gimg) or not len(dimg):
+        return np.zeros(len(ks), dtype=np.int64)
+
+    # rank of each prediction in its image by confidence
+    order = np.lexsort((-det['confs'], dimg))
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - det['offsets'][dimg[order]]
+    top = np.flatnonzero(rank < ks.max())
+
+    # pairs (prediction, ground truth) of the same image with the same labels
+    glabel = gt['tuple_label'].astype(np.int64)
+    dlabel = det['tuple_label'][top].astype(np.int64)
+    base = max(glabel.max(), dlabel.max()) + 1
+    gkey = ((gimg * base + glabel[:, 0]) * base + glabel[:, 1]) * base + glabel[:, 2]
+    dkey = ((dimg[top] * base + dlabel[:, 0]) * base + dlabel[:, 1]) * base + dlabel[:, 2]
+    gorder = np.argsort(gkey, kind='mergesort')
+    lo = np.searchsorted(gkey[gorder], dkey, side='left')
+    counts = np.searchsorted(gkey[gorder], dkey, side='right') - lo
+    pdet = np.repeat(top, counts)
+    shift = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    pgt = gorder[np.repeat(lo, counts) + shift]
+
+    ov = np.minimum(box_iou(det['sub_bboxes'][pdet], gt['sub_bboxes'][pgt]),
+                    box_iou(det['obj_bboxes'][pdet], gt['obj_bboxes'][pgt]))
+    valid = ov >= IOU_THRESHOLD
+    pdet, pgt, ov = pdet[valid], pgt[valid], ov[valid]
+
+    # greedy assignment in the order of confidence: each prediction takes the free
+    # ground truth with the highest overlap
+    order = np.lexsort((pgt, -ov, rank[pdet], dimg[pdet]))
+    used_det, used_gt = set(), set()
+    for d, g in zip(pdet[order], pgt[order]):
+        if d in used_det or g in used_gt: continue
+        used_det.add(d)
+        used_gt.add(g)
+    matched = rank[np.array(sorted(used_det), dtype=np.int64)]
+    return np.array([(matched < k).sum() for k in ks], dtype=np.int64)
+
+
+def recall(gt, det, ks=(50, 100), processes=None, nb_shards=None):
+    """ Compute the recall@K of predictions `det` for each K of `ks`.
+
+    Parameters:
+    -----------
+    gt: dict
+        flat arrays of the ground truth (see `load_gt`)
+    det: dict
+        flat arrays of the predictions (see `load_detections`)
+    ks: array
+        list of K
+    processes: int
+        number of processes (default: number of cpus)
+    nb_shards: int
+        number of shards of images (default: 4 shards per process)
+
+    Returns:
+    --------
+    dictionary in the form {K: recall}
+    """
+    nb_images = len(gt['offsets']) - 1
+    if len(det['offsets']) - 1 != nb_images:
+        logger.error('Number of images differs: {} in ground truth and {} in predictions'.format(nb_images, len(det['offsets'])-1))
+        sys.exit()
+    if processes == 1:
+        bounds = [0, nb_images]
+    else:
+        if not nb_shards:
+            nb_shards = 4 * (processes or cpu_count())
+        bounds = np.unique(np.linspace(0, nb_images, nb_shards+1).astype(np.int64))
+    jobs = [(slice_images(gt, bounds[i], bounds[i+1]), slice_images(det, bounds[i], bounds[i+1]), ks)
+            for i in range(len(bounds)-1)]
+    if len(jobs) > 1:
+        pool = Pool(processes)
+        results = pool.map(match_images, jobs)
+        pool.close()
+        pool.join()
+    else:
+        results = [match_images(job) for job in jobs]
+    tp = np.sum(results, axis=0)
+    nb_gt = max(len(gt['tuple_label']), 1)
+    return dict((k, float(tp[i]) / nb_gt) for i, k in enumerate(ks))
+
+
+def main(gtfile, pred_det=None, rel_det=None, ks=(50, 100), processes=None):
+    """
+    Print the recall@K of predicate detection and relationship detection.
+    """
+    start = time.time()
+    gt = load_gt(gtfile)
+    logger.info('Loaded {} relations of {} images from: {}'.format(len(gt['tuple_label']), len(gt['offsets'])-1, gtfile))
+    results = {}
+    for task, detfile in [('Predicate detection', pred_det), ('Relationship detection', rel_det)]:
+        if not detfile: continue
+        det = load_detections(detfile)
+        logger.info('Loaded {} predictions from: {}'.format(len(det['tuple_label']), detfile))
+        results[task] = recall(gt, det, ks, processes)
+        for k in ks:
+            logger.info('{} R@{}: {:.4f}'.format(task, k, results[task][k]))
+    logger.info('Evaluated in {:.2f}s'.format(time.time() - start))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('gtfile', metavar='gt_file', help='Path to the ground truth (gt.npz or gt.pkl).')
+    parser.add_argument('-d', '--pred_det', help='Path to the predictions of predicate detection.')
+    parser.add_argument('-r', '--rel_det', help='Path to the predictions of relationship detection.')
+    parser.add_argument('-k', '--topk', help='Values of K', type=int, nargs='+', default=[50, 100])
+    parser.add_argument('-p', '--processes', help='Number of processes', type=int, default=None)
+    args = parser.parse_args()
+
+    main(args.gtfile, args.pred_det, args.rel_det, args.topk, args.processes)
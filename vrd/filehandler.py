@@ -7,8 +7,44 @@ logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=lo
 import os
 import sys
 import ast
+import cPickle
+import numpy as np
+import xml.etree.cElementTree as ET
+from string import Template
+from multiprocessing import Pool
+from xml.sax.saxutils import escape
 
-from os.path import exists, join, splitext
+from os.path import exists, join, splitext, realpath, basename, dirname
+
+
+CACHE = {}
+
+
+def load_cached(inputfile, function, *args):
+    """ Return the result of `function(*args)` shared by all the calls that read
+        the same ``inputfile``. The result is computed again only when the file
+        is modified, i.e., its size or modification time (in nanoseconds, when
+        available) changes. Callers must not change the returned object.
+    """
+    if not exists(inputfile):
+        return function(*args)
+    inputfile = realpath(inputfile)
+    st = os.stat(inputfile)
+    mtime = getattr(st, 'st_mtime_ns', st.st_mtime)
+    key = (inputfile, mtime, st.st_size, function.__name__) + args
+    if key not in CACHE:
+        CACHE[key] = function(*args)
+    return CACHE[key]
+
+
+def intern_ids(names, dic):
+    """ Convert a list of names into an array of ids of `dic`. The dictionary
+        is only accessed once for each distinct name.
+    """
+    if not len(names):
+        return np.zeros(0, dtype=np.int64)
+    uniq, inverse = np.unique(names, return_inverse=True)
+    return np.array([dic[name] for name in uniq], dtype=np.int64)[inverse]
 
 
 class FolderHandler(object):
@@ -163,6 +199,21 @@ class LisFile(FileHandler):
         with open(self.inputfile) as fin:
             for i, _ in enumerate(fin, start=1): pass
         return i-3
+
+    def frames(self):
+        """ Yield (id_frame, fname, objects) for each frame, where objects are
+            tuples (obj, x, y, w, h). The file must be opened with `with`.
+        """
+        objs = []
+        last_id, fname = None, None
+        for _ in self:
+            if self.idfr != last_id and objs:
+                yield last_id, fname, objs
+                objs = []
+            last_id, fname = self.idfr, self.fname
+            objs.append((self.obj, self.x, self.y, self.w, self.h))
+        if objs:
+            yield last_id, fname, objs
 # End of LisFile class
 
 
@@ -291,6 +342,44 @@ class DecompressedFile(FileHandler):
         if as_set:
             return set(rels)
         return rels
+
+    def frames(self):
+        """ Yield (id_frame, triplets) for each frame, where triplets are 
+            tuples (subject, relation, object). The file must be opened with `with`.
+        """
+        triplets = []
+        last_id = None
+        for arr in self:
+            if arr[0] != last_id and triplets:
+                yield last_id, triplets
+                triplets = []
+            last_id = arr[0]
+            triplets.append((arr[1], arr[2], arr[3]))
+        if triplets:
+            yield last_id, triplets
+
+    def to_arrays(self, do, dr):
+        """ Load all relations as arrays of ids (frames, subjects, relations, objects)
+
+        Parameters:
+        -----------
+        do: dict
+            dictionary in the form {'object_1': idobj1, 'object_2': idobj2...}
+        dr: dict
+            dictionary in the form {'relation1': idrel1, 'relation2': idrel2...}
+        """
+        frames, subs, rels, objs = [], [], [], []
+        self.exist_file()
+        with open(self.inputfile) as fin:
+            for line in fin:
+                if not line or not line[0].isdigit(): continue
+                arr = line.rstrip('\r\n').split(self.sep)
+                frames.append(arr[0])
+                subs.append(arr[1])
+                rels.append(arr[2])
+                objs.append(arr[3])
+        return (np.array(frames, dtype=np.int64), intern_ids(subs, do), 
+                intern_ids(rels, dr), intern_ids(objs, do))
 # End of DecompressedFile class
 
 
@@ -315,27 +404,31 @@ class ConfigFile(FileHandler):
 
     def load_classes(self, cnames=False, as_set=False):
         """ cnames : class names instead of ids """
-        self.__enter__()
-        self.dcls = {}
-        for line in self.fin:
-            arr = line.strip().split()
-            if cnames:
-                if self.background:
-                    self.dcls[arr[1]] = int(arr[0])
-                elif arr[1] == '__background__': 
-                    continue
-                else:
-                    self.dcls[arr[1]] = int(arr[0])-1
-            else:
-                if self.background:
-                    self.dcls[int(arr[0])] = arr[1]
-                elif arr[1] == '__background__': 
-                    continue
-                else:
-                    self.dcls[int(arr[0])-1] = arr[1]
+        self.dcls = dict(load_cached(self.inputfile, self._read_classes, cnames, self.background))
         if as_set:
             return set(self.dcls.keys())
         return self.dcls
+
+    def _read_classes(self, cnames, background):
+        dcls = {}
+        with self:
+            for line in self.fin:
+                arr = line.strip().split()
+                if cnames:
+                    if background:
+                        dcls[arr[1]] = int(arr[0])
+                    elif arr[1] == '__background__': 
+                        continue
+                    else:
+                        dcls[arr[1]] = int(arr[0])-1
+                else:
+                    if background:
+                        dcls[int(arr[0])] = arr[1]
+                    elif arr[1] == '__background__': 
+                        continue
+                    else:
+                        dcls[int(arr[0])-1] = arr[1]
+        return dcls
 # End of ConfigFile class
 
 
@@ -344,7 +437,8 @@ class PredictionFile(FileHandler):
 
         Frame;xmin;ymin;xmax;ymax;id_class;score
 
-        where `score' is a value between 0 and 1.
+        where `score' is a value between 0 and 1. Files created by the tracker
+        contain the id of the track in a last column (`id_track`).
     """
     def __init__(self, inputfile, sep=';'):
         super(PredictionFile, self).__init__(inputfile, sep=sep)
@@ -353,14 +447,16 @@ class PredictionFile(FileHandler):
         for self.nb_line, line in enumerate(self.fin):
             if not line or not line[0].isdigit(): continue
             arr = self.check_line(self.nb_lines, line)
-            arr[:-1] = map(int, arr[:-1])
-            self.idfr, self.xmin, self.ymin, self.xmax, self.ymax, self.id_class = arr[:-1]
-            self.score = float(arr[-1])
+            arr[:6] = map(int, arr[:6])
+            self.idfr, self.xmin, self.ymin, self.xmax, self.ymax, self.id_class = arr[:6]
+            self.score = float(arr[6])
+            if len(arr) == 8:
+                arr[7] = int(arr[7])
             yield arr
 
     def check_line(self, i, line):
         arr = line.strip().split(';')
-        if len(arr) != 7:
+        if len(arr) != 7 and len(arr) != 8:
             logger.error('Malformed line in input file! [LINE: {}]'.format(i))
             sys.exit()
         return arr
@@ -377,9 +473,85 @@ class PredictionFile(FileHandler):
                 last_id = self.idfr
                 objs.append((self.id_class, self.xmin, self.ymin, self.xmax, self.ymax, self.score))
         yield self.idfr, objs
+
+    def load_arrays(self, chunk_size=1 << 24):
+        """ Parse all detections into a `PredictionArray`. The file is read in chunks 
+            of about `chunk_size` bytes and each chunk is converted to numbers at once.
+            Files created by the tracker also have the field `id_track`.
+        """
+        self.exist_file()
+        parts = []
+        fields = None
+        with open(self.inputfile) as fin:
+            for lines in iter(lambda: fin.readlines(chunk_size), []):
+                lines = [line for line in lines if line[:1].isdigit()]
+                if not lines: continue
+                if fields is None:
+                    fields = PREDICTION_FIELDS
+                    if lines[0].count(';') == len(PREDICTION_FIELDS):
+                        fields = PREDICTION_FIELDS + [('id_track', np.int64)]
+                parts.append(parse_predictions(lines, fields))
+        data = np.concatenate(parts) if parts else np.zeros(0, dtype=PREDICTION_FIELDS)
+        return PredictionArray(data)
 # End of PredictionFile class
 
 
+PREDICTION_FIELDS = [('frame', np.int64), ('xmin', np.int32), ('ymin', np.int32), ('xmax', np.int32),
+                     ('ymax', np.int32), ('id_class', np.int32), ('score', np.float32)]
+
+
+def parse_predictions(lines, fields, sep=';'):
+    """ Convert lines of a PredictionFile into a structured array with `fields` """
+    values = np.fromstring(''.join(lines).replace(sep, ' '), sep=' ')
+    if len(values) != len(lines) * len(fields):
+        logger.error('Malformed line in input file! [LINE: {}]'.format(lines[0].strip()))
+        sys.exit()
+    values = values.reshape((len(lines), len(fields)))
+    data = np.empty(len(lines), dtype=fields)
+    for i, (name, _) in enumerate(fields):
+        data[name] = values[:, i]
+    return data
+
+
+class PredictionArray(object):
+    """ Detections of a PredictionFile in a structured array sorted by frame, where
+        the rows of the N-th frame are in `offsets[N]:offsets[N+1]`. Rows of a frame
+        are views of the array. E.g.:
+
+            preds = PredictionFile('predictions.txt').load_arrays()
+            for idfr, rows in preds:
+                boxes, scores = rows[['xmin', 'ymin', 'xmax', 'ymax']], rows['score']
+    """
+    def __init__(self, data):
+        if len(data) and np.any(data['frame'][1:] < data['frame'][:-1]):
+            data = data[np.argsort(data['frame'], kind='mergesort')]
+        self.data = data
+        self.offsets = group_offsets(data['frame'])
+        self.frames = data['frame'][self.offsets[:-1]]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.data[self.offsets[index]:self.offsets[index+1]]
+
+    def __iter__(self):
+        for i, idfr in enumerate(self.frames):
+            yield int(idfr), self[i]
+
+    def frame(self, idfr):
+        """ Return the rows of the frame `idfr` (no rows if the frame has no detections) """
+        i = np.searchsorted(self.frames, idfr)
+        if i < len(self.frames) and self.frames[i] == idfr:
+            return self[i]
+        return self.data[:0]
+
+    def boxes(self):
+        """ Return an array (nb_rows, 4) with [xmin, ymin, xmax, ymax] of all rows """
+        return np.column_stack([self.data['xmin'], self.data['ymin'], self.data['xmax'], self.data['ymax']])
+# End of PredictionArray class
+
+
 class MapFile(FileHandler):
     """ Map_paths file has the form:
 
@@ -401,41 +573,382 @@ class MapFile(FileHandler):
         return arr
 
     def load_dictionary(self, key='kscgr'):
-        self.map = {}
-        self.__enter__()
-        for kscgr, voc in self:
-            if key == 'kscgr':
-                self.map[kscgr] = voc
-                if not self.path:
-                    self.path = 'data'.join(kscgr.split('data')[:-1])
-            else:
-                self.map[voc] = kscgr
-                if not self.path:
-                    self.path = voc.split('JPEGImages')[0]
+        self.map, self.path = load_cached(self.inputfile, self._read_dictionary, key)
         return self.map
+
+    def _read_dictionary(self, key):
+        dmap = {}
+        path = ''
+        with self:
+            for kscgr, voc in self:
+                if key == 'kscgr':
+                    dmap[kscgr] = voc
+                    if not path:
+                        path = 'data'.join(kscgr.split('data')[:-1])
+                else:
+                    dmap[voc] = kscgr
+                    if not path:
+                        path = voc.split('JPEGImages')[0]
+        return dmap, path
+
+    def load_index(self, folder=None):
+        """ Return the `MapIndex` of the file, building it when it does not exist
+            or when it is older than the file. The index is saved in `folder`
+            (default: `map_paths.idx` next to the file).
+        """
+        self.exist_file()
+        if not folder:
+            folder = splitext(self.inputfile)[0]+'.idx'
+        fmeta = join(folder, 'meta.pkl')
+        if not exists(fmeta) or os.path.getmtime(fmeta) < os.path.getmtime(self.inputfile):
+            logger.info('Building index of map file in: {}'.format(folder))
+            MapIndex.build(self, folder)
+        return MapIndex(folder)
 # End of MapFile class
 
 
+def kscgr_key(path, frame=None):
+    """ Return (split, recipe, frame) of a KSCGR path.
+
+    Example:
+    --------
+    >>> kscgr_key('/usr/share/datasets/KSCGR/data1/boild-egg/0.jpg')
+        (1, 'boild-egg', 0)
+    >>> kscgr_key('data1/boild-egg', 10)
+        (1, 'boild-egg', 10)
+    """
+    arr = path.rstrip('/').split('/')
+    if frame is None:
+        frame = int(splitext(arr.pop())[0])
+    return int(arr[-2][4:]), arr[-1], int(frame)
+
+
+class MapIndex(object):
+    """ Index of the map file sorted by (split, recipe, frame). Each key is encoded
+        in a single integer, thus the index is searched without building the path 
+        of the frame. Arrays are memory-mapped and can be shared by processes.
+        E.g.:
+
+            index = MapFile('map_paths.txt').load_index()
+            vocpath = index.voc(1, 'boild-egg', 0)
+            split, recipe, frame = index.kscgr(vocpath)
+
+        The folder of the index contains:
+
+        'meta.pkl': recipes (sorted), KSCGR and VOC homes and extension of images
+        'keys.npy': sorted keys of the frames
+        'voc.npy': VOC paths in the order of keys
+        'voc_order.npy': positions of the VOC paths in alphabetical order
+    """
+    FRAME_BITS = 24
+    RECIPE_BITS = 16
+
+    def __init__(self, folder, mmap_mode='r'):
+        self.folder = folder
+        with open(join(folder, 'meta.pkl'), 'rb') as fin:
+            meta = cPickle.load(fin)
+        self.recipes = meta['recipes']
+        self.kscgr_home = meta['kscgr_home']
+        self.voc_home = meta['voc_home']
+        self.ext = meta['ext']
+        self.id_recipes = dict((recipe, i) for i, recipe in enumerate(self.recipes))
+        self.keys = np.load(join(folder, 'keys.npy'), mmap_mode=mmap_mode)
+        self.vocs = np.load(join(folder, 'voc.npy'), mmap_mode=mmap_mode)
+        self.voc_order = np.load(join(folder, 'voc_order.npy'), mmap_mode=mmap_mode)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def encode(splits, recipes, frames):
+        """ Encode (split, id_recipe, frame) into keys (also for arrays) """
+        splits = np.asarray(splits, dtype=np.int64)
+        recipes = np.asarray(recipes, dtype=np.int64)
+        frames = np.asarray(frames, dtype=np.int64)
+        return (((splits << MapIndex.RECIPE_BITS) | recipes) << MapIndex.FRAME_BITS) | frames
+
+    def decode(self, key):
+        """ Decode a key into (split, recipe, frame) """
+        key = int(key)
+        frame = key & ((1 << self.FRAME_BITS) - 1)
+        key >>= self.FRAME_BITS
+        recipe = key & ((1 << self.RECIPE_BITS) - 1)
+        return key >> self.RECIPE_BITS, self.recipes[recipe], frame
+
+    def find(self, splits, recipes, frames):
+        """ Return the positions of the frames in the index (-1 if not found).
+            `recipes` contains ids of recipes (see `id_recipes`). 
+        """
+        keys = self.encode(splits, recipes, frames)
+        pos = np.searchsorted(self.keys, keys)
+        pos = np.minimum(pos, len(self.keys) - 1)
+        return np.where(self.keys[pos] == keys, pos, -1)
+
+    def voc(self, split, recipe, frame):
+        """ Return the VOC path of a frame of a recipe. Raise `KeyError` when the
+            frame does not exist in the index.
+        """
+        if recipe not in self.id_recipes:
+            raise KeyError((split, recipe, frame))
+        pos = int(self.find(split, self.id_recipes[recipe], frame))
+        if pos < 0:
+            raise KeyError((split, recipe, frame))
+        return str(self.vocs[pos])
+
+    def kscgr(self, vocpath):
+        """ Return (split, recipe, frame) of a VOC path. Raise `KeyError` when the
+            path does not exist in the index.
+        """
+        i = int(np.searchsorted(self.vocs, vocpath, sorter=self.voc_order))
+        if i == len(self.vocs) or self.vocs[self.voc_order[i]] != vocpath:
+            raise KeyError(vocpath)
+        return self.decode(self.keys[self.voc_order[i]])
+
+    def kscgr_path(self, vocpath):
+        """ Return the original KSCGR path of a VOC path """
+        split, recipe, frame = self.kscgr(vocpath)
+        return '{}data{}/{}/{}{}'.format(self.kscgr_home, split, recipe, frame, self.ext)
+
+    @staticmethod
+    def build(fmap, folder):
+        """ Build the index of a `MapFile` in `folder` """
+        splits, recipes, frames, vocs = [], [], [], []
+        kscgr_home, voc_home, ext = '', '', ''
+        with fmap:
+            for kscgr, voc in fmap:
+                split, recipe, frame = kscgr_key(kscgr)
+                splits.append(split)
+                recipes.append(recipe)
+                frames.append(frame)
+                vocs.append(voc)
+                if not kscgr_home:
+                    kscgr_home = 'data'.join(kscgr.split('data')[:-1])
+                    voc_home = voc.split('JPEGImages')[0]
+                    ext = splitext(kscgr)[1]
+        names, id_recipes = np.unique(recipes, return_inverse=True)
+        if len(names) >= 1 << MapIndex.RECIPE_BITS or (frames and max(frames) >= 1 << MapIndex.FRAME_BITS):
+            logger.error('Number of recipes or frames is too large to be indexed: {}'.format(fmap.inputfile))
+            sys.exit()
+        keys = MapIndex.encode(splits, id_recipes, frames)
+        order = np.argsort(keys, kind='mergesort')
+        vocs = np.array(vocs)[order]
+        if not exists(folder):
+            os.makedirs(folder)
+        np.save(join(folder, 'keys.npy'), keys[order])
+        np.save(join(folder, 'voc.npy'), vocs)
+        np.save(join(folder, 'voc_order.npy'), np.argsort(vocs, kind='mergesort'))
+        meta = {'recipes': list(names), 'kscgr_home': kscgr_home, 'voc_home': voc_home, 'ext': ext}
+        with open(join(folder, 'meta.pkl'), 'wb') as fout:
+            cPickle.dump(meta, fout, cPickle.HIGHEST_PROTOCOL)
+# End of MapIndex class
+
+
+class FlatStore(object):
+    """ Folder of `.npy` arrays whose rows are grouped by image. The rows of 
+        the image N are in `offsets[N]:offsets[N+1]` of each array. Arrays are 
+        memory-mapped, thus only the rows that are accessed are read from disk.
+        E.g.:
+
+            store = FlatStore('proposal')
+            boxes = store.rows('boxes', 10)
+    """
+    def __init__(self, folder, mmap_mode='r'):
+        self.folder = folder
+        self.mmap_mode = mmap_mode
+        if not exists(join(folder, 'offsets.npy')):
+            logger.error('{} is not a valid store'.format(folder))
+            sys.exit()
+        self.offsets = np.load(join(folder, 'offsets.npy'))
+        self.arrays = {}
+        for fname in os.listdir(folder):
+            key, ext = splitext(fname)
+            if ext == '.npy' and key != 'offsets':
+                self.arrays[key] = np.load(join(folder, fname), mmap_mode=mmap_mode)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+    def rows(self, key, index):
+        """ Return a view with the rows of `key` for the image `index` """
+        return self.arrays[key][self.offsets[index]:self.offsets[index+1]]
+
+    @staticmethod
+    def save(folder, offsets, **arrays):
+        """ Save `offsets` and each array of `arrays` as `<folder>/<key>.npy` """
+        if not exists(folder):
+            os.makedirs(folder)
+        np.save(join(folder, 'offsets.npy'), np.asarray(offsets, dtype=np.int64))
+        for key in arrays:
+            np.save(join(folder, key+'.npy'), arrays[key])
+        return folder
+# End of FlatStore class
+
+
+class ShardWriter(object):
+    """ Save records (e.g. dictionaries of `train.pkl`) in pickle files of at most
+        `chunk_size` records in `folder`, thus only a chunk is kept in memory. 
+        The number of records of each shard is saved in `index.pkl`.
+        E.g.:
+
+            with ShardWriter('train') as writer:
+                for record in records:
+                    writer.add(record)
+    """
+    def __init__(self, folder, chunk_size=1000):
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self.records = []
+        self.sizes = []
+        if not exists(folder):
+            os.makedirs(folder)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return sum(self.sizes) + len(self.records)
+
+    def add(self, record):
+        self.records.append(record)
+        if len(self.records) >= self.chunk_size:
+            self._flush()
+
+    def _flush(self):
+        fname = join(self.folder, '{:05d}.pkl'.format(len(self.sizes)))
+        with open(fname, 'wb') as fout:
+            cPickle.dump(self.records, fout, cPickle.HIGHEST_PROTOCOL)
+        self.sizes.append(len(self.records))
+        self.records = []
+
+    def close(self):
+        if self.records:
+            self._flush()
+        with open(join(self.folder, 'index.pkl'), 'wb') as fout:
+            cPickle.dump({'sizes': self.sizes}, fout, cPickle.HIGHEST_PROTOCOL)
+# End of ShardWriter class
+
+
+class ShardReader(object):
+    """ Read the records saved by `ShardWriter` as a list. Shards are loaded 
+        when accessed, keeping only the last shard in memory.
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        findex = join(folder, 'index.pkl')
+        if not exists(findex):
+            logger.error('{} is not a valid folder of shards'.format(folder))
+            sys.exit()
+        with open(findex, 'rb') as fin:
+            self.sizes = cPickle.load(fin)['sizes']
+        self.offsets = np.concatenate([[0], np.cumsum(self.sizes)]).astype(np.int64)
+        self.id_shard = -1
+        self.records = []
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def _load(self, id_shard):
+        if id_shard != self.id_shard:
+            with open(join(self.folder, '{:05d}.pkl'.format(id_shard)), 'rb') as fin:
+                self.records = cPickle.load(fin)
+            self.id_shard = id_shard
+        return self.records
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('Record index out of range: {}'.format(index))
+        id_shard = int(np.searchsorted(self.offsets, index, side='right')) - 1
+        return self._load(id_shard)[index - self.offsets[id_shard]]
+
+    def __iter__(self):
+        for id_shard in range(len(self.sizes)):
+            for record in self._load(id_shard):
+                yield record
+# End of ShardReader class
+
+
+def group_offsets(frames):
+    """ Return the offsets of the runs of equal values in `frames`
+
+    Example:
+    --------
+    >>> group_offsets(np.array([0, 0, 1, 3, 3, 3]))
+        array([0, 2, 3, 6])
+    """
+    frames = np.asarray(frames)
+    if not len(frames):
+        return np.zeros(1, dtype=np.int64)
+    starts = np.flatnonzero(frames[1:] != frames[:-1]) + 1
+    return np.concatenate([[0], starts, [len(frames)]]).astype(np.int64)
+
+
+VOC_TEMPLATE = Template("""<annotations>
+  <folder>JPEGImages</folder>
+  <filename>$filename</filename>
+  <size>
+    <width>$width</width>
+    <height>$height</height>
+    <depth>3</depth>
+  </size>
+  <segmented>0</segmented>
+$objects</annotations>
+""")
+
+VOC_OBJECT_TEMPLATE = Template("""  <object>
+    <name>$name</name>
+    <pose>Unspecified</pose>
+    <truncated>0</truncated>
+    <difficult>0</difficult>
+    <bndbox>
+      <xmin>$xmin</xmin>
+      <ymin>$ymin</ymin>
+      <xmax>$xmax</xmax>
+      <ymax>$ymax</ymax>
+    </bndbox>
+  </object>
+""")
+
+
+def render_voc(filename, width, height, objects):
+    """ Return the XML of an image containing `objects` [(name, xmin, ymin, xmax, ymax), ...] """
+    xml_objects = ''.join([VOC_OBJECT_TEMPLATE.substitute(name=escape(str(name)), xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax)
+                           for name, xmin, ymin, xmax, ymax in objects])
+    return VOC_TEMPLATE.substitute(filename=escape(filename), width=width, height=height, objects=xml_objects)
+
+
+UTILS_FOLDER = join(dirname(realpath(__file__)), '..', 'object-recognition')
+
+
+def image_size(image_file):
+    """ Return (width, height) of an image reading only its header, with the cache of sizes
+        of `object-recognition/utils.py`. Without its dependencies, the image is opened by PIL.
+    """
+    if UTILS_FOLDER not in sys.path:
+        sys.path.append(UTILS_FOLDER)
+    try:
+        from utils import image_size as header_size
+    except ImportError:
+        from PIL import Image
+        return Image.open(image_file).size
+    return header_size(image_file)
+
+
 class VOCFile(object):
     def __init__(self, image_file, width=None, height=None):
         self.filename = basename(image_file)
         self.width = width
         self.height = height
         if not width or not height:
-            im = Image.open(image_file)
-            self.width, self.height = im.size
-        self._create_header()
-
-    def _create_header(self):
-        """ Create XML with information of the image """
-        self.xml = ET.Element('annotations')
-        ET.SubElement(self.xml, 'folder').text = 'JPEGImages'
-        ET.SubElement(self.xml, 'filename').text = self.filename    
-        imsize = ET.SubElement(self.xml, 'size')
-        ET.SubElement(imsize, 'width').text = str(self.width)
-        ET.SubElement(imsize, 'height').text = str(self.height)
-        ET.SubElement(imsize, 'depth').text = '3'
-        ET.SubElement(self.xml, 'segmented').text = '0' 
+            self.width, self.height = image_size(image_file)
+        self.objects = []
 
     def add_object(self, name, x, y, w, h):
         """ Add the annotation for an object """
@@ -450,26 +963,105 @@ class VOCFile(object):
         ymin = y
         xmax = x + w
         ymax = y + h 
-        if xmax > 256:
-            xmax = 256
-        if ymax > 256:
-            ymax = 256
-
-        obj = ET.SubElement(self.xml, "object")
-        ET.SubElement(obj, "name").text = name
-        ET.SubElement(obj, "pose").text = "Unspecified"
-        ET.SubElement(obj, "truncated").text = '0'
-        ET.SubElement(obj, "difficult").text = '0'
-        bbox = ET.SubElement(obj, "bndbox")
-        ET.SubElement(bbox, "xmin").text = str(xmin)
-        ET.SubElement(bbox, "ymin").text = str(ymin)
-        ET.SubElement(bbox, "xmax").text = str(xmax)
-        ET.SubElement(bbox, "ymax").text = str(ymax)
+        if xmax > self.width:
+            xmax = self.width
+        if ymax > self.height:
+            ymax = self.height
+        self.objects.append((name, xmin, ymin, xmax, ymax))
+
+    def to_xml(self):
+        """ Return the XML corresponding to the image """
+        return render_voc(self.filename, self.width, self.height, self.objects)
     
     def save_xml(self, folderout):
         """ Save the XML corresponding to an image in folderout """
         fname, _ = splitext(self.filename)
         fileout = join(folderout, fname+'.xml')
-        tree = ET.ElementTree(self.xml)
-        tree.write(fileout, pretty_print=True)
+        with open(fileout, 'w') as fout:
+            fout.write(self.to_xml())
 # End of VOCFile class
+
+
+def _write_voc_chunk(args):
+    """ Write the XML files of a chunk of images (see `write_voc_files`) """
+    folderout, images = args
+    for filename, width, height, objects in images:
+        fname, _ = splitext(basename(filename))
+        with open(join(folderout, fname+'.xml'), 'w') as fout:
+            fout.write(render_voc(basename(filename), width, height, objects))
+    return len(images)
+
+
+def write_voc_files(images, folderout, processes=None, chunk_size=500):
+    """ Write an XML file for each image in `folderout` using a pool of processes.
+
+    Parameters:
+    -----------
+    images: array
+        list of (filename, width, height, objects), where `objects` is a list of
+        (name, xmin, ymin, xmax, ymax)
+    folderout: string
+        path to the folder where XML files are saved
+    processes: int
+        number of processes (default: number of cpus)
+    chunk_size: int
+        number of images written by each task
+    """
+    if not exists(folderout):
+        os.makedirs(folderout)
+    jobs = [(folderout, images[i:i+chunk_size]) for i in range(0, len(images), chunk_size)]
+    if processes != 1 and len(jobs) > 1:
+        pool = Pool(processes)
+        nb_files = sum(pool.imap_unordered(_write_voc_chunk, jobs))
+        pool.close()
+        pool.join()
+    else:
+        nb_files = sum(map(_write_voc_chunk, jobs))
+    return nb_files
+
+
+def read_voc(xml_file):
+    """ Read a VOC XML file incrementally.
+
+    Returns:
+    --------
+    (path, width, height, names, boxes), where `path` is the path (or filename) of
+    the image and `boxes` is an array (nb_objects, 4) with [xmin, ymin, xmax, ymax]
+    """
+    filename, path, width, height = '', '', 0, 0
+    names, boxes = [], []
+    for _, elem in ET.iterparse(xml_file):
+        if elem.tag == 'filename':
+            filename = elem.text
+        elif elem.tag == 'path':
+            path = elem.text
+        elif elem.tag == 'size':
+            width, height = int(elem.findtext('width')), int(elem.findtext('height'))
+        elif elem.tag == 'object':
+            names.append(elem.findtext('name'))
+            boxes.append([int(float(elem.findtext('bndbox/'+key))) for key in ['xmin', 'ymin', 'xmax', 'ymax']])
+            elem.clear()
+    return path or filename, width, height, names, np.array(boxes, dtype=np.int64).reshape((-1, 4))
+
+
+def _read_voc_chunk(files):
+    """ Read a chunk of XML files (see `read_voc_files`) """
+    return [read_voc(xml_file) for xml_file in files]
+
+
+def read_voc_files(files, processes=None, chunk_size=500):
+    """ Read a list of VOC XML files using a pool of processes, returning the list
+        of (path, width, height, names, boxes) of each file (see `read_voc`)
+    """
+    jobs = [files[i:i+chunk_size] for i in range(0, len(files), chunk_size)]
+    images = []
+    if processes != 1 and len(jobs) > 1:
+        pool = Pool(processes)
+        for chunk in pool.imap(_read_voc_chunk, jobs):
+            images.extend(chunk)
+        pool.close()
+        pool.join()
+    else:
+        for chunk in map(_read_voc_chunk, jobs):
+            images.extend(chunk)
+    return images
@@ -0,0 +1,142 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+"""
+Predict relations between the objects detected in each frame using only the language prior
+(`so_prior.pkl`), as a baseline for VRD-DSR. For every ordered pair (subject, object) of the
+proposals of a frame (see `create_proposal.py`) and every relation, the score is:
+
+    score = conf(subject) * conf(object) * p(relation | subject, object)
+
+Pairs of all frames of a chunk are scored at once by gathering the rows of `so_prior` of
+the pairs. The `top_k` relations with higher score of each frame (above `threshold`) are
+saved as a Decompressed file, which can be used by `run_recognizer.py`:
+
+    0\tperson\tholding\tshell_egg
+    0\tshell_egg\ton\tbowl
+    1\tperson\tholding\tshell_egg
+
+Class ids of the proposals contain the background (id=0), while `so_prior` does not.
+"""
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+import argparse
+from os.path import join, dirname
+
+import filehandler as fh
+import numpy as np
+import cPickle
+
+
+def frame_pairs(sizes):
+    """ Return (image, i, j) of all ordered pairs i != j of the rows of each image.
+
+    Example:
+    --------
+    >>> frame_pairs([2, 1, 3])
+        (array([0, 0, 2, 2, 2, 2, 2, 2]), array([0, 1, 0, 0, 1, 1, 2, 2]), array([1, 0, 1, 2, 0, 2, 0, 1]))
+    """
+    sizes = np.asarray(sizes, dtype=np.int64)
+    nb_pairs = sizes * sizes
+    image = np.repeat(np.arange(len(sizes)), nb_pairs)
+    pos = np.arange(nb_pairs.sum()) - np.repeat(np.cumsum(nb_pairs) - nb_pairs, nb_pairs)
+    i, j = pos // sizes[image], pos % sizes[image]
+    keep = i != j
+    return image[keep], i[keep], j[keep]
+
+
+def score_chunk(store, so_prior, start, end, top_k=10, threshold=0.0):
+    """ Score the relations of all pairs of proposals of the images `start:end`.
+
+    Parameters:
+    -----------
+    store: FlatStore
+        proposals containing `frames`, `confs` and `cls`
+    so_prior: array
+        p(relation|subject, object) with shape (nb_objects, nb_objects, nb_relations)
+    start, end: int
+        range of images of the chunk
+    top_k: int
+        maximum number of relations of each frame
+    threshold: float
+        minimum score of a relation
+
+    Returns:
+    --------
+    arrays (frames, subjects, relations, objects, scores) sorted by frame and relation
+    """
+    first, last = store.offsets[start], store.offsets[end]
+    offsets = store.offsets[start:end+1] - first
+    frames = np.asarray(store['frames'][first:last])[offsets[:-1]]
+    confs = np.asarray(store['confs'][first:last], dtype=np.float64)
+    cls = np.asarray(store['cls'][first:last], dtype=np.int64) - 1
+    nb_objects, _, nb_relations = so_prior.shape
+
+    image, i, j = frame_pairs(np.diff(offsets))
+    sub, obj = offsets[image] + i, offsets[image] + j
+    valid = (cls[sub] >= 0) & (cls[sub] < nb_objects) & (cls[obj] >= 0) & (cls[obj] < nb_objects)
+    image, sub, obj = image[valid], sub[valid], obj[valid]
+
+    # (nb_pairs, nb_relations) scores in a single operation
+    scores = (confs[sub] * confs[obj])[:, np.newaxis] * so_prior[cls[sub], cls[obj]]
+    pair, rel = np.nonzero(scores > threshold)
+    scores = scores[pair, rel]
+    image, subs, objs = image[pair], cls[sub[pair]], cls[obj[pair]]
+
+    # keep the highest score of repeated relations (boxes of the same class)
+    key = ((image * nb_objects + subs) * nb_relations + rel) * nb_objects + objs
+    order = np.lexsort((-scores, key))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = key[order][1:] != key[order][:-1]
+    order = order[first]
+
+    # top_k relations of each frame (ties keep the lower ids of subject, relation and object)
+    order = order[np.lexsort((-scores[order], image[order]))]
+    rank = np.arange(len(order)) - np.searchsorted(image[order], image[order])
+    order = order[rank < top_k]
+    order = order[np.argsort(key[order], kind='mergesort')]
+    return frames[image[order]], subs[order], rel[order], objs[order], scores[order]
+
+
+def predict(inputfolder, prior_file, output=None, class_file='classes.cfg', rels_file='relations.cfg',
+            top_k=10, threshold=0.0, chunk_size=1000):
+    """
+    Predict relations of the proposals in `inputfolder` using `so_prior` and save them
+    as a Decompressed file.
+    """
+    if not output:
+        output = join(dirname(inputfolder.rstrip('/')), 'relations_prior.txt')
+    do = fh.ConfigFile(class_file, background=False).load_classes()
+    logger.info('Loaded dictionary with {} objects.'.format(len(do)))
+    dr = fh.ConfigFile(rels_file).load_classes()
+    logger.info('Loaded dictionary with {} relations.'.format(len(dr)))
+    with open(prior_file, 'rb') as fin:
+        so_prior = np.asarray(cPickle.load(fin), dtype=np.float64)
+    store = fh.FlatStore(inputfolder)
+    logger.info('Predicting relations of {} frames.'.format(len(store)))
+
+    nb_relations = 0
+    with open(output, 'w') as fout:
+        for start in range(0, len(store), chunk_size):
+            end = min(start+chunk_size, len(store))
+            for fr, s, r, o, _ in zip(*score_chunk(store, so_prior, start, end, top_k, threshold)):
+                fout.write('{}\t{}\t{}\t{}\n'.format(fr, do[s], dr[r], do[o]))
+                nb_relations += 1
+    logger.info('Saved {} relations in file: {}'.format(nb_relations, output))
+    return output
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inputfolder', metavar='proposal_folder', help='Path to the folder containing proposals.')
+    parser.add_argument('prior', metavar='so_prior', help='Path to the `so_prior.pkl` file.')
+    parser.add_argument('-o', '--output', help='Path to the Decompressed file to save the relations.')
+    parser.add_argument('-c', '--class_file', help='File containing ids and their classes', default='classes.cfg')
+    parser.add_argument('-r', '--relation_file', help='File containing ids and their relations', default='relations.cfg')
+    parser.add_argument('-k', '--top_k', help='Maximum number of relations of each frame', type=int, default=10)
+    parser.add_argument('-t', '--threshold', help='Minimum score of a relation', type=float, default=0.0)
+    parser.add_argument('-n', '--chunk_size', help='Number of frames scored at once', type=int, default=1000)
+    args = parser.parse_args()
+
+    predict(args.inputfolder, args.prior, args.output, args.class_file, args.relation_file,
+            args.top_k, args.threshold, args.chunk_size)
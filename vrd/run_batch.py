@@ -0,0 +1,105 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+"""
+This script runs a list of VRD jobs in a single process, avoiding to start the interpreter,
+import numpy and load `classes.cfg`, `relations.cfg` and `map_paths.txt` for each job. Each
+line of the input file is a JSON object naming the script, the function and its arguments, e.g.:
+
+{"script": "create_so_prior", "function": "main", "args": ["data1/boild-egg.txt"]}
+{"script": "create_gt", "function": "create_gt_pickle", "args": ["data1/boild-egg.lis", "data1/boild-egg.txt"]}
+{"script": "create_pickle", "function": "main", "args": ["data1/boild-egg.lis", "data1/boild-egg.txt"], "kwargs": {"map_paths": "map_paths.txt"}}
+
+Configuration and map files read by `filehandler` are parsed once and shared by all jobs.
+The output file contains one JSON object per job with its status and elapsed time in seconds.
+"""
+import sys
+import json
+import time
+import argparse
+import importlib
+import traceback
+from os.path import join, dirname
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+
+def load_jobs(inputfile):
+    """ Load the list of jobs from a file containing a JSON object per line """
+    jobs = []
+    with open(inputfile) as fin:
+        for i, line in enumerate(fin):
+            line = line.strip()
+            if not line or line.startswith('#'): continue
+            try:
+                job = json.loads(line)
+            except ValueError:
+                logger.error('Malformed line in input file! [LINE: {}]'.format(i))
+                sys.exit()
+            if 'script' not in job or 'function' not in job:
+                logger.error('Job must have `script` and `function` keys! [LINE: {}]'.format(i))
+                sys.exit()
+            jobs.append(job)
+    return jobs
+
+
+def run_job(job):
+    """ Run a single job returning a dictionary with its status and elapsed time.
+
+    Parameters:
+    -----------
+    job: dict
+        dictionary with keys `script`, `function` and optional `args` and `kwargs`
+    """
+    result = dict(job)
+    start = time.time()
+    try:
+        module = importlib.import_module(job['script'])
+        function = getattr(module, job['function'])
+        function(*job.get('args', []), **job.get('kwargs', {}))
+        result['status'] = 'ok'
+    except (Exception, SystemExit) as error:
+        logger.error('Job {}.{} failed: {}'.format(job['script'], job['function'], repr(error)))
+        logger.debug(traceback.format_exc())
+        result['status'] = 'error'
+        result['error'] = repr(error)
+    result['seconds'] = round(time.time() - start, 4)
+    return result
+
+
+def run_batch(inputfile, output=None):
+    """ Run all jobs of `inputfile` in the current process.
+
+    Parameters:
+    -----------
+    inputfile: string
+        path to the file containing a job per line
+    output: string
+        path to the file where the status and time of each job are saved
+    """
+    if not output:
+        output = join(dirname(inputfile), 'batch_results.jsonl')
+
+    jobs = load_jobs(inputfile)
+    logger.info('Running {} jobs from: {}'.format(len(jobs), inputfile))
+    start = time.time()
+    nb_errors = 0
+    with open(output, 'w') as fout:
+        for i, job in enumerate(jobs):
+            result = run_job(job)
+            if result['status'] != 'ok':
+                nb_errors += 1
+            logger.info('Job {}/{} {}.{}: {} ({:.4f}s)'.format(i+1, len(jobs), job['script'], job['function'], result['status'], result['seconds']))
+            fout.write('{}\n'.format(json.dumps(result)))
+            fout.flush()
+    logger.info('Finished {} jobs ({} errors) in {:.2f}s'.format(len(jobs), nb_errors, time.time() - start))
+    logger.info('Saved job results in: {}'.format(output))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', metavar='jobs_file', help='File containing a JSON job per line')
+    parser.add_argument('-o', '--output', help='File to save the status and time of each job', default=None)
+    args = parser.parse_args()
+
+    run_batch(args.input, args.output)
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+"""
+Keep a persistent store with the raw counts of (subject, object, predicate) and the files
+already counted, regenerating `so_prior.pkl` from the counts. Only new or changed files
+(by modification time and size) are counted when the store is updated. Files that were
+counted before and no longer exist in the input folder are subtracted from the store.
+
+The store is a pickle file containing the following keys:
+
+'classes': list of objects sorted by id
+'relations': list of relations sorted by id
+'counts': array with shape (nb_objects, nb_objects, nb_relations) with the number of relations
+'files': dictionary {path: (signature, index, values)} where `index` and `values` are the
+    nonzero positions and counts of the flattened `counts` of the file
+
+Concurrent updates of the same store are serialized with a lock file (`<store>.lock`) and
+the store and `so_prior.pkl` are replaced atomically while the lock is held.
+"""
+import logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+import os
+import sys
+import fcntl
+import argparse
+import operator
+from os.path import join, dirname, exists, realpath, isdir
+from multiprocessing import Pool
+
+import filehandler as fh
+import numpy as np
+import cPickle
+
+from create_so_prior import count_file, normalize
+
+
+def signature(path):
+    """ Return (modification time, size) of a file, with the time in nanoseconds when available """
+    st = os.stat(path)
+    return getattr(st, 'st_mtime_ns', st.st_mtime), st.st_size
+
+
+class CountStore(object):
+    """ Persistent counts of (subject, object, relation) with the files already counted.
+        The store must be used as a context manager, which holds the lock of the store:
+
+        >>> with CountStore('so_counts.pkl', do, dr) as store:
+        ...     store.update(files)
+        ...     store.save()
+    """
+    def __init__(self, storefile, do, dr):
+        self.storefile = storefile
+        self.classes = [k for k, _ in sorted(do.items(), key=operator.itemgetter(1))]
+        self.relations = [k for k, _ in sorted(dr.items(), key=operator.itemgetter(1))]
+        self.do = do
+        self.dr = dr
+        self.counts = None
+        self.files = {}
+
+    def __enter__(self):
+        self.flock = open(self.storefile+'.lock', 'a')
+        fcntl.flock(self.flock.fileno(), fcntl.LOCK_EX)
+        self._load()
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.flock.fileno(), fcntl.LOCK_UN)
+        self.flock.close()
+
+    def _load(self):
+        shape = (len(self.classes), len(self.classes), len(self.relations))
+        self.counts = np.zeros(shape, dtype=np.int64)
+        self.files = {}
+        if not exists(self.storefile):
+            return
+        with open(self.storefile, 'rb') as fin:
+            store = cPickle.load(fin)
+        if store['classes'] != self.classes or store['relations'] != self.relations:
+            logger.error('Classes or relations differ from the ones in the store: {}'.format(self.storefile))
+            sys.exit()
+        self.counts = store['counts']
+        self.files = store['files']
+        logger.info('Loaded store with {} files.'.format(len(self.files)))
+
+    def _add(self, path, sign, counts):
+        index = np.flatnonzero(counts)
+        values = counts.flat[index]
+        self.counts.flat[index] += values
+        self.files[path] = (sign, index, values)
+
+    def remove(self, path):
+        """ Subtract the counts of a file from the store """
+        _, index, values = self.files.pop(path)
+        self.counts.flat[index] -= values
+
+    def update(self, inputs, processes=None):
+        """ Count the new and changed files of `inputs`, returning the number of counted files """
+        changed = []
+        for path in inputs:
+            path = realpath(path)
+            sign = signature(path)
+            if path not in self.files or self.files[path][0] != sign:
+                changed.append((path, sign))
+        logger.info('Counting {} new or changed files out of {}.'.format(len(changed), len(inputs)))
+        if not changed:
+            return 0
+
+        jobs = [(path, self.do, self.dr) for path, _ in changed]
+        pool = None
+        if processes != 1 and len(jobs) > 1:
+            pool = Pool(processes)
+            results = pool.imap(count_file, jobs)
+        else:
+            results = map(count_file, jobs)
+        for (path, sign), (counts, _) in zip(changed, results):
+            if path in self.files:
+                self.remove(path)
+            self._add(path, sign, counts)
+        if pool:
+            pool.close()
+            pool.join()
+        return len(changed)
+
+    def prune(self, folder, inputs):
+        """ Remove files of `folder` in the store that are not in `inputs` """
+        folder = realpath(folder)+os.sep
+        inputs = set(realpath(path) for path in inputs)
+        removed = [path for path in self.files if path.startswith(folder) and path not in inputs]
+        for path in removed:
+            self.remove(path)
+        return len(removed)
+
+    def save(self):
+        """ Replace the store atomically """
+        store = {'classes': self.classes, 'relations': self.relations,
+                 'counts': self.counts, 'files': self.files}
+        ftmp = '{}.{}.tmp'.format(self.storefile, os.getpid())
+        with open(ftmp, 'wb') as fout:
+            cPickle.dump(store, fout, cPickle.HIGHEST_PROTOCOL)
+        os.rename(ftmp, self.storefile)
+        logger.info('Saved store with {} files in: {}'.format(len(self.files), self.storefile))
+
+    def so_prior(self):
+        """ Return p(relation|subject, object) from the counts """
+        return normalize(self.counts.astype('float64'))
+
+    def save_so_prior(self, output):
+        """ Replace `output` atomically with p(relation|subject, object) """
+        ftmp = '{}.{}.tmp'.format(output, os.getpid())
+        with open(ftmp, 'wb') as fout:
+            cPickle.dump(self.so_prior(), fout, cPickle.HIGHEST_PROTOCOL)
+        os.rename(ftmp, output)
+        logger.info('Saved content in file: {}'.format(output))
+# End of CountStore class
+
+
+def main(inputfile, store=None, output=None, class_file='classes.cfg', rels_file='relations.cfg', processes=None):
+    """
+    Update the store of counts with the relations of `inputfile` (file or folder) and
+    regenerate `so_prior.pkl`.
+    """
+    folder = inputfile if isdir(inputfile) else dirname(inputfile)
+    if not store:
+        store = join(folder, 'so_counts.pkl')
+    if not output:
+        output = join(folder, 'so_prior.pkl')
+
+    do = fh.ConfigFile(class_file, background=False).load_classes(cnames=True)
+    logger.info('Loaded dictionary with {} objects.'.format(len(do)))
+    dr = fh.ConfigFile(rels_file).load_classes(cnames=True)
+    logger.info('Loaded dictionary with {} relations.'.format(len(dr)))
+
+    if isdir(inputfile):
+        inputs = list(fh.FolderHandler(inputfile))
+    else:
+        inputs = [inputfile]
+
+    with CountStore(store, do, dr) as cstore:
+        nb_changed = cstore.update(inputs, processes)
+        if isdir(inputfile):
+            nb_changed += cstore.prune(inputfile, inputs)
+        if nb_changed:
+            cstore.save()
+        cstore.save_so_prior(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inputfile', metavar='relations_file', help='Path to the file (or folder of files) containing relations between objects.')
+    parser.add_argument('-s', '--store', help='Path to the store of counts (default: so_counts.pkl in the input folder).')
+    parser.add_argument('-o', '--output', help='Path to the file to save the conditional probabilities.')
+    parser.add_argument('-c', '--class_file', help='File containing ids and their classes', default='classes.cfg')
+    parser.add_argument('-r', '--relation_file', help='File containing ids and their relations', default='relations.cfg')
+    parser.add_argument('-p', '--processes', help='Number of processes', type=int, default=None)
+    args = parser.parse_args()
+
+    main(args.inputfile, args.store, args.output, args.class_file, args.relation_file, args.processes)